@@ -0,0 +1,149 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from spacy.kb import InMemoryLookupKB
+
+
+class AliasEntityTable:
+    """A CSR table mapping each KnowledgeBase alias to its entities,
+    prior probabilities and entity label ids. It's built once from a
+    InMemoryLookupKB so candidate expansion for a batch of aliases is a
+    couple of numpy gathers instead of a `kb.get_alias_candidates` call
+    per alias.
+    """
+
+    def __init__(
+        self,
+        aliases: List[str],
+        indptr: np.ndarray,
+        entity_ids: np.ndarray,
+        priors: np.ndarray,
+        entities: List[str],
+        entity_labels: np.ndarray,
+        labels: List[str],
+        kb: Optional[InMemoryLookupKB] = None,
+    ):
+        """Initialize an AliasEntityTable
+
+        aliases (List[str]): Alias of each row
+        indptr (np.ndarray): Row offsets into `entity_ids` and `priors`
+        entity_ids (np.ndarray): Entity index of each alias entity
+        priors (np.ndarray): Prior probability of each alias entity
+        entities (List[str]): KnowledgeBase entity ids
+        entity_labels (np.ndarray): Label id of each entity
+        labels (List[str]): Sorted labels so label ids compare like label strings
+        kb (Optional[InMemoryLookupKB]): KnowledgeBase to read entity vectors from
+        """
+        self.aliases = aliases
+        self.alias_rows = {alias: i for i, alias in enumerate(aliases)}
+        self.indptr = indptr
+        self.entity_ids = entity_ids
+        self.priors = priors
+        self.entities = entities
+        self.entity_labels = entity_labels
+        self.labels = labels
+        self.label_ids = {label: i for i, label in enumerate(labels)}
+        self.kb = kb
+        self.entity_vectors: Optional[np.ndarray] = None
+
+    @classmethod
+    def from_kb(
+        cls, kb: InMemoryLookupKB, ent_label_map: Dict[str, str]
+    ) -> "AliasEntityTable":
+        """Build the table from a KnowledgeBase
+
+        kb (InMemoryLookupKB): KnowledgeBase with entities and aliases
+        ent_label_map (Dict[str, str]): Label of each entity
+
+        RETURNS (AliasEntityTable): Table covering every alias in the kb
+        """
+        aliases = kb.get_alias_strings()
+        entities = kb.get_entity_strings()
+        entity_index = {entity: i for i, entity in enumerate(entities)}
+
+        indptr = np.zeros(len(aliases) + 1, dtype=np.int64)
+        entity_ids = []
+        priors = []
+        for i, alias in enumerate(aliases):
+            for candidate in kb.get_alias_candidates(alias):
+                entity_ids.append(entity_index[candidate.entity_])
+                priors.append(candidate.prior_prob)
+            indptr[i + 1] = len(entity_ids)
+
+        labels = sorted(set(ent_label_map.values()) | {""})
+        label_ids = {label: i for i, label in enumerate(labels)}
+        entity_labels = np.array(
+            [label_ids[ent_label_map.get(entity, "")] for entity in entities],
+            dtype=np.int32,
+        )
+        return cls(
+            aliases,
+            indptr,
+            np.array(entity_ids, dtype=np.int32),
+            np.array(priors, dtype=np.float32),
+            entities,
+            entity_labels,
+            labels,
+            kb=kb,
+        )
+
+    def get_entity_vectors(self) -> np.ndarray:
+        """Entity vectors of the kb, gathered on first use
+
+        RETURNS (np.ndarray): `(n_entities, entity_vector_length)` matrix
+        """
+        if self.entity_vectors is None:
+            self.entity_vectors = np.asarray(
+                [self.kb.get_vector(entity) for entity in self.entities],
+                dtype=np.float32,
+            ).reshape(len(self.entities), -1)
+        return self.entity_vectors
+
+    def expand(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Expand alias rows to all of their entities
+
+        rows (np.ndarray): Alias row of each input position
+
+        RETURNS (Tuple[np.ndarray, np.ndarray]): Input position and entity index
+            of every expanded candidate, grouped by input position
+        """
+        starts = self.indptr[rows]
+        counts = self.indptr[rows + 1] - starts
+        sources = np.repeat(np.arange(len(rows)), counts)
+        group_starts = np.repeat(np.cumsum(counts) - counts, counts)
+        positions = np.repeat(starts, counts) + np.arange(counts.sum()) - group_starts
+        return sources, self.entity_ids[positions]
+
+
+def rank_entities(
+    segments: np.ndarray,
+    entity_ids: np.ndarray,
+    similarities: np.ndarray,
+    labels: np.ndarray,
+    n_segments: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Keep the best candidate of each entity per segment (mention) and rank
+    the candidates of each segment by similarity, then label.
+    Ties keep their input order.
+
+    segments (np.ndarray): Segment of each candidate
+    entity_ids (np.ndarray): Entity index of each candidate
+    similarities (np.ndarray): Similarity of each candidate
+    labels (np.ndarray): Label id of each candidate
+    n_segments (int): Number of segments
+
+    RETURNS (Tuple[np.ndarray, np.ndarray]): Positions of the kept candidates in
+        ranked order and the `n_segments + 1` offsets of each segment in them
+    """
+    order = np.lexsort(
+        (np.arange(len(segments)), -labels, -similarities, segments)
+    )
+    keys = segments[order].astype(np.int64) * (int(entity_ids.max(initial=0)) + 1)
+    keys += entity_ids[order]
+    _, first = np.unique(keys, return_index=True)
+    order = order[np.sort(first)]
+    offsets = np.searchsorted(segments[order], np.arange(n_segments + 1))
+    return order, offsets
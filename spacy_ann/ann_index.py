@@ -0,0 +1,44 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import scipy
+from nmslib.dist import FloatIndex
+
+
+class AnnIndex(ABC):
+    """Index of the alias vectors queried by the CandidateGenerator, the subset
+    of the nmslib `FloatIndex` interface it uses. Indexes built by an
+    `AnnBackend` implement it, nmslib indexes are registered as virtual subclasses.
+    """
+
+    @abstractmethod
+    def __len__(self) -> int:
+        """Number of indexed vectors"""
+
+    @abstractmethod
+    def knnQueryBatch(
+        self, vectors: scipy.sparse.csr_matrix, k: int = 10, num_threads: int = 0
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """k nearest neighbors of each vector
+
+        vectors (scipy.sparse.csr_matrix): Non-empty L2 normalized query vectors
+        k (int): Number of neighbors
+        num_threads (int): Query threads, 0 uses all cores
+
+        RETURNS (List[Tuple[np.ndarray, np.ndarray]]): int32 neighbors and cosine
+            distances of each vector, nearest first
+        """
+
+    def setQueryTimeParams(self, params: Dict[str, Any]):
+        """Set query time params like `{"efSearch": 200}`. Indexes without
+        query time params ignore them.
+
+        params (Dict[str, Any]): Query time params
+        """
+
+
+AnnIndex.register(FloatIndex)
@@ -1,18 +1,18 @@
 from pathlib import Path
 from timeit import default_timer as timer
-from typing import List, Set, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import joblib
-import nmslib
 import numpy as np
 import scipy
 import srsly
-from nmslib.dist import FloatIndex
 from sklearn.feature_extraction.text import TfidfVectorizer
 from spacy.kb import InMemoryLookupKB
 from spacy.util import ensure_path
 from spacy.vocab import Vocab
-from spacy_ann.types import AliasCandidate
+from spacy_ann.backends import AnnIndex, get_backend
+from spacy_ann.char_vectorizer import make_query_vectorizer
+from spacy_ann.util import knn_to_alias_candidates
 from wasabi import Printer
 
 
@@ -26,6 +26,8 @@ class AnnKnowledgeBase(InMemoryLookupKB):
         ef_search: int = 200,
         ef_construction: int = 2000,
         n_threads: int = 60,
+        backend: str = "nmslib",
+        backend_params: Optional[Dict[str, Any]] = None,
     ):
         """Initialize a CandidateGenerator
 
@@ -37,6 +39,8 @@ class AnnKnowledgeBase(InMemoryLookupKB):
             Improves recall at the expense of longer **indexing** time
         n_threads (int): Number of threads to use when creating the index.
             Change based on your machine.
+        backend (str): Registered AnnBackend building the index, see `spacy_ann.backends`
+        backend_params (Optional[Dict[str, Any]]): Backend specific params
         """
         super().__init__(vocab, entity_vector_length)
         self.k = k
@@ -44,13 +48,15 @@ class AnnKnowledgeBase(InMemoryLookupKB):
         self.ef_search = ef_search
         self.ef_construction = ef_construction
         self.n_threads = n_threads
+        self.backend = backend
+        self.backend_params = dict(backend_params or {})
         self.ann_index = None
 
     def _initialize(
         self,
         aliases: List[str],
         short_aliases: Set[str],
-        ann_index: FloatIndex,
+        ann_index: AnnIndex,
         vectorizer: TfidfVectorizer,
         alias_tfidfs: scipy.sparse.csr_matrix,
     ):
@@ -59,7 +65,7 @@ class AnnKnowledgeBase(InMemoryLookupKB):
 
         aliases (List[str]): Aliases with vectors contained in the ANN Index
         short_aliases (Set[str]): Aliases too short for a TF-IDF representation
-        ann_index (FloatIndex): Computed ANN Index of TF-IDF representations for aliases
+        ann_index (AnnIndex): Computed ANN Index of TF-IDF representations for aliases
         vectorizer (TfidfVectorizer): TF-IDF Vectorizer to get vector representation of aliases
         alias_tfidfs (scipy.sparse.csr_matrix): Computed TF-IDF Sparse Vectors for aliases
         """
@@ -67,6 +73,7 @@ class AnnKnowledgeBase(InMemoryLookupKB):
         self.short_aliases = short_aliases
         self.ann_index = ann_index
         self.vectorizer = vectorizer
+        self._query_vectorizer = make_query_vectorizer(vectorizer)
         self.alias_tfidfs = alias_tfidfs
 
     def fit_index(self, verbose: bool = True):
@@ -75,18 +82,11 @@ class AnnKnowledgeBase(InMemoryLookupKB):
         kb_aliases = self.get_alias_strings()
         short_aliases = set([a for a in kb_aliases if len(a) < 4])
 
-        # nmslib hyperparameters (very important)
-        # guide: https://github.com/nmslib/nmslib/blob/master/python_bindings/parameters.md
-        # m_parameter = 100
-        # # `C` for Construction. Set to the maximum recommended value
-        # # Improves recall at the expense of longer indexing time
-        # construction = 2000
-        # num_threads = 60  # set based on the machine
         index_params = {
-            "M": self.m_parameter,
-            "indexThreadQty": self.n_threads,
-            "efConstruction": self.ef_construction,
-            "post": 0,
+            "m_parameter": self.m_parameter,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "n_threads": self.n_threads,
         }
 
         # NOTE: here we are creating the tf-idf vectorizer with float32 type, but we can serialize the
@@ -126,15 +126,8 @@ class AnnKnowledgeBase(InMemoryLookupKB):
 
         msg.text(f"Fitting ann index on {len(aliases)} aliases")
         start_time = timer()
-        ann_index = nmslib.init(
-            method="hnsw",
-            space="cosinesimil_sparse",
-            data_type=nmslib.DataType.SPARSE_VECTOR,
-        )
-        ann_index.addDataPointBatch(alias_tfidfs)
-        ann_index.createIndex(index_params, print_progress=verbose)
-        query_time_params = {"efSearch": self.ef_search}
-        ann_index.setQueryTimeParams(query_time_params)
+        backend = get_backend(self.backend, **self.backend_params)
+        ann_index = backend.build(alias_tfidfs, index_params, verbose=verbose)
         end_time = timer()
         total_time = end_time - start_time
         msg.text(f"Fitting ann index took {round(total_time)} seconds")
@@ -145,60 +138,45 @@ class AnnKnowledgeBase(InMemoryLookupKB):
         return self
 
     def _nmslib_knn_with_zero_vectors(
-        self, vectors: np.ndarray, k: int
-    ) -> Tuple[np.ndarray, np.ndarray]:
+        self, vectors: scipy.sparse.csr_matrix, k: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """ann_index.knnQueryBatch crashes if any of the vectors is all zeros.
         This function is a wrapper around `ann_index.knnQueryBatch` that solves this problem. It works as follows:
         - remove empty vectors from `vectors`.
-        - call `ann_index.knnQueryBatch` with the non-empty vectors only. This returns `neighbors`,
-        a list of list of neighbors. `len(neighbors)` equals the length of the non-empty vectors.
-        - extend the list `neighbors` with `None`s in place of empty vectors.
-        - return the extended list of neighbors and distances.
+        - call `ann_index.knnQueryBatch` with the non-empty vectors only.
+        - scatter the results into dense `(n, k)` arrays. Rows of empty vectors and
+        positions past the number of neighbors found are marked invalid in `mask`.
 
-        vectors (np.ndarray): Vectors used to query index for neighbors and distances
+        vectors (scipy.sparse.csr_matrix): Vectors used to query index for neighbors and similarities
         k (int): k neighbors to consider
 
-        RETURNS (Tuple[np.ndarray, np.ndarray]): Tuple of [neighbors, distances]
+        RETURNS (Tuple[np.ndarray, np.ndarray, np.ndarray]): Tuple of int32 neighbors,
+            float32 similarities and a boolean validity mask, all of shape `(n, k)`
         """
+        n_vectors = vectors.shape[0]
+        neighbors = np.zeros((n_vectors, k), dtype=np.int32)
+        similarities = np.zeros((n_vectors, k), dtype=np.float32)
+        mask = np.zeros((n_vectors, k), dtype=bool)
 
-        empty_vectors_boolean_flags = np.array(
-            vectors.sum(axis=1) != 0).reshape(-1,)
-        empty_vectors_count = vectors.shape[0] - \
-            sum(empty_vectors_boolean_flags)
-
-        # init extended_neighbors with a list of Nones
-        extended_neighbors = np.empty(
-            (len(empty_vectors_boolean_flags),), dtype=object)
-        extended_distances = np.empty(
-            (len(empty_vectors_boolean_flags),), dtype=object)
-
-        if vectors.shape[0] - empty_vectors_count == 0:
-            return extended_neighbors, extended_distances
+        non_empty_rows = np.flatnonzero(np.asarray(vectors.sum(axis=1)).reshape(-1) != 0)
+        if len(non_empty_rows) == 0:
+            return neighbors, similarities, mask
 
         # remove empty vectors before calling `ann_index.knnQueryBatch`
-        vectors = vectors[empty_vectors_boolean_flags]
+        results = self.ann_index.knnQueryBatch(vectors[non_empty_rows], k=k)
 
-        # call `knnQueryBatch` to get neighbors
-        original_neighbours = self.ann_index.knnQueryBatch(vectors, k=k)
+        if all(len(idx) == k for idx, _ in results):
+            neighbors[non_empty_rows] = np.stack([idx for idx, _ in results])
+            similarities[non_empty_rows] = 1.0 - np.stack([dist for _, dist in results])
+            mask[non_empty_rows] = True
+        else:
+            for row, (idx, dist) in zip(non_empty_rows, results):
+                n_found = len(idx)
+                neighbors[row, :n_found] = idx
+                similarities[row, :n_found] = 1.0 - dist
+                mask[row, :n_found] = True
 
-        neighbors, distances = zip(
-            *[(x[0].tolist(), x[1].tolist()) for x in original_neighbours]
-        )
-        neighbors = list(neighbors)
-        distances = list(distances)
-
-        # neighbors need to be converted to an np.array of objects instead of ndarray of dimensions len(vectors)xk
-        # Solution: add a row to `neighbors` with any length other than k. This way, calling np.array(neighbors)
-        # returns an np.array of objects
-        neighbors.append([])
-        distances.append([])
-        # interleave `neighbors` and Nones in `extended_neighbors`
-        extended_neighbors[empty_vectors_boolean_flags] = np.array(
-            neighbors, dtype=object)[:-1]
-        extended_distances[empty_vectors_boolean_flags] = np.array(
-            distances, dtype=object)[:-1]
-
-        return extended_neighbors, extended_distances
+        return neighbors, similarities, mask
 
     def require_ann_index(self):
         """Raise an error if the ann_index is not initialized
@@ -213,42 +191,22 @@ class AnnKnowledgeBase(InMemoryLookupKB):
     def get_alias_candidates(self, mention_texts: List[str]):
         self.require_ann_index()
 
-        tfidfs = self.vectorizer.transform(mention_texts)
+        tfidfs = self._query_vectorizer.transform(mention_texts)
         start_time = timer()
 
         # `ann_index.knnQueryBatch` crashes if one of the vectors is all zeros.
         # `nmslib_knn_with_zero_vectors` is a wrapper around `ann_index.knnQueryBatch`
         # that addresses this issue.
-        batch_neighbors, batch_distances = self._nmslib_knn_with_zero_vectors(
+        neighbors, similarities, mask = self._nmslib_knn_with_zero_vectors(
             tfidfs, self.k
         )
         end_time = timer()
         end_time - start_time
 
-        batch_candidates = []
-        for mention, neighbors, distances in zip(
-            mention_texts, batch_neighbors, batch_distances
-        ):
-            if mention in self.short_aliases:
-                batch_candidates.append(
-                    [AliasCandidate(alias=mention, similarity=1.0)])
-                continue
-            if neighbors is None:
-                neighbors = []
-            if distances is None:
-                distances = []
-
-            alias_candidates: List[AliasCandidate] = []
-            for neighbor_index, distance in zip(neighbors, distances):
-                alias = self.aliases[neighbor_index]
-                similarity = 1.0 - distance
-                alias_candidates.append(
-                    AliasCandidate(alias=alias, similarity=similarity)
-                )
-
-            batch_candidates.append(alias_candidates)
-
-        return batch_candidates
+        return knn_to_alias_candidates(
+            mention_texts, self.aliases, self.short_aliases,
+            neighbors, similarities, mask
+        )
 
     def get_candidates(self, alias: str):
         """
@@ -278,6 +236,8 @@ class AnnKnowledgeBase(InMemoryLookupKB):
             "ef_search": self.ef_search,
             "ef_construction": self.ef_construction,
             "n_threads": self.n_threads,
+            "backend": self.backend,
+            "backend_params": self.backend_params,
         }
 
         cg_cfg_path = path / "cg_cfg"
@@ -287,11 +247,12 @@ class AnnKnowledgeBase(InMemoryLookupKB):
         tfidf_vectorizer_path = path / "tfidf_vectorizer.joblib"
         tfidf_vectors_path = path / "tfidf_vectors_sparse.npz"
 
+        backend = get_backend(self.backend, **self.backend_params)
+        cfg.update(backend.save(self.ann_index, ann_index_path))
         srsly.write_json(cg_cfg_path, cfg)
         srsly.write_json(aliases_path, self.aliases)
         srsly.write_json(short_aliases_path, list(self.short_aliases))
 
-        self.ann_index.saveIndex(str(ann_index_path))
         joblib.dump(self.vectorizer, tfidf_vectorizer_path)
         # 先转换为密集矩阵，再转回稀疏矩阵
         dense_matrix = self.alias_tfidfs.toarray()
@@ -317,18 +278,15 @@ class AnnKnowledgeBase(InMemoryLookupKB):
         self.ef_search = cfg.get("ef_search", 200)
         self.ef_construction = cfg.get("ef_construction", 2000)
         self.n_threads = cfg.get("n_threads", 60)
+        self.backend = cfg.get("backend", "nmslib")
+        self.backend_params = cfg.get("backend_params", {})
 
         aliases = srsly.read_json(aliases_path)
         short_aliases = set(srsly.read_json(short_aliases_path))
         tfidf_vectorizer = joblib.load(tfidf_vectorizer_path)
         alias_tfidfs = scipy.sparse.load_npz(tfidf_vectors_path)
-        ann_index = nmslib.init(
-            method="hnsw",
-            space="cosinesimil_sparse",
-            data_type=nmslib.DataType.SPARSE_VECTOR,
-        )
-        ann_index.addDataPointBatch(alias_tfidfs)
-        ann_index.loadIndex(str(ann_index_path))
+        backend = get_backend(self.backend, **self.backend_params)
+        ann_index = backend.load(ann_index_path, alias_tfidfs, cfg)
         query_time_params = {"efSearch": self.ef_search}
         ann_index.setQueryTimeParams(query_time_params)
 
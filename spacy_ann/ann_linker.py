@@ -2,20 +2,32 @@
 # Licensed under the MIT License.
 from pathlib import Path
 import re
-from typing import Callable, List, Tuple, Dict
+import shutil
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 import os.path as osp
 import itertools as it
 import numpy as np
 import srsly
 from spacy import util
+from spacy.attrs import ENT_KB_ID
 from spacy.pipeline import Pipe
 from spacy.kb import InMemoryLookupKB
 from spacy.language import Language
 from spacy.tokens import Doc, Span
+from spacy_ann.alias_table import AliasEntityTable, rank_entities
 from spacy_ann.candidate_generator import CandidateGenerator
-from spacy_ann.types import KnowledgeBaseCandidate
-from spacy_ann.util import get_spans, get_span_text
+from spacy_ann.types import AliasCandidate, KnowledgeBaseCandidate
+from spacy_ann.util import MentionNormalizer, get_spans
 from .regex_matcher_pipe import RegexMatcherPipe
+
+# components and attributes used to POS tag mentions for the noun token fallback
+TAGGING_PIPES = ("tok2vec", "transformer", "tagger", "morphologizer", "attribute_ruler")
+TAGGING_ATTRS = ("token.pos", "token.tag", "doc.tensor")
+# CandidateGenerator params partitions inherit from the global CandidateGenerator
+PARTITION_CG_PARAMS = (
+    "k", "m_parameter", "ef_search", "ef_construction", "n_threads", "n_shards",
+    "exact_match", "index_type", "backend", "backend_params",
+)
     
 
 @Language.factory(
@@ -79,6 +91,11 @@ class AnnLinker(Pipe):
         self.kb = None
         self.cg = None
         self.ent_label_map = {}
+        self.alias_table = None
+        self.partitions: Dict[str, CandidateGenerator] = {}
+        self.label_groups: Dict[str, List[str]] = {}
+        self.label_partitions: Dict[str, str] = {}
+        self.normalizer = MentionNormalizer(nlp)
         self.threshold = threshold
         self.enable_context_similarity = enable_context_similarity
         self.disambiguate = disambiguate
@@ -114,104 +131,330 @@ class AnnLinker(Pipe):
 
         RETURNS (Doc): spaCy Doc with updated annotations
         """
+        self._link_docs([doc])
+        return doc
 
-        self.require_kb()
-        self.require_cg()
+    def pipe(
+        self,
+        stream: Iterable[Doc],
+        batch_size: int = 128,
+        threshold: Optional[float] = None,
+    ) -> Iterator[Doc]:
+        """Annotate a stream of spaCy docs with candidate info.
+        Mentions of all docs in a minibatch are deduplicated and sent to
+        the CandidateGenerator in a single call.
+
+        stream (Iterable[Doc]): Stream of spaCy Docs
+        batch_size (int): Number of docs to link together
+        threshold (Optional[float]): Minimum AliasCandidate similarity for these
+            docs, defaults to `self.threshold`
+
+        RETURNS (Iterator[Doc]): Stream of spaCy Docs with updated annotations
+        """
+        for docs in util.minibatch(stream, size=batch_size):
+            self._link_docs(docs, threshold=threshold)
+            yield from docs
+
+    def _get_mentions(self, docs: List[Doc]) -> List[Tuple[List[Span], List[str]]]:
+        """Get the spans to link in a batch of docs and the strings to query the
+        CandidateGenerator with. Spans of all docs are normalized together.
+
+        docs (List[Doc]): Batch of spaCy Docs
 
+        RETURNS (List[Tuple[List[Span], List[str]]]): Mention spans and their
+            query strings for each doc
+        """
         if self.disambiguate:
-            mentions = doc.ents
-            mention_strings = [ent.text for ent in mentions]
+            batch_spans = [list(doc.ents) for doc in docs]
+            batch_strings = [[ent.text for ent in spans] for spans in batch_spans]
         else:
-            mentions = get_spans(doc)
-            mention_strings = [get_span_text(self.nlp, e) for e in mentions]
-        batch_candidates = self.cg(mention_strings)
-        
-        for ent, alias_candidates in zip(mentions, batch_candidates):
-            alias_candidates = [
-                ac for ac in alias_candidates if ac.similarity > self.threshold
-            ]
-            # match noun chunks with 100% similarity
-            if not self.disambiguate and len(alias_candidates) == 0 and \
-                    len(ent.text) > 4 and ent.label_ in ['ingredient', 'fragrance']:
-                noun_chunks = [w.text for w in self.nlp(ent.text) if w.pos_ in ['NOUN', 'PROPN'] and len(w.text)>=2]
-                if len(noun_chunks) > 0:
-                    batch_candidates = self.cg(noun_chunks)
-                    alias_candidates = []
-                    for acs in batch_candidates:
-                        for ac in acs:
-                            if ac.similarity == 1.0 and ac.alias in noun_chunks:
-                                alias_candidates.append(ac)
+            batch_spans = [get_spans(doc) for doc in docs]
+            mention_strings = self.normalizer.normalize_spans(
+                list(it.chain(*batch_spans))
+            )
+            batch_strings = []
+            start = 0
+            for spans in batch_spans:
+                batch_strings.append(mention_strings[start:start + len(spans)])
+                start += len(spans)
+        return list(zip(batch_spans, batch_strings))
+
+    def _link_docs(self, docs: List[Doc], threshold: Optional[float] = None):
+        """Link the mentions of a batch of docs. Candidate generation runs
+        once per CandidateGenerator for the unique mention strings of the whole
+        batch and the results are scattered back to the spans of each doc.
+
+        docs (List[Doc]): Batch of spaCy Docs, annotated in place
+        threshold (Optional[float]): Minimum AliasCandidate similarity,
+            defaults to `self.threshold`
+        """
+        self.require_kb()
+        self.require_cg()
+        if threshold is None:
+            threshold = self.threshold
+
+        batch_mentions = self._get_mentions(docs)
+        candidates_map = self._generate_candidates(batch_mentions)
+
+        mentions_table = self.nlp.vocab.lookups.get_table(
+            "mentions_to_alias_cand"
+        )
+        batch_alias_candidates = []
+        fallback_mentions = []
+        for doc_idx, (mentions, mention_strings) in enumerate(batch_mentions):
+            for ent, mention in zip(mentions, mention_strings):
+                partition = self.label_partitions.get(ent.label_)
+                alias_candidates = [
+                    ac for ac in candidates_map[(partition, mention)]
+                    if ac.similarity > threshold
+                ]
+                if not alias_candidates and self._needs_noun_fallback(ent):
+                    fallback_mentions.append(len(batch_alias_candidates))
+                batch_alias_candidates.append((doc_idx, ent, alias_candidates))
+
+        if fallback_mentions:
+            fallback_candidates = self._noun_fallback(
+                [batch_alias_candidates[i][1] for i in fallback_mentions]
+            )
+            for i, alias_candidates in zip(fallback_mentions, fallback_candidates):
+                doc_idx, ent, _ = batch_alias_candidates[i]
+                batch_alias_candidates[i] = (doc_idx, ent, alias_candidates)
+
+        linked_mentions = []
+        for doc_idx, ent, alias_candidates in batch_alias_candidates:
             ent._.alias_candidates = alias_candidates
+            if alias_candidates:
+                mentions_table.set(ent.text, alias_candidates[0].alias)
+                linked_mentions.append((doc_idx, ent, alias_candidates))
+
+        kb_ids = [[] for _ in docs]
+        for (doc_idx, ent, _), entity in zip(
+            linked_mentions, self._rank_kb_candidates(docs, linked_mentions)
+        ):
+            if entity:
+                kb_ids[doc_idx].append((ent, entity))
+        for doc, doc_kb_ids in zip(docs, kb_ids):
+            self._set_kb_ids(doc, doc_kb_ids)
+
+    def _generate_candidates(
+        self, batch_mentions: List[Tuple[List[Span], List[str]]]
+    ) -> Dict[Tuple[Optional[str], str], List[AliasCandidate]]:
+        """Query the CandidateGenerators once per batch. Mentions with a label of
+        a partition are sent to that partition's CandidateGenerator, all other
+        mentions to the global one, each with its unique mention strings.
+
+        batch_mentions (List[Tuple[List[Span], List[str]]]): Mention spans and
+            their query strings for each doc, see `_get_mentions`
+
+        RETURNS (Dict[Tuple[Optional[str], str], List[AliasCandidate]]): AliasCandidates
+            by partition name (None for the global CandidateGenerator) and mention string
+        """
+        partition_strings: Dict[Optional[str], Dict[str, None]] = {}
+        for mentions, mention_strings in batch_mentions:
+            for ent, mention in zip(mentions, mention_strings):
+                partition = self.label_partitions.get(ent.label_)
+                partition_strings.setdefault(partition, {})[mention] = None
+
+        candidates_map = {}
+        for partition, strings in partition_strings.items():
+            cg = self.cg if partition is None else self.partitions[partition]
+            unique_strings = list(strings)
+            for mention, candidates in zip(unique_strings, cg(unique_strings)):
+                candidates_map[(partition, mention)] = candidates
+        return candidates_map
+
+    def _set_kb_ids(self, doc: Doc, kb_ids: List[Tuple[Span, str]]):
+        """Set `ent_kb_id` for the tokens of each linked span in one
+        `Doc.from_array` call.
+
+        doc (Doc): spaCy Doc
+        kb_ids (List[Tuple[Span, str]]): Linked spans and their KnowledgeBase ids
+        """
+        if not kb_ids:
+            return
+        strings = self.nlp.vocab.strings
+        kb_id_array = doc.to_array([ENT_KB_ID])
+        for ent, entity in kb_ids:
+            kb_id_array[ent.start:ent.end] = strings.add(entity)
+        doc.from_array([ENT_KB_ID], kb_id_array)
+
+    def _needs_noun_fallback(self, ent: Span) -> bool:
+        """Whether an unmatched mention should be matched by its noun tokens
+
+        ent (Span): Mention span without AliasCandidates above the threshold
+
+        RETURNS (bool): True for long enough ingredient and fragrance mentions
+        """
+        return (
+            not self.disambiguate
+            and len(ent.text) > 4
+            and ent.label_ in ['ingredient', 'fragrance']
+        )
+
+    def _noun_fallback(self, spans: List[Span]) -> List[List[AliasCandidate]]:
+        """Match noun tokens of unmatched mentions with 100% similarity.
+        The texts of all spans are POS tagged in one batch using only the
+        components needed for tagging and the noun tokens of all spans are
+        sent to the CandidateGenerator in one call.
+
+        spans (List[Span]): Mention spans without AliasCandidates
+
+        RETURNS (List[List[AliasCandidate]]): AliasCandidates for each span
+        """
+        texts = [ent.text for ent in spans]
+        unique_texts = list(dict.fromkeys(texts))
+        tagging_pipes = self.get_tagging_pipes()
+        docs = (self.nlp.make_doc(text) for text in unique_texts)
+        for name, proc in self.nlp.pipeline:
+            if name in tagging_pipes:
+                docs = proc.pipe(docs) if hasattr(proc, "pipe") else map(proc, docs)
+        text_nouns = {
+            text: [w.text for w in doc if w.pos_ in ['NOUN', 'PROPN'] and len(w.text)>=2]
+            for text, doc in zip(unique_texts, docs)
+        }
+
+        unique_nouns = list(dict.fromkeys(it.chain(*text_nouns.values())))
+        noun_candidates = dict(zip(unique_nouns, self.cg(unique_nouns)))
 
-            if len(alias_candidates) == 0:
+        batch_candidates = []
+        for text in texts:
+            noun_chunks = text_nouns[text]
+            batch_candidates.append([
+                ac for noun in noun_chunks for ac in noun_candidates[noun]
+                if ac.similarity == 1.0 and ac.alias in noun_chunks
+            ])
+        return batch_candidates
+
+    def get_tagging_pipes(self) -> List[str]:
+        """Names of the enabled pipeline components needed to POS tag a text
+        for the noun token fallback
+
+        RETURNS (List[str]): Component names
+        """
+        names = []
+        for name in self.nlp.pipe_names:
+            if name == self.name:
+                break
+            assigns = self.nlp.get_pipe_meta(name).assigns
+            if name in TAGGING_PIPES or any(a in TAGGING_ATTRS for a in assigns):
+                names.append(name)
+        return names
+
+    def _rank_kb_candidates(
+        self,
+        docs: List[Doc],
+        linked_mentions: List[Tuple[int, Span, List[AliasCandidate]]],
+    ) -> List[Optional[str]]:
+        """Expand the AliasCandidates of a batch of mentions to KnowledgeBase
+        entities, keep the best candidate per entity and rank them. Sets
+        `span._.kb_candidates` on each mention.
+
+        docs (List[Doc]): Batch of spaCy Docs the mentions belong to
+        linked_mentions (List[Tuple[int, Span, List[AliasCandidate]]]): Doc index,
+            span and AliasCandidates of each mention
+
+        RETURNS (List[Optional[str]]): Id of the best entity for each mention
+            or None if not linked
+        """
+        if not linked_mentions:
+            return []
+        table = self.get_alias_table()
+
+        mention_ids = []
+        alias_rows = []
+        alias_sims = []
+        for i, (_, _, alias_candidates) in enumerate(linked_mentions):
+            for ac in alias_candidates:
+                row = table.alias_rows.get(ac.alias)
+                if row is not None:
+                    mention_ids.append(i)
+                    alias_rows.append(row)
+                    alias_sims.append(ac.similarity)
+
+        sources, entity_ids = table.expand(np.asarray(alias_rows, dtype=np.int64))
+        segments = np.asarray(mention_ids, dtype=np.int64)[sources]
+        asims = np.asarray(alias_sims, dtype=np.float64)[sources]
+        labels = table.entity_labels[entity_ids]
+
+        csims = np.zeros(len(entity_ids))
+        if self.enable_context_similarity:
+            has_vector = np.array([ent.has_vector for _, ent, _ in linked_mentions])
+            if has_vector.any():
+                doc_vectors = np.stack([
+                    doc.vector.get() if str(type(doc.vector)).count('cupy') else doc.vector
+                    for doc in docs
+                ])
+                doc_norms = np.array([doc.vector_norm for doc in docs])
+                mention_docs = np.array([doc_idx for doc_idx, _, _ in linked_mentions])
+                entity_encodings = table.get_entity_vectors()[entity_ids]
+                candidate_docs = mention_docs[segments]
+                csims = (entity_encodings * doc_vectors[candidate_docs]).sum(axis=1) / (
+                    np.linalg.norm(entity_encodings, axis=1) * doc_norms[candidate_docs] + 1e-8
+                )
+                csims[~has_vector[segments]] = 0.0
+        similarities = np.where(
+            self.enable_context_similarity & (csims > 0), csims, asims
+        )
+
+        if self.disambiguate and isinstance(self.disambiguate, str):
+            label_mask = np.array(
+                [label.startswith(self.disambiguate) for label in table.labels]
+            )
+            keep = label_mask[labels]
+            segments, entity_ids, similarities = segments[keep], entity_ids[keep], similarities[keep]
+            asims, csims, labels = asims[keep], csims[keep], labels[keep]
+
+        order, offsets = rank_entities(
+            segments, entity_ids, similarities, labels, len(linked_mentions)
+        )
+        exact = similarities[order] == 1
+
+        best_entities = []
+        for i, (_, ent, _) in enumerate(linked_mentions):
+            start, end = offsets[i], offsets[i + 1]
+            if start == end:
+                best_entities.append(None)
                 continue
-            else:
-                mentions_table = self.nlp.vocab.lookups.get_table(
-                    "mentions_to_alias_cand"
+            positions = order[start:end]
+            kb_candidates = [
+                KnowledgeBaseCandidate(
+                    entity=table.entities[entity],
+                    label=table.labels[label],
+                    similarity=sim,
+                    context_similarity=csim,
+                    alias_similarity=asim,
                 )
-                mentions_table.set(ent.text, alias_candidates[0].alias)
+                for entity, label, sim, csim, asim in zip(
+                    entity_ids[positions].tolist(),
+                    labels[positions].tolist(),
+                    similarities[positions].tolist(),
+                    csims[positions].tolist(),
+                    asims[positions].tolist(),
+                )
+            ]
+            ent._.kb_candidates = kb_candidates
+
+            # select best candidate as entity
+            best = 0
+            label_id = table.label_ids.get(ent.label_)
+            if label_id is not None:
+                exact_match = np.flatnonzero(
+                    exact[start:end] & (labels[positions] == label_id)
+                )
+                if len(exact_match):
+                    best = exact_match[0]
+            best_entities.append(kb_candidates[best].entity)
+        return best_entities
 
-                # return all kb entities of each candidate
-                alias_kb_lst = [
-                    self.kb.get_alias_candidates(ac.alias) for ac in alias_candidates
-                ]
-                # flatten to list of candidates
-                kba_candidates = list(it.chain(*alias_kb_lst))
-                kba_alias_idx = list(
-                    it.chain(*[[i] * len(items) for i, items in enumerate(alias_kb_lst)]))
-                candicate_similarity = [
-                    ac.similarity for ac in alias_candidates
-                ]
-                if self.enable_context_similarity and ent.has_vector:
-                    # create candidate matrix
-                    entity_encodings = np.asarray(
-                        [c.entity_vector for c in kba_candidates]
-                    )
-                    doc_vector = doc.vector.T.get() if str(type(doc.vector)).count('cupy') else doc.vector.T
-                    candidate_norm = np.linalg.norm(
-                        entity_encodings, axis=1)
-                    sims = np.dot(entity_encodings, doc_vector) / (
-                        (candidate_norm * doc.vector_norm) + 1e-8
-                    )
-                else:
-                    sims = np.zeros(len(kba_candidates))
-                kb_candidates = []
-                for cand, alias_idx, csim in zip(kba_candidates, kba_alias_idx, sims):
-                    asim = candicate_similarity[alias_idx]
-                    kb_candidates.append(
-                        KnowledgeBaseCandidate(
-                            entity=cand.entity_, label=self.ent_label_map.get(
-                                cand.entity_, ''),
-                            similarity=csim if self.enable_context_similarity and csim > 0 else asim,
-                            context_similarity=csim,
-                            alias_similarity=asim
-                        )
-                    )
-                
-                if self.disambiguate and isinstance(self.disambiguate, str):
-                    kb_candidates = [ent for ent in kb_candidates if ent.label.startswith(self.disambiguate)]
-                if kb_candidates:
-                    # dedup by entity, keep max item for each entity
-                    kb_candidates = sorted(kb_candidates, key=lambda x: (
-                        x.label, x.similarity), reverse=True)
-                    kb_candidates = [list(v)[0] for k, v in it.groupby(
-                        kb_candidates, key=lambda x: x.entity)]
-                    
-                    # sort by similarity
-                    kb_candidates = sorted(
-                        kb_candidates, key=lambda x: x.similarity, reverse=True)
-                    ent._.kb_candidates = kb_candidates
-
-                    # select best candidate as entity
-                    exact_match = [c for c in kb_candidates if c.label==ent.label_ and c.similarity==1]
-                    if exact_match:
-                        best_candidate = exact_match[0]
-                    else:
-                        best_candidate = kb_candidates[0]
-                    for t in ent:
-                        t.ent_kb_id_ = best_candidate.entity
+    def get_alias_table(self) -> AliasEntityTable:
+        """Get the alias to entity table, building it from the kb on first use
 
-        return doc
+        RETURNS (AliasEntityTable): Table for the current kb and entity labels
+        """
+        if self.alias_table is None:
+            self.require_kb()
+            self.alias_table = AliasEntityTable.from_kb(self.kb, self.ent_label_map)
+        return self.alias_table
 
     def set_kb(self, kb: InMemoryLookupKB):
         """Set the InMemoryLookupKB
@@ -219,6 +462,7 @@ class AnnLinker(Pipe):
         kb (InMemoryLookupKB): spaCy InMemoryLookupKB
         """
         self.kb = kb
+        self.alias_table = None
 
     def set_cg(self, cg: CandidateGenerator):
         """Set the CandidateGenerator
@@ -227,8 +471,81 @@ class AnnLinker(Pipe):
         """
         self.cg = cg
 
+    def set_partitions(
+        self,
+        partitions: Dict[str, CandidateGenerator],
+        label_groups: Dict[str, List[str]],
+    ):
+        """Set the per label CandidateGenerators
+
+        partitions (Dict[str, CandidateGenerator]): Initialized CandidateGenerator
+            of each partition
+        label_groups (Dict[str, List[str]]): Entity labels of each partition
+
+        RAISES:
+            ValueError: A label belongs to more than one partition
+        """
+        label_partitions = {}
+        for name in partitions:
+            for label in label_groups[name]:
+                if label in label_partitions:
+                    raise ValueError(
+                        f"Label {label} belongs to partitions "
+                        f"{label_partitions[label]} and {name}"
+                    )
+                label_partitions[label] = name
+        self.partitions = dict(partitions)
+        self.label_groups = {name: list(label_groups[name]) for name in partitions}
+        self.label_partitions = label_partitions
+
+    def fit_partitions(
+        self,
+        label_groups: Optional[Dict[str, List[str]]] = None,
+        verbose: bool = False,
+        **cg_params: Any,
+    ) -> Dict[str, CandidateGenerator]:
+        """Build a CandidateGenerator per entity label, or per group of labels,
+        over the aliases of the kb entities with those labels. A mention whose
+        `ent.label_` belongs to a partition is only searched in that partition's
+        smaller index, mentions with other labels use the global CandidateGenerator.
+        Partitions are built from the current kb and labels, refit them after
+        changing either.
+
+        label_groups (Optional[Dict[str, List[str]]]): Entity labels of each partition,
+            one partition per label of `ent_label_map` if None. Partitions without
+            aliases are skipped so their labels use the global CandidateGenerator.
+        verbose (bool): Set to True to print fit progress
+        cg_params (Any): CandidateGenerator params of the partitions, defaults to the
+            params of the global CandidateGenerator
+
+        RETURNS (Dict[str, CandidateGenerator]): Fitted CandidateGenerator of each partition
+        """
+        self.require_kb()
+        self.require_cg()
+        if label_groups is None:
+            label_groups = {
+                label: [label] for label in sorted(set(self.ent_label_map.values()))
+            }
+        params = {name: getattr(self.cg, name) for name in PARTITION_CG_PARAMS}
+        params.update(cg_params)
+
+        table = self.get_alias_table()
+        alias_rows = np.repeat(np.arange(len(table.aliases)), np.diff(table.indptr))
+        alias_labels = table.entity_labels[table.entity_ids]
+        partitions = {}
+        for name, labels in label_groups.items():
+            label_ids = [table.label_ids[label] for label in labels if label in table.label_ids]
+            rows = np.unique(alias_rows[np.isin(alias_labels, label_ids)])
+            if len(rows) == 0:
+                continue
+            aliases = [table.aliases[row] for row in rows.tolist()]
+            partitions[name] = CandidateGenerator(**params).fit(aliases, verbose=verbose)
+        self.set_partitions(partitions, label_groups)
+        return self.partitions
+
     def set_entity_lables(self, ent_label_map: Dict[str, str]):
         self.ent_label_map = ent_label_map
+        self.alias_table = None
         if self.ent_label_map and self.disambiguate and isinstance(self.disambiguate, str):
             if self.nlp.has_pipe("ann_regex_matcher"):
                 self.nlp.remove_pipe("ann_regex_matcher")
@@ -278,6 +595,14 @@ class AnnLinker(Pipe):
             self.disambiguate = cfg.get("disambiguate")
         if osp.exists(path / "el"):
             self.ent_label_map = srsly.read_json(path / "el")
+        self.alias_table = AliasEntityTable.from_kb(self.kb, self.ent_label_map)
+
+        label_groups = cfg.get("label_groups", {})
+        partitions = {
+            name: CandidateGenerator().from_disk(path / "partitions" / str(i))
+            for i, name in enumerate(label_groups)
+        }
+        self.set_partitions(partitions, label_groups)
         return self
 
     def to_disk(self, path: Path, exclude: Tuple = tuple(), **kwargs):
@@ -294,9 +619,18 @@ class AnnLinker(Pipe):
             "threshold": self.threshold,
             "enable_context_similarity": self.enable_context_similarity,
             "disambiguate": self.disambiguate,
+            "label_groups": self.label_groups,
         }
         srsly.write_json(path / "cfg", cfg)
 
         self.kb.to_disk(path / "kb")
         self.cg.to_disk(path)
         srsly.write_json(path / "el", self.ent_label_map)
+
+        # partition directories are numbered in `label_groups` order
+        if (path / "partitions").exists():
+            shutil.rmtree(path / "partitions")
+        if self.label_groups:
+            (path / "partitions").mkdir()
+        for i, name in enumerate(self.label_groups):
+            self.partitions[name].to_disk(path / "partitions" / str(i))
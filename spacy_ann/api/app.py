@@ -1,20 +1,32 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import asyncio
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
 
 import srsly
 from dotenv import find_dotenv, load_dotenv
 from fastapi import Body, FastAPI, HTTPException
 from fastapi.security import APIKeyHeader
+from spacy.language import Language
+from spacy.tokens import Doc, Span
 from spacy_ann import __version__
-from spacy_ann.api.types import LinkingRecord, LinkingRequest, LinkingResponse
+from spacy_ann.api.types import (
+    CandidatesRequest,
+    CandidatesResponse,
+    LinkingRecord,
+    LinkingRequest,
+    LinkingResponse,
+)
 from starlette.requests import Request
-from starlette.responses import RedirectResponse
+from starlette.responses import RedirectResponse, Response
 
 load_dotenv(find_dotenv())
 openapi_prefix = os.getenv("CLUSTER_ROUTE_PREFIX", "").rstrip("/")
+n_linking_threads = int(os.getenv("LINKING_THREADS", "4"))
 
 
 app = FastAPI(
@@ -27,7 +39,80 @@ example_request = srsly.read_json(
     Path(__file__).parent / "example_request.json")
 
 
+MSGPACK_MEDIA_TYPES = ("application/msgpack", "application/x-msgpack")
+MODEL_VERSION_HEADER = "X-Model-Version"
+
 security = APIKeyHeader(name="api-key")
+executor = ThreadPoolExecutor(
+    max_workers=n_linking_threads, thread_name_prefix="spacy_ann_link"
+)
+
+
+def configure_executor(n_threads: int) -> ThreadPoolExecutor:
+    """Replace the thread pool used for linking
+
+    n_threads (int): Number of linking threads
+
+    RETURNS (ThreadPoolExecutor): The new thread pool
+    """
+    global executor
+    executor.shutdown(wait=False)
+    executor = ThreadPoolExecutor(
+        max_workers=n_threads, thread_name_prefix="spacy_ann_link"
+    )
+    return executor
+
+
+def get_nlp(request: Request) -> Language:
+    """Get the nlp object set on the request state by `spacy_ann serve`
+
+    RAISES:
+        HTTPException: nlp is not set
+
+    RETURNS (Language): spaCy Language object with an `ann_linker` pipe
+    """
+    try:
+        return request.state.nlp
+    except AttributeError:
+        error_msg = (
+            "`nlp` does not exist in the request state."
+            "nlp is set using middleware defined in the `spacy_ann serve` command."
+            "Are you running this app outside of the `spacy_ann serve` command?"
+        )
+        raise HTTPException(status_code=501, detail=error_msg)
+
+
+def get_model_version(nlp: Language) -> str:
+    """Version of the served model. Clients use it to invalidate cached results.
+
+    nlp (Language): spaCy Language object with an `ann_linker` pipe
+
+    RETURNS (str): Model name and version, and the revision of the
+        CandidateGenerator if aliases were added or removed
+    """
+    version = f"{nlp.meta.get('lang', '')}_{nlp.meta.get('name', '')}-{nlp.meta.get('version', '')}"
+    revision = getattr(nlp.get_pipe("ann_linker").cg, "revision", 0)
+    return f"{version}+{revision}" if revision else version
+
+
+def encode_response(request: Request, data: Dict[str, Any]) -> Response:
+    """Serialize response data in the format the client accepts.
+    msgpack if requested in the `Accept` header, otherwise JSON. The data is
+    serialized directly, without validating it against the response model.
+    The model version is reported in the `X-Model-Version` header.
+
+    request (Request): Incoming request
+    data (Dict[str, Any]): Response data
+
+    RETURNS (Response): Serialized response
+    """
+    headers = {MODEL_VERSION_HEADER: get_model_version(request.state.nlp)}
+    accept = request.headers.get("accept", "")
+    if any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return Response(
+            srsly.msgpack_dumps(data), media_type=MSGPACK_MEDIA_TYPES[0], headers=headers
+        )
+    return Response(srsly.json_dumps(data), media_type="application/json", headers=headers)
 
 
 @app.get("/", include_in_schema=False)
@@ -39,44 +124,273 @@ def docs_redirect():
 async def link(
     request: Request,
     #    api_key = Depends(security),
-    similarity_threshold: float = 0.65,
+    similarity_threshold: Optional[float] = None,
+    include_candidates: bool = True,
+    max_candidates: Optional[int] = None,
+    include_context: bool = True,
     body: LinkingRequest = Body(..., example=example_request),
 ):
-    """Link batch of Spans to their canonical KnowledgeBase Id."""
+    """Link batch of Spans to their canonical KnowledgeBase Id.
 
-    try:
-        nlp = request.state.nlp
-        # app_api_key = request.state.api_key
-    except AttributeError:
-        error_msg = (
-            "`nlp` does not exist in the request state."
-            "nlp is set using middleware defined in the `spacy_ann serve` command."
-            "Are you running this app outside of the `spacy_ann serve` command?"
-        )
-        raise HTTPException(status_code=501, detail=error_msg)
+    `similarity_threshold` overrides the threshold of the model's `ann_linker`.
+    Set `include_candidates=false` to only return the ids, or `max_candidates`
+    to truncate the candidate lists of each span. `include_context=false` omits
+    the document text from the response. Responses are msgpack encoded if the
+    `Accept` header asks for `application/msgpack`.
+    """
+
+    nlp = get_nlp(request)
 
     # if app_api_key != NO_API_KEY and api_key != app_api_key:
     #     raise HTTPException(
     #         status_code=HTTP_401_UNAUTHORIZED, detail="Unauthorized auth api-key passed in header"
     #     )
 
-    res = LinkingResponse(documents=[])
-    for doc in body.documents:
+    options = LinkingOptions(
+        similarity_threshold,
+        max_candidates if include_candidates else 0,
+        include_context,
+    )
+    batcher = getattr(request.state, "batcher", None)
+    if batcher is not None:
+        n_spans = sum(len(doc.spans) for doc in body.documents)
+        data = await batcher.submit((body.documents, options), size=n_spans)
+    else:
+        # linking is CPU bound, run it in the pool so it doesn't block the event loop
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(
+            executor, link_documents, nlp, body.documents, *options
+        )
+    return encode_response(request, data)
+
+
+@app.post("/candidates", response_model=CandidatesResponse)
+async def candidates(
+    request: Request,
+    body: CandidatesRequest,
+    similarity_threshold: Optional[float] = None,
+):
+    """Link mention texts without their documents.
+
+    `texts` and `labels` describe one mention each, send every distinct
+    mention once. Returns the id of each mention ("" if not linked) and its top
+    `max_candidates` KnowledgeBase candidates as flat arrays, the candidates
+    of mention `i` are at `offsets[i]:offsets[i + 1]`. `similarity_threshold`
+    overrides the threshold of the model's `ann_linker`.
+    """
+    nlp = get_nlp(request)
+    if len(body.texts) != len(body.labels):
+        raise HTTPException(
+            status_code=422, detail="`texts` and `labels` must have the same length"
+        )
+    loop = asyncio.get_running_loop()
+    data = await loop.run_in_executor(
+        executor,
+        link_mentions,
+        nlp,
+        body.texts,
+        body.labels,
+        similarity_threshold,
+        body.max_candidates,
+    )
+    return encode_response(request, data)
+
+
+@app.get("/stats")
+def stats(request: Request):
+    """Batch size and wait time histograms of the micro-batcher, if enabled."""
+    batcher = getattr(request.state, "batcher", None)
+    return {"micro_batching": batcher.stats() if batcher is not None else None}
+
+
+class LinkingOptions(NamedTuple):
+    """Per request options of `link_documents`"""
+
+    similarity_threshold: Optional[float] = None
+    max_candidates: Optional[int] = None
+    include_context: bool = True
+
+
+def link_batch(
+    nlp: Language, batch: List[Tuple[List[LinkingRecord], LinkingOptions]]
+) -> List[Dict[str, Any]]:
+    """Link the documents of several requests collected by the micro-batcher.
+    Requests with the same similarity threshold are linked together, the other
+    options only change the format of each response.
+
+    nlp (Language): spaCy Language object with an `ann_linker` pipe
+    batch (List[Tuple[List[LinkingRecord], LinkingOptions]]): Documents and
+        linking options of each request
+
+    RETURNS (List[Dict[str, Any]]): Response data for each request
+    """
+    responses: List[Optional[Dict[str, Any]]] = [None] * len(batch)
+    by_threshold: Dict[Optional[float], List[int]] = {}
+    for i, (_, options) in enumerate(batch):
+        by_threshold.setdefault(options.similarity_threshold, []).append(i)
+
+    for similarity_threshold, indices in by_threshold.items():
+        documents = [doc for i in indices for doc in batch[i][0]]
+        linked = _link_records(nlp, documents, similarity_threshold)
+        start = 0
+        for i in indices:
+            request_documents, options = batch[i]
+            end = start + len(request_documents)
+            responses[i] = _linking_response(
+                request_documents,
+                linked[start:end],
+                options.max_candidates,
+                options.include_context,
+            )
+            start = end
+    return responses
+
+
+def link_documents(
+    nlp: Language,
+    documents: List[LinkingRecord],
+    similarity_threshold: Optional[float] = None,
+    max_candidates: Optional[int] = None,
+    include_context: bool = True,
+) -> Dict[str, Any]:
+    """Link the spans of a batch of documents with one batched `ann_linker` call
+
+    nlp (Language): spaCy Language object with an `ann_linker` pipe
+    documents (List[LinkingRecord]): Documents with spans to link
+    similarity_threshold (Optional[float]): Minimum similarity of the AliasCandidates,
+        None uses the threshold of the `ann_linker` pipe
+    max_candidates (Optional[int]): Maximum number of candidates per span,
+        0 omits the candidate lists and None returns all of them
+    include_context (bool): Include the document text in the response
+
+    RETURNS (Dict[str, Any]): `LinkingResponse` data with id and candidates
+        set on each span
+    """
+    linked = _link_records(nlp, documents, similarity_threshold)
+    return _linking_response(documents, linked, max_candidates, include_context)
+
+
+def _link_records(
+    nlp: Language,
+    documents: List[LinkingRecord],
+    similarity_threshold: Optional[float] = None,
+) -> List[Tuple[Doc, List[Optional[Span]]]]:
+    """Make a doc of each document and link its spans
+
+    RETURNS (List[Tuple[Doc, List[Optional[Span]]]]): Linked doc of each document
+        and the entity of each of its spans, None if a span doesn't map to tokens
+    """
+    ann_linker = nlp.get_pipe("ann_linker")
+
+    spacy_docs = []
+    for doc in documents:
         spacy_doc = nlp.make_doc(doc.context)
         spans = [spacy_doc.char_span(
             s.start, s.end, label=s.label, alignment_mode='contract') for s in doc.spans]
         spacy_doc.ents = [s for s in spans if s]
-        ann_linker = nlp.get_pipe("ann_linker")
-        ann_linker.cg.threshold = similarity_threshold
-        spacy_doc = ann_linker(spacy_doc)
+        spacy_docs.append((spacy_doc, spans))
+
+    list(ann_linker.pipe(
+        [spacy_doc for spacy_doc, _ in spacy_docs],
+        batch_size=max(len(spacy_docs), 1),
+        threshold=similarity_threshold,
+    ))
+    return spacy_docs
+
+
+def _linking_response(
+    documents: List[LinkingRecord],
+    linked: List[Tuple[Doc, List[Optional[Span]]]],
+    max_candidates: Optional[int] = None,
+    include_context: bool = True,
+) -> Dict[str, Any]:
+    """`LinkingResponse` data of linked documents, see `link_documents`"""
+    include_candidates = max_candidates != 0
+    res_documents = []
+    for doc, (spacy_doc, spans) in zip(documents, linked):
+        kb_ids = {(ent.start, ent.end): ent.kb_id_ for ent in spacy_doc.ents}
+        res_spans = []
+        for span, ent in zip(doc.spans, spans):
+            res_span = {
+                "text": span.text,
+                "start": span.start,
+                "end": span.end,
+                "label": span.label,
+                "id": span.id,
+            }
+            if include_candidates:
+                res_span["alias_candidates"] = None
+                res_span["kb_candidates"] = None
+            if ent is not None:
+                res_span["id"] = kb_ids.get((ent.start, ent.end), "")
+                if include_candidates:
+                    res_span["alias_candidates"] = [
+                        c.dict() for c in ent._.alias_candidates[:max_candidates]
+                    ]
+                    res_span["kb_candidates"] = [
+                        c.dict() for c in ent._.kb_candidates[:max_candidates]
+                    ]
+            res_spans.append(res_span)
+
+        res_doc = {"spans": res_spans}
+        if include_context:
+            res_doc["context"] = doc.context
+        res_documents.append(res_doc)
+
+    return {"documents": res_documents}
+
+
+def link_mentions(
+    nlp: Language,
+    texts: List[str],
+    labels: List[str],
+    similarity_threshold: Optional[float] = None,
+    max_candidates: int = 10,
+) -> Dict[str, Any]:
+    """Link mention texts without document context. Each mention is linked as
+    the only entity of a doc made from its text, so it's normalized and
+    linked exactly like the same span sent to `link_documents`.
+
+    nlp (Language): spaCy Language object with an `ann_linker` pipe
+    texts (List[str]): Mention texts
+    labels (List[str]): Mention labels
+    similarity_threshold (Optional[float]): Minimum similarity of the AliasCandidates,
+        None uses the threshold of the `ann_linker` pipe
+    max_candidates (int): Maximum number of KnowledgeBase candidates per mention
+
+    RETURNS (Dict[str, Any]): `CandidatesResponse` data with ids and
+        KnowledgeBase candidate arrays
+    """
+    ann_linker = nlp.get_pipe("ann_linker")
 
-        for i, ent in enumerate(spacy_doc.ents):
-            doc.spans[i].id = ent.kb_id_
-            doc.spans[i].alias_candidates = ent._.alias_candidates
-            doc.spans[i].kb_candidates = ent._.kb_candidates
+    spacy_docs = []
+    for text, label in zip(texts, labels):
+        spacy_doc = nlp.make_doc(text)
+        if len(spacy_doc):
+            spacy_doc.ents = [Span(spacy_doc, 0, len(spacy_doc), label=label)]
+        spacy_docs.append(spacy_doc)
 
-        # print(doc)
-        res.documents.append(LinkingRecord(
-            spans=doc.spans, context=doc.context))
+    list(ann_linker.pipe(
+        spacy_docs, batch_size=max(len(spacy_docs), 1), threshold=similarity_threshold
+    ))
 
-    return res
+    ids = []
+    offsets = [0]
+    entities = []
+    similarities = []
+    for spacy_doc in spacy_docs:
+        if spacy_doc.ents:
+            ent = spacy_doc.ents[0]
+            ids.append(ent.kb_id_)
+            for kb_candidate in ent._.kb_candidates[:max_candidates]:
+                entities.append(kb_candidate.entity)
+                similarities.append(kb_candidate.similarity)
+        else:
+            ids.append("")
+        offsets.append(len(entities))
+    return {
+        "ids": ids,
+        "offsets": offsets,
+        "entities": entities,
+        "similarities": similarities,
+    }
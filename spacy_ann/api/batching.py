@@ -0,0 +1,137 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+class Histogram:
+    """Cumulative histogram with fixed bucket upper bounds,
+    reported like a Prometheus histogram.
+    """
+
+    def __init__(self, buckets: Sequence[float]):
+        """Initialize a Histogram
+
+        buckets (Sequence[float]): Sorted bucket upper bounds
+        """
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self) -> Dict[str, Any]:
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets + ["+Inf"], self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+        return {"buckets": buckets, "count": self.count, "sum": self.sum}
+
+
+class MicroBatcher:
+    """Collect work submitted by concurrent requests and process it as one
+    batch. A batch is flushed when its size reaches `max_batch_size` or
+    `max_wait_ms` after its first item was submitted, whichever comes first.
+    Batches are processed in `executor` so the event loop is never blocked.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int = 256,
+        max_wait_ms: float = 2.0,
+        executor: Optional[Executor] = None,
+    ):
+        """Initialize a MicroBatcher
+
+        process_batch (Callable[[List[Any]], List[Any]]): Function processing a list of
+            submitted items and returning one result per item
+        max_batch_size (int): Batch size that triggers a flush, measured in the
+            `size` passed to `submit` (e.g. number of mentions)
+        max_wait_ms (float): Maximum time in milliseconds an item waits for a batch
+        executor (Optional[Executor]): Executor to process batches in.
+            Defaults to the event loop's default executor.
+        """
+        self.process_batch = process_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024])
+        self.wait_times_ms = Histogram([0.1, 0.25, 0.5, 1, 2, 5, 10, 25, 50, 100])
+        self._pending: List[Tuple[Any, int, float, asyncio.Future]] = []
+        self._pending_size = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, item: Any, size: int = 1) -> Any:
+        """Add an item to the next batch and wait for its result
+
+        item (Any): Item to process
+        size (int): Size of the item counted against `max_batch_size`
+
+        RETURNS (Any): Result of `process_batch` for the item
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, size, loop.time(), future))
+        self._pending_size += size
+        if self._pending_size >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_ms / 1000, self._flush)
+        return await future
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch size and wait time histograms
+
+        RETURNS (Dict[str, Any]): Histograms of flushed batches
+        """
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batch_size": self.batch_sizes.to_dict(),
+            "wait_time_ms": self.wait_times_ms.to_dict(),
+        }
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        batch_size, self._pending_size = self._pending_size, 0
+        if not batch:
+            return
+
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.batch_sizes.observe(batch_size)
+        for _, _, submitted, _ in batch:
+            self.wait_times_ms.observe((now - submitted) * 1000)
+
+        futures = [future for _, _, _, future in batch]
+        task = loop.run_in_executor(
+            self.executor, self.process_batch, [item for item, _, _, _ in batch]
+        )
+
+        def set_results(task: asyncio.Future):
+            if task.exception() is not None:
+                for future in futures:
+                    if not future.done():
+                        future.set_exception(task.exception())
+                return
+            for future, result in zip(futures, task.result()):
+                if not future.done():
+                    future.set_result(result)
+
+        task.add_done_callback(set_results)
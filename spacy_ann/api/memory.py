@@ -0,0 +1,101 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import gc
+import multiprocessing
+import os
+from typing import Dict, Optional
+
+MB = 1024 * 1024
+
+
+def freeze_loaded_objects():
+    """Move every object allocated so far to the permanent GC generation.
+    Frozen objects are never traversed by the garbage collector, so the
+    pages holding the loaded model stay shared with forked workers
+    instead of being copied when the collector touches them.
+    """
+    gc.collect()
+    if hasattr(gc, "freeze"):
+        gc.freeze()
+
+
+def get_memory_usage(pid: Optional[int] = None) -> Dict[str, int]:
+    """Resident and shared memory of a process in bytes, read from
+    `/proc/<pid>/smaps_rollup`. Returns an empty dict if it's not available.
+
+    pid (Optional[int]): Process id, defaults to the current process
+
+    RETURNS (Dict[str, int]): `rss`, `pss`, `shared` and `private` bytes
+    """
+    path = f"/proc/{pid or 'self'}/smaps_rollup"
+    if not os.path.exists(path):
+        return {}
+    fields = {}
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) * 1024
+    shared = fields.get("Shared_Clean", 0) + fields.get("Shared_Dirty", 0)
+    private = fields.get("Private_Clean", 0) + fields.get("Private_Dirty", 0)
+    return {
+        "rss": fields.get("Rss", 0),
+        "pss": fields.get("Pss", 0),
+        "shared": shared,
+        "private": private,
+    }
+
+
+def format_memory_usage(usage: Dict[str, int]) -> str:
+    """Human readable summary of `get_memory_usage`"""
+    if not usage:
+        return "memory usage not available"
+    rss = usage["rss"]
+    shared_ratio = usage["shared"] / rss if rss else 0.0
+    return (
+        f"RSS {rss // MB} MB, PSS {usage['pss'] // MB} MB, "
+        f"shared {usage['shared'] // MB} MB ({shared_ratio:.0%})"
+    )
+
+
+def get_available_memory() -> Optional[int]:
+    """Memory available for new processes in bytes, read from `/proc/meminfo`
+
+    RETURNS (Optional[int]): Available bytes or None if it's not available
+    """
+    if not os.path.exists("/proc/meminfo"):
+        return None
+    with open("/proc/meminfo") as f:
+        for line in f:
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) * 1024
+    return None
+
+
+def compute_n_workers(
+    n_threads: int,
+    worker_memory: int,
+    memory_budget: Optional[int] = None,
+    cpu_count: Optional[int] = None,
+) -> int:
+    """Number of worker processes that fits both the CPU and memory budgets.
+    Every worker runs `n_threads` linking threads, and is assumed to need
+    `worker_memory` bytes in the worst case where nothing stays shared.
+
+    n_threads (int): Linking threads per worker
+    worker_memory (int): Memory budget of one worker in bytes
+    memory_budget (Optional[int]): Memory for all workers in bytes.
+        Defaults to 80% of the available memory.
+    cpu_count (Optional[int]): Number of CPUs. Defaults to all CPUs.
+
+    RETURNS (int): Number of workers, at least 1
+    """
+    cpu_count = cpu_count or multiprocessing.cpu_count()
+    n_workers = max(1, cpu_count // max(1, n_threads))
+    if memory_budget is None:
+        available = get_available_memory()
+        memory_budget = int(available * 0.8) if available else None
+    if memory_budget and worker_memory > 0:
+        n_workers = min(n_workers, max(1, memory_budget // worker_memory))
+    return n_workers
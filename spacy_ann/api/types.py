@@ -5,7 +5,7 @@ from typing import List, Optional
 
 from pydantic import BaseModel
 # from spacy.kb import Candidate
-from spacy_ann.types import AliasCandidate, KnowledgeBaseCandidate
+from spacy_ann.types import AliasCandidateModel, KnowledgeBaseCandidateModel
 
 # class ApiAliasCandidate(BaseModel):
 #     alias: str
@@ -23,8 +23,8 @@ class LinkingSpan(BaseModel):
     end: int
     label: str
     id: Optional[str] = None
-    alias_candidates: Optional[List[AliasCandidate]] = None
-    kb_candidates: Optional[List[KnowledgeBaseCandidate]] = None
+    alias_candidates: Optional[List[AliasCandidateModel]] = None
+    kb_candidates: Optional[List[KnowledgeBaseCandidateModel]] = None
 
 
 class LinkingRecord(BaseModel):
@@ -36,5 +36,24 @@ class LinkingRequest(BaseModel):
     documents: List[LinkingRecord]
 
 
+class LinkingResponseRecord(BaseModel):
+    spans: List[LinkingSpan]
+    # omitted with `include_context=false`
+    context: Optional[str] = None
+
+
 class LinkingResponse(BaseModel):
-    documents: List[LinkingRecord]
+    documents: List[LinkingResponseRecord]
+
+
+class CandidatesRequest(BaseModel):
+    texts: List[str]
+    labels: List[str]
+    max_candidates: int = 10
+
+
+class CandidatesResponse(BaseModel):
+    ids: List[str]
+    offsets: List[int]
+    entities: List[str]
+    similarities: List[float]
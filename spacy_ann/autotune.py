@@ -0,0 +1,220 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from dataclasses import asdict, dataclass
+from timeit import default_timer as timer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy
+
+from .backends import AnnIndex
+from .benchmark import exact_knn, query_index, recall_at_k
+from .candidate_generator import CandidateGenerator
+
+EF_SEARCH_VALUES = (10, 20, 40, 80, 160, 320, 640)
+M_VALUES = (16, 32, 64, 100)
+EF_CONSTRUCTION_VALUES = (100, 200, 500, 2000)
+
+
+@dataclass
+class TuningPoint:
+    ef_search: int
+    recall: float
+    latency_ms: float
+    m_parameter: Optional[int] = None
+    ef_construction: Optional[int] = None
+    build_seconds: Optional[float] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {key: value for key, value in asdict(self).items() if value is not None}
+
+
+def sweep_ef_search(
+    ann_index: AnnIndex,
+    vectors: scipy.sparse.csr_matrix,
+    exact_similarities: np.ndarray,
+    ef_values: Sequence[int] = EF_SEARCH_VALUES,
+    batch_size: int = 32,
+) -> List[TuningPoint]:
+    """recall@k and latency of an index for each efSearch value.
+    The index is left with the last efSearch value.
+
+    ann_index (AnnIndex): Index to query
+    vectors (scipy.sparse.csr_matrix): Non-empty query vectors
+    exact_similarities (np.ndarray): `(n, k)` similarities of the exact neighbors
+    ef_values (Sequence[int]): efSearch values to measure
+    batch_size (int): Queries per `knnQueryBatch` call
+
+    RETURNS (List[TuningPoint]): One point per efSearch value
+    """
+    k = exact_similarities.shape[1]
+    points = []
+    for ef_search in ef_values:
+        ann_index.setQueryTimeParams({"efSearch": ef_search})
+        similarities, mask, latency_ms = query_index(
+            ann_index, vectors, k, batch_size=batch_size
+        )
+        recall = recall_at_k(similarities, mask, exact_similarities)
+        points.append(TuningPoint(ef_search, recall, latency_ms))
+    return points
+
+
+def pareto_front(points: Sequence[TuningPoint]) -> List[TuningPoint]:
+    """Points no other point beats on both recall and latency, fastest first"""
+    front = []
+    for point in sorted(points, key=lambda p: (p.latency_ms, -p.recall)):
+        if not front or point.recall > front[-1].recall:
+            front.append(point)
+    return front
+
+
+def select_point(
+    points: Sequence[TuningPoint],
+    recall_target: Optional[float] = None,
+    latency_budget_ms: Optional[float] = None,
+) -> TuningPoint:
+    """Choose a Pareto point: the fastest one reaching `recall_target` within
+    `latency_budget_ms`, or the one with the best recall within the budget if
+    no target is given. Falls back to the best recall (or the fastest point if
+    nothing fits the budget).
+
+    points (Sequence[TuningPoint]): Measured points
+    recall_target (Optional[float]): Minimum recall@k
+    latency_budget_ms (Optional[float]): Maximum mean latency per query in ms
+
+    RETURNS (TuningPoint): The chosen point
+    """
+    front = pareto_front(points)
+    if latency_budget_ms is not None:
+        within_budget = [p for p in front if p.latency_ms <= latency_budget_ms]
+        if not within_budget:
+            return front[0]
+        front = within_budget
+    if recall_target is not None:
+        for point in front:
+            if point.recall >= recall_target:
+                return point
+    return front[-1]
+
+
+def _build_index(
+    cg: CandidateGenerator,
+    alias_tfidfs: scipy.sparse.csr_matrix,
+    m_parameter: int,
+    ef_construction: int,
+) -> Tuple[AnnIndex, float]:
+    params = {
+        "m_parameter": m_parameter,
+        "ef_construction": ef_construction,
+        "ef_search": cg.ef_search,
+        "n_threads": cg.n_threads,
+    }
+    backend = cg._get_backend()
+    start_time = timer()
+    index = backend.build(alias_tfidfs, params)
+    return index, timer() - start_time
+
+
+def autotune(
+    cg: CandidateGenerator,
+    mentions: List[str],
+    recall_target: Optional[float] = 0.95,
+    latency_budget_ms: Optional[float] = None,
+    ef_values: Sequence[int] = EF_SEARCH_VALUES,
+    tune_build: bool = False,
+    m_values: Sequence[int] = M_VALUES,
+    ef_construction_values: Sequence[int] = EF_CONSTRUCTION_VALUES,
+    sample_size: int = 50000,
+    batch_size: int = 32,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Tune the HNSW params of a CandidateGenerator for a recall target or latency budget.
+    `efSearch` is swept on the built index against exact search for a sample of mentions
+    and the chosen value is applied to `cg`. With `tune_build`, `M` and `efConstruction`
+    are chosen by building indexes with the backend of `cg` on a sample of the aliases.
+    They are applied to `cg`
+    and take effect the next time the index is built (`fit` or `compact`).
+
+    cg (CandidateGenerator): Fitted CandidateGenerator
+    mentions (List[str]): Real or synthetic mentions to tune for
+    recall_target (Optional[float]): Minimum recall@k
+    latency_budget_ms (Optional[float]): Maximum mean latency per query in ms
+    ef_values (Sequence[int]): efSearch values to try
+    tune_build (bool): Also tune `M` and `efConstruction` on a sample of the aliases
+    m_values (Sequence[int]): M values to try
+    ef_construction_values (Sequence[int]): efConstruction values to try
+    sample_size (int): Number of aliases to build the sampled indexes on
+    batch_size (int): Queries per `knnQueryBatch` call
+    seed (int): Random seed of the alias sample
+
+    RAISES:
+        ValueError: The index of `cg` has no efSearch, or no mention has a
+            non-empty TF-IDF vector
+
+    RETURNS (Dict[str, Any]): The chosen point and all measured points
+    """
+    cg.require_ann_index()
+    if not cg.ann_backend.supports_ef_search:
+        raise ValueError(
+            f"The {cg.ann_backend.name} index of the CandidateGenerator has no efSearch "
+            "to tune, fit it with index_type='hnsw' and the nmslib or hnswlib backend"
+        )
+    vectors = scipy.sparse.csr_matrix(cg._query_vectorizer.transform(mentions))
+    vectors = vectors[np.asarray(vectors.sum(axis=1)).reshape(-1) != 0]
+    if vectors.shape[0] == 0:
+        raise ValueError("None of the mentions have a non-empty TF-IDF vector")
+    alias_tfidfs = scipy.sparse.csr_matrix(cg.alias_tfidfs)
+    k = min(cg.k, alias_tfidfs.shape[0])
+
+    _, exact_similarities = exact_knn(alias_tfidfs, vectors, k)
+    points = sweep_ef_search(
+        cg.ann_index, vectors, exact_similarities, ef_values, batch_size=batch_size
+    )
+    chosen = select_point(points, recall_target, latency_budget_ms)
+    cg.ef_search = chosen.ef_search
+    cg.ann_index.setQueryTimeParams({"efSearch": cg.ef_search})
+    report = {
+        "k": k,
+        "n_mentions": vectors.shape[0],
+        "recall_target": recall_target,
+        "latency_budget_ms": latency_budget_ms,
+        "ef_search": chosen.to_dict(),
+        "ef_search_points": [p.to_dict() for p in points],
+    }
+
+    if tune_build:
+        rng = np.random.default_rng(seed)
+        rows = np.sort(rng.permutation(alias_tfidfs.shape[0])[:sample_size])
+        sample_tfidfs = alias_tfidfs[rows]
+        _, sample_exact = exact_knn(sample_tfidfs, vectors, k)
+        build_points = []
+        for m_parameter in m_values:
+            for ef_construction in ef_construction_values:
+                index, build_seconds = _build_index(
+                    cg, sample_tfidfs, m_parameter, ef_construction
+                )
+                point = select_point(
+                    sweep_ef_search(
+                        index, vectors, sample_exact, ef_values, batch_size=batch_size
+                    ),
+                    recall_target,
+                    latency_budget_ms,
+                )
+                point.m_parameter = m_parameter
+                point.ef_construction = ef_construction
+                point.build_seconds = build_seconds
+                build_points.append(point)
+        # the best query time point, then the cheapest build among equal ones
+        best = select_point(build_points, recall_target, latency_budget_ms)
+        candidates = [
+            p for p in build_points
+            if p.recall >= best.recall and p.latency_ms <= best.latency_ms
+        ]
+        best = min(candidates, key=lambda p: p.build_seconds)
+        cg.m_parameter = best.m_parameter
+        cg.ef_construction = best.ef_construction
+        report["sample_size"] = len(rows)
+        report["build"] = best.to_dict()
+        report["build_points"] = [p.to_dict() for p in build_points]
+    return report
@@ -0,0 +1,475 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import tempfile
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Type
+
+import nmslib
+import numpy as np
+import scipy
+from nmslib.dist import FloatIndex
+
+from .ann_index import AnnIndex
+from .brute_force import BruteForceIndex
+from .dense import (
+    DENSE_DTYPES,
+    IVF_MIN_ALIASES,
+    N_PROBE,
+    RESCORE_FACTOR,
+    DenseIndex,
+    DenseProjection,
+    fit_inverted_lists,
+    quantize,
+    rescore,
+)
+from .sharded_index import ShardedIndex, build_sharded_index
+
+BACKENDS: Dict[str, Type["AnnBackend"]] = {}
+
+
+def register_backend(name: str) -> Callable[[Type["AnnBackend"]], Type["AnnBackend"]]:
+    """Class decorator registering an AnnBackend under a name, so it can be
+    chosen with the `backend` setting of a CandidateGenerator
+
+    name (str): Backend name recorded in `cg_cfg`
+
+    RETURNS (Callable): The decorator
+    """
+
+    def register(cls: Type["AnnBackend"]) -> Type["AnnBackend"]:
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+
+    return register
+
+
+def get_backend(name: str, **params) -> "AnnBackend":
+    """Initialize a registered AnnBackend
+
+    name (str): Backend name
+    params: Backend specific params
+
+    RAISES:
+        ValueError: Unknown backend name
+
+    RETURNS (AnnBackend): The backend
+    """
+    if name not in BACKENDS:
+        raise ValueError(
+            f"Unknown ANN backend {name}, expected one of {tuple(BACKENDS)}"
+        )
+    return BACKENDS[name](**params)
+
+
+class AnnBackend:
+    """Builds, saves and loads the ANN index of a CandidateGenerator,
+    an `AnnIndex`.
+
+    The build params are the CandidateGenerator settings `m_parameter`,
+    `ef_construction`, `ef_search`, `n_threads` and `n_shards`. Backends
+    use the ones that apply to them.
+    """
+
+    name = ""
+    # whether `build` can split the aliases into `n_shards` indexes
+    supports_shards = False
+    # whether `efSearch` changes the results of the index, see `spacy_ann.autotune`
+    supports_ef_search = False
+
+    def build(
+        self,
+        alias_tfidfs: scipy.sparse.csr_matrix,
+        params: Dict[str, Any],
+        verbose: bool = False,
+    ) -> AnnIndex:
+        """Build an index over non-empty L2 normalized TF-IDF vectors
+
+        alias_tfidfs (scipy.sparse.csr_matrix): Vectors to index
+        params (Dict[str, Any]): Build params
+        verbose (bool): Print progress while building the index
+
+        RETURNS (AnnIndex): Index with the query time params set
+        """
+        raise NotImplementedError
+
+    def save(self, index: AnnIndex, path: Path) -> Dict[str, Any]:
+        """Save an index to `path`, and to files starting with `path` if it needs several
+
+        index (AnnIndex): Index returned by `build` or `load`
+        path (Path): File path
+
+        RETURNS (Dict[str, Any]): Entries `load` needs in `cfg`
+        """
+        raise NotImplementedError
+
+    def load(
+        self, path: Path, alias_tfidfs: scipy.sparse.csr_matrix, cfg: Dict[str, Any]
+    ) -> AnnIndex:
+        """Load an index saved with `save`
+
+        path (Path): Path passed to `save`
+        alias_tfidfs (scipy.sparse.csr_matrix): The indexed vectors
+        cfg (Dict[str, Any]): Contents of `cg_cfg`
+
+        RETURNS (AnnIndex): The loaded index
+        """
+        raise NotImplementedError
+
+    def size(self, path: Path) -> int:
+        """Size on disk of an index saved to `path` in bytes, the indexed
+        vectors are stored separately and not included
+
+        path (Path): Path passed to `save`
+
+        RETURNS (int): Size in bytes
+        """
+        path = Path(path)
+        return sum(
+            p.stat().st_size for p in path.parent.glob(f"{path.name}*") if p.is_file()
+        )
+
+
+def nmslib_index_params(params: Dict[str, Any]) -> Dict[str, Any]:
+    """nmslib HNSW params of the index or of each shard"""
+    # nmslib hyperparameters (very important)
+    # guide: https://github.com/nmslib/nmslib/blob/master/python_bindings/parameters.md
+    return {
+        "M": params["m_parameter"],
+        "indexThreadQty": max(1, params["n_threads"] // params.get("n_shards", 1)),
+        "efConstruction": params["ef_construction"],
+        "post": 0,
+    }
+
+
+def _init_nmslib_index() -> FloatIndex:
+    return nmslib.init(
+        method="hnsw",
+        space="cosinesimil_sparse",
+        data_type=nmslib.DataType.SPARSE_VECTOR,
+    )
+
+
+@register_backend("nmslib")
+class NmslibBackend(AnnBackend):
+    """nmslib HNSW index over the sparse TF-IDF vectors, optionally split into
+    shards built in parallel processes
+    """
+
+    supports_shards = True
+    supports_ef_search = True
+
+    def build(
+        self,
+        alias_tfidfs: scipy.sparse.csr_matrix,
+        params: Dict[str, Any],
+        verbose: bool = False,
+    ) -> AnnIndex:
+        index_params = nmslib_index_params(params)
+        n_shards = params.get("n_shards", 1)
+        if n_shards > 1:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                index, _, _ = build_sharded_index(
+                    None,
+                    index_params,
+                    params["ef_search"],
+                    n_shards,
+                    Path(tmp_dir),
+                    alias_tfidfs=alias_tfidfs,
+                )
+            return index
+        index = _init_nmslib_index()
+        index.addDataPointBatch(alias_tfidfs)
+        index.createIndex(index_params, print_progress=verbose)
+        index.setQueryTimeParams({"efSearch": params["ef_search"]})
+        return index
+
+    def save(self, index: AnnIndex, path: Path) -> Dict[str, Any]:
+        index.saveIndex(str(path), save_data=True)
+        if isinstance(index, ShardedIndex):
+            return {"shard_offsets": index.offsets}
+        return {}
+
+    def load(
+        self, path: Path, alias_tfidfs: scipy.sparse.csr_matrix, cfg: Dict[str, Any]
+    ) -> AnnIndex:
+        if "shard_offsets" in cfg:
+            return ShardedIndex.load(str(path), cfg["shard_offsets"])
+        index = _init_nmslib_index()
+        if Path(f"{path}.dat").exists():
+            index.loadIndex(str(path), load_data=True)
+        else:
+            # saved without its data, the vectors have to be added back first
+            index.addDataPointBatch(alias_tfidfs)
+            index.loadIndex(str(path))
+        return index
+
+
+@register_backend("brute_force")
+class BruteForceBackend(AnnBackend):
+    """Exact search without an index, see `BruteForceIndex`"""
+
+    def build(
+        self,
+        alias_tfidfs: scipy.sparse.csr_matrix,
+        params: Dict[str, Any],
+        verbose: bool = False,
+    ) -> BruteForceIndex:
+        return BruteForceIndex(alias_tfidfs)
+
+    def save(self, index: BruteForceIndex, path: Path) -> Dict[str, Any]:
+        return {}
+
+    def load(
+        self, path: Path, alias_tfidfs: scipy.sparse.csr_matrix, cfg: Dict[str, Any]
+    ) -> BruteForceIndex:
+        return BruteForceIndex(alias_tfidfs)
+
+
+class HnswlibIndex(AnnIndex):
+    """hnswlib HNSW index over dense projections of the TF-IDF vectors.
+    With re-scoring, `rescore_factor` times more neighbors than requested
+    are found in the projected space and re-scored exactly on the TF-IDF
+    vectors, so similarities are the same as with the sparse indexes.
+    """
+
+    def __init__(
+        self,
+        index: Any,
+        projection: DenseProjection,
+        alias_tfidfs: Optional[scipy.sparse.csr_matrix] = None,
+        rescore_factor: int = RESCORE_FACTOR,
+    ):
+        """Initialize a HnswlibIndex
+
+        index (hnswlib.Index): Index of the projected alias vectors
+        projection (DenseProjection): Projection of the TF-IDF vectors
+        alias_tfidfs (Optional[scipy.sparse.csr_matrix]): TF-IDF vectors of the aliases
+            to re-score the neighbors with, None to return the dense similarities
+        rescore_factor (int): Neighbors re-scored per requested neighbor
+        """
+        self.index = index
+        self.projection = projection
+        self.alias_tfidfs = (
+            None if alias_tfidfs is None else scipy.sparse.csr_matrix(alias_tfidfs)
+        )
+        self.rescore_factor = rescore_factor
+        self.ef_search = index.ef
+
+    def __len__(self) -> int:
+        return self.index.get_current_count()
+
+    def knnQueryBatch(
+        self, vectors: scipy.sparse.csr_matrix, k: int = 10, num_threads: int = 0
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        vectors = scipy.sparse.csr_matrix(vectors)
+        rescoring = self.alias_tfidfs is not None
+        n_candidates = min(k * self.rescore_factor if rescoring else k, len(self))
+        # hnswlib can't return more neighbors than the size of its search queue
+        self.index.set_ef(max(self.ef_search, n_candidates))
+        candidates, distances = self.index.knn_query(
+            self.projection.transform(vectors),
+            k=n_candidates,
+            num_threads=num_threads or -1,
+        )
+        if rescoring:
+            neighbors, similarities = rescore(
+                self.alias_tfidfs, vectors, candidates.astype(np.int64), k
+            )
+        else:
+            neighbors, similarities = candidates.astype(np.int32), 1.0 - distances
+        return [
+            (row_neighbors, 1.0 - row_similarities)
+            for row_neighbors, row_similarities in zip(neighbors, similarities)
+        ]
+
+    def setQueryTimeParams(self, params: Dict[str, Any]):
+        self.ef_search = params.get("efSearch", self.ef_search)
+        self.index.set_ef(self.ef_search)
+
+
+def _import_hnswlib():
+    try:
+        import hnswlib
+    except ImportError:
+        raise ImportError(
+            "The hnswlib backend requires hnswlib, install it with `pip install hnswlib`"
+        )
+    return hnswlib
+
+
+@register_backend("hnswlib")
+class HnswlibBackend(AnnBackend):
+    """hnswlib HNSW index over dense projections of the TF-IDF vectors, see
+    `HnswlibIndex`. Builds much faster than the sparse nmslib index and needs
+    the optional `hnswlib` package.
+    """
+
+    supports_ef_search = True
+
+    def __init__(
+        self,
+        n_components: int = 256,
+        rescore: bool = True,
+        rescore_factor: int = RESCORE_FACTOR,
+    ):
+        """Initialize a HnswlibBackend
+
+        n_components (int): Dimension of the projected vectors
+        rescore (bool): Re-score the neighbors exactly on the TF-IDF vectors
+        rescore_factor (int): Neighbors re-scored per requested neighbor
+        """
+        self.n_components = n_components
+        self.rescore = rescore
+        self.rescore_factor = rescore_factor
+
+    def build(
+        self,
+        alias_tfidfs: scipy.sparse.csr_matrix,
+        params: Dict[str, Any],
+        verbose: bool = False,
+    ) -> HnswlibIndex:
+        hnswlib = _import_hnswlib()
+        projection = DenseProjection.fit(alias_tfidfs, self.n_components)
+        index = hnswlib.Index(space="cosine", dim=projection.n_components)
+        index.init_index(
+            max_elements=alias_tfidfs.shape[0],
+            M=params["m_parameter"],
+            ef_construction=params["ef_construction"],
+        )
+        index.add_items(
+            projection.transform(alias_tfidfs),
+            np.arange(alias_tfidfs.shape[0]),
+            num_threads=params["n_threads"],
+        )
+        index.set_ef(params["ef_search"])
+        return HnswlibIndex(
+            index,
+            projection,
+            alias_tfidfs if self.rescore else None,
+            rescore_factor=self.rescore_factor,
+        )
+
+    def save(self, index: HnswlibIndex, path: Path) -> Dict[str, Any]:
+        index.index.save_index(str(path))
+        index.projection.to_disk(Path(f"{path}.projection.npy"))
+        return {"n_components": index.projection.n_components}
+
+    def load(
+        self, path: Path, alias_tfidfs: scipy.sparse.csr_matrix, cfg: Dict[str, Any]
+    ) -> HnswlibIndex:
+        hnswlib = _import_hnswlib()
+        index = hnswlib.Index(space="cosine", dim=cfg["n_components"])
+        index.load_index(str(path), max_elements=alias_tfidfs.shape[0])
+        index.set_ef(cfg.get("ef_search", 200))
+        projection = DenseProjection.from_disk(Path(f"{path}.projection.npy"))
+        return HnswlibIndex(
+            index,
+            projection,
+            alias_tfidfs if self.rescore else None,
+            rescore_factor=self.rescore_factor,
+        )
+
+
+@register_backend("dense")
+class DenseBackend(AnnBackend):
+    """Dense projections of the TF-IDF vectors stored as int8 or float16 in
+    inverted lists, see `DenseIndex`. The vectors are memory-mapped on load.
+    """
+
+    def __init__(
+        self,
+        n_components: int = 128,
+        dtype: str = "int8",
+        rescore: bool = True,
+        rescore_factor: int = RESCORE_FACTOR,
+        n_lists: Optional[int] = None,
+        n_probe: int = N_PROBE,
+    ):
+        """Initialize a DenseBackend
+
+        n_components (int): Dimension of the projected vectors
+        dtype (str): Storage type of the projected vectors, see `DENSE_DTYPES`
+        rescore (bool): Re-score the top candidates exactly on the TF-IDF vectors
+        rescore_factor (int): Candidates re-scored per requested neighbor
+        n_lists (Optional[int]): Number of inverted lists, 0 scans all vectors.
+            If None, indexes with at least `IVF_MIN_ALIASES` aliases get about the
+            square root of the number of aliases and smaller ones are scanned.
+        n_probe (int): Inverted lists searched per query, more lists give a
+            better recall and slower queries
+        """
+        if dtype not in DENSE_DTYPES:
+            raise ValueError(f"Unknown dtype {dtype}, expected one of {DENSE_DTYPES}")
+        self.n_components = n_components
+        self.dtype = dtype
+        self.rescore = rescore
+        self.rescore_factor = rescore_factor
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+
+    def _get_n_lists(self, n_aliases: int) -> int:
+        if self.n_lists is not None:
+            return self.n_lists
+        return int(np.sqrt(n_aliases)) if n_aliases >= IVF_MIN_ALIASES else 0
+
+    def build(
+        self,
+        alias_tfidfs: scipy.sparse.csr_matrix,
+        params: Dict[str, Any],
+        verbose: bool = False,
+    ) -> DenseIndex:
+        projection = DenseProjection.fit(alias_tfidfs, self.n_components)
+        dense = projection.transform(alias_tfidfs)
+        centroids = list_rows = list_offsets = None
+        n_lists = self._get_n_lists(dense.shape[0])
+        if n_lists:
+            centroids, list_rows, list_offsets = fit_inverted_lists(dense, n_lists)
+            dense = dense[list_rows]
+        vectors, scales = quantize(dense, self.dtype)
+        return DenseIndex(
+            vectors,
+            scales,
+            projection,
+            alias_tfidfs if self.rescore else None,
+            rescore_factor=self.rescore_factor,
+            centroids=centroids,
+            list_rows=list_rows,
+            list_offsets=list_offsets,
+            n_probe=self.n_probe,
+        )
+
+    def save(self, index: DenseIndex, path: Path) -> Dict[str, Any]:
+        np.save(f"{path}.vectors.npy", index.vectors)
+        if index.scales is not None:
+            np.save(f"{path}.scales.npy", index.scales)
+        index.projection.to_disk(Path(f"{path}.projection.npy"))
+        if index.centroids is not None:
+            np.save(f"{path}.centroids.npy", index.centroids)
+            np.save(f"{path}.list_rows.npy", index.list_rows)
+            np.save(f"{path}.list_offsets.npy", index.list_offsets)
+        return {}
+
+    def load(
+        self, path: Path, alias_tfidfs: scipy.sparse.csr_matrix, cfg: Dict[str, Any]
+    ) -> DenseIndex:
+        vectors = np.load(f"{path}.vectors.npy", mmap_mode="r")
+        scales_path = Path(f"{path}.scales.npy")
+        scales = np.load(scales_path) if scales_path.exists() else None
+        projection = DenseProjection.from_disk(Path(f"{path}.projection.npy"))
+        centroids = list_rows = list_offsets = None
+        if Path(f"{path}.centroids.npy").exists():
+            centroids = np.load(f"{path}.centroids.npy")
+            list_rows = np.load(f"{path}.list_rows.npy", mmap_mode="r")
+            list_offsets = np.load(f"{path}.list_offsets.npy")
+        return DenseIndex(
+            vectors,
+            scales,
+            projection,
+            alias_tfidfs if self.rescore else None,
+            rescore_factor=self.rescore_factor,
+            centroids=centroids,
+            list_rows=list_rows,
+            list_offsets=list_offsets,
+            n_probe=self.n_probe,
+        )
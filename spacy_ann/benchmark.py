@@ -0,0 +1,301 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import multiprocessing
+import os
+import platform
+import random
+import resource
+from pathlib import Path
+from timeit import default_timer as timer
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy
+
+from .api.memory import MB, get_memory_usage
+from .backends import AnnIndex
+from .brute_force import BruteForceIndex
+from .candidate_generator import CandidateGenerator
+
+SYLLABLES = [
+    c + v for c in "bcdfghjklmnprstvwz" for v in ["a", "e", "i", "o", "u", "ai", "ou"]
+]
+
+
+def generate_aliases(n: int, seed: int = 0) -> List[str]:
+    """Unique synthetic aliases of 1 to 3 words made of random syllables
+
+    n (int): Number of aliases
+    seed (int): Random seed
+
+    RETURNS (List[str]): Aliases
+    """
+    rng = np.random.default_rng(seed)
+    aliases: Dict[str, None] = {}
+    while len(aliases) < n:
+        batch = max(n - len(aliases), 1024)
+        n_words = rng.integers(1, 4, size=batch)
+        n_syllables = rng.integers(1, 5, size=n_words.sum())
+        syllables = rng.integers(0, len(SYLLABLES), size=n_syllables.sum()).tolist()
+        words = []
+        start = 0
+        for count in n_syllables.tolist():
+            words.append("".join(SYLLABLES[i] for i in syllables[start:start + count]))
+            start += count
+        start = 0
+        for count in n_words.tolist():
+            alias = " ".join(words[start:start + count])
+            aliases[alias.title() if len(aliases) % 2 else alias] = None
+            start += count
+    return list(aliases)[:n]
+
+
+def generate_mentions(
+    aliases: Sequence[str], n: int, noise: float = 0.5, seed: int = 0
+) -> List[str]:
+    """Mentions sampled from aliases. With probability `noise` a mention gets
+    one character deleted, replaced or transposed, so it needs a nearest
+    neighbor search instead of an exact match.
+
+    aliases (Sequence[str]): Aliases to sample
+    n (int): Number of mentions
+    noise (float): Probability of a typo in a mention
+    seed (int): Random seed
+
+    RETURNS (List[str]): Mentions
+    """
+    rng = random.Random(seed)
+    mentions = []
+    for _ in range(n):
+        mention = aliases[rng.randrange(len(aliases))]
+        if len(mention) > 1 and rng.random() < noise:
+            i = rng.randrange(len(mention) - 1)
+            edit = rng.randrange(3)
+            if edit == 0:
+                mention = mention[:i] + mention[i + 1:]
+            elif edit == 1:
+                mention = mention[:i] + rng.choice("aeioubdkst") + mention[i + 1:]
+            else:
+                mention = mention[:i] + mention[i + 1] + mention[i] + mention[i + 2:]
+        mentions.append(mention)
+    return mentions
+
+
+def exact_knn(
+    alias_tfidfs: scipy.sparse.csr_matrix, vectors: scipy.sparse.csr_matrix, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact cosine k nearest neighbors, the ground truth of recall measurements
+
+    alias_tfidfs (scipy.sparse.csr_matrix): L2 normalized alias vectors
+    vectors (scipy.sparse.csr_matrix): L2 normalized query vectors
+    k (int): Number of neighbors
+
+    RETURNS (Tuple[np.ndarray, np.ndarray]): `(n, k)` neighbors and similarities,
+        most similar first
+    """
+    return BruteForceIndex(alias_tfidfs).knn(vectors, k)
+
+
+def query_index(
+    ann_index: AnnIndex,
+    vectors: scipy.sparse.csr_matrix,
+    k: int,
+    batch_size: int = 32,
+    num_threads: int = 1,
+) -> Tuple[np.ndarray, np.ndarray, float]:
+    """Query an index in batches and time the queries
+
+    ann_index (AnnIndex): Index to query
+    vectors (scipy.sparse.csr_matrix): Non-empty query vectors
+    k (int): Number of neighbors
+    batch_size (int): Queries per `knnQueryBatch` call
+    num_threads (int): Query threads
+
+    RETURNS (Tuple[np.ndarray, np.ndarray, float]): `(n, k)` similarities, validity mask
+        and mean latency per query in ms
+    """
+    similarities = np.zeros((vectors.shape[0], k), dtype=np.float32)
+    mask = np.zeros((vectors.shape[0], k), dtype=bool)
+    elapsed = 0.0
+    for start in range(0, vectors.shape[0], batch_size):
+        batch = vectors[start:start + batch_size]
+        start_time = timer()
+        results = ann_index.knnQueryBatch(batch, k=k, num_threads=num_threads)
+        elapsed += timer() - start_time
+        for row, (_, dist) in enumerate(results, start):
+            similarities[row, :len(dist)] = 1.0 - dist
+            mask[row, :len(dist)] = True
+    return similarities, mask, elapsed * 1000 / max(vectors.shape[0], 1)
+
+
+def recall_at_k(
+    similarities: np.ndarray,
+    mask: np.ndarray,
+    exact_similarities: np.ndarray,
+    tolerance: float = 1e-5,
+) -> float:
+    """Fraction of the exact k nearest neighbors found by an approximate search.
+    Neighbors are compared by similarity so ties at the k-th neighbor count as found.
+
+    similarities (np.ndarray): `(n, k)` similarities of the approximate neighbors
+    mask (np.ndarray): `(n, k)` validity mask of the approximate neighbors
+    exact_similarities (np.ndarray): `(n, k)` similarities of the exact neighbors
+
+    RETURNS (float): Mean recall@k over the queries with a non-empty vector
+    """
+    k = exact_similarities.shape[1]
+    kth = exact_similarities[:, -1:] - tolerance
+    expected = (exact_similarities > 0).sum(axis=1)
+    found = ((similarities[:, :k] >= kth) & mask[:, :k] & (similarities[:, :k] > 0)).sum(axis=1)
+    rows = expected > 0
+    if not rows.any():
+        return 1.0
+    return float(np.mean(np.minimum(found[rows], expected[rows]) / expected[rows]))
+
+
+def measure_recall(
+    cg: CandidateGenerator, mentions: List[str], k: Optional[int] = None
+) -> float:
+    """recall@k of the ANN index of a CandidateGenerator against exact search,
+    1.0 if it searches exactly
+
+    cg (CandidateGenerator): Fitted CandidateGenerator
+    mentions (List[str]): Query mentions
+    k (Optional[int]): Number of neighbors, defaults to `cg.k`
+
+    RETURNS (float): Mean recall@k
+    """
+    k = min(k or cg.k, len(cg.aliases))
+    if isinstance(cg.ann_index, BruteForceIndex):
+        return 1.0
+    vectors = scipy.sparse.csr_matrix(cg._query_vectorizer.transform(mentions))
+    vectors = vectors[np.asarray(vectors.sum(axis=1)).reshape(-1) != 0]
+    similarities, mask, _ = query_index(cg.ann_index, vectors, k)
+    _, exact_similarities = exact_knn(cg.alias_tfidfs, vectors, k)
+    return recall_at_k(similarities, mask, exact_similarities)
+
+
+def measure_queries(
+    cg: CandidateGenerator, mentions: List[str], batch_size: int
+) -> Dict[str, Any]:
+    """Throughput and latency of `cg(batch)` over batches of mentions.
+    The candidate cache is cleared before each batch so every batch is a cold query.
+
+    cg (CandidateGenerator): Fitted CandidateGenerator
+    mentions (List[str]): Query mentions
+    batch_size (int): Mentions per batch
+
+    RETURNS (Dict[str, Any]): Mentions per second and p50/p95/p99 batch latency in ms
+    """
+    latencies = []
+    for start in range(0, len(mentions), batch_size):
+        batch = mentions[start:start + batch_size]
+        cg.cache.clear()
+        start_time = timer()
+        cg(batch)
+        latencies.append(timer() - start_time)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "batch_size": batch_size,
+        "n_batches": len(latencies),
+        "mentions_per_second": len(mentions) / sum(latencies) if latencies else 0.0,
+        "latency_ms": {
+            f"p{q}": float(np.percentile(latencies_ms, q)) for q in (50, 95, 99)
+        },
+    }
+
+
+def directory_size(path: Path) -> int:
+    """Total size of the files under a directory in bytes"""
+    return sum(p.stat().st_size for p in Path(path).rglob("*") if p.is_file())
+
+
+def _fit_and_save(
+    aliases: List[str], cg_params: Dict[str, Any], path: str
+) -> Dict[str, float]:
+    """Fit and save a CandidateGenerator. Runs in a fresh process so peak RSS
+    only covers the fit.
+    """
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    start_time = timer()
+    cg = CandidateGenerator(**cg_params).fit(aliases)
+    fit_seconds = timer() - start_time
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    peak_workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+    cg.to_disk(path)
+    return {
+        "seconds": fit_seconds,
+        "n_indexed": len(cg.aliases),
+        "baseline_rss_mb": baseline / MB,
+        "peak_rss_mb": peak / MB,
+        "peak_worker_rss_mb": peak_workers / MB,
+    }
+
+
+def run_benchmark(
+    aliases: List[str],
+    path: Path,
+    cg_params: Dict[str, Any],
+    mentions: List[str],
+    batch_sizes: Sequence[int],
+    recall_queries: int = 1000,
+) -> Dict[str, Any]:
+    """Fit, save, load and query a CandidateGenerator on a set of aliases
+
+    aliases (List[str]): Aliases to index
+    path (Path): Directory to save the CandidateGenerator to
+    cg_params (Dict[str, Any]): CandidateGenerator params
+    mentions (List[str]): Query mentions
+    batch_sizes (Sequence[int]): Query batch sizes to measure
+    recall_queries (int): Number of mentions used to measure recall@k
+
+    RETURNS (Dict[str, Any]): Fit, disk, load, query and recall results
+    """
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        fit = pool.apply(_fit_and_save, (aliases, cg_params, str(path)))
+
+    rss_before = get_memory_usage().get("rss", 0)
+    start_time = timer()
+    cg = CandidateGenerator().from_disk(path)
+    load_seconds = timer() - start_time
+    rss_after = get_memory_usage().get("rss", 0)
+
+    queries = [measure_queries(cg, mentions, batch_size) for batch_size in batch_sizes]
+    return {
+        "n_aliases": len(aliases),
+        "ann_index": cg.ann_backend.name,
+        "fit": fit,
+        "disk": {
+            "bytes": directory_size(path),
+            "index_bytes": cg.ann_backend.size(path / "cg" / "ann_index.bin"),
+        },
+        "load": {"seconds": load_seconds, "rss_mb": (rss_after - rss_before) / MB},
+        "query": queries,
+        "recall": {
+            "k": cg.k,
+            "recall_at_k": measure_recall(cg, mentions[:recall_queries]),
+        },
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """Versions and hardware the benchmark ran on"""
+    import nmslib
+    import sklearn
+
+    from . import __version__
+
+    return {
+        "spacy_ann": __version__,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "sklearn": sklearn.__version__,
+        "nmslib": getattr(nmslib, "__version__", "unknown"),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+    }
@@ -0,0 +1,99 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from typing import List, Tuple
+
+import numpy as np
+import scipy
+
+from .ann_index import AnnIndex
+
+# maximum number of cells of the dense similarity block of one chunk of queries
+MAX_CHUNK_CELLS = 2 ** 24
+# largest index the "auto" policy searches exactly, one exact query costs about
+# as much as an HNSW query (efSearch 200) at 100,000 aliases and grows linearly.
+# Batching doesn't change this, the sparse product costs the same per query.
+BRUTE_FORCE_MAX_ALIASES = 100000
+
+
+class BruteForceIndex(AnnIndex):
+    """Exact cosine kNN over L2 normalized sparse TF-IDF vectors. Queries are
+    split in chunks, each chunk is one sparse matrix product with all aliases
+    followed by an `argpartition` top k, so memory stays bounded by
+    `max_chunk_cells`.
+    """
+
+    def __init__(
+        self,
+        alias_tfidfs: scipy.sparse.csr_matrix,
+        max_chunk_cells: int = MAX_CHUNK_CELLS,
+    ):
+        """Initialize a BruteForceIndex
+
+        alias_tfidfs (scipy.sparse.csr_matrix): L2 normalized alias vectors
+        max_chunk_cells (int): Maximum number of cells of a dense similarity block
+        """
+        self.alias_tfidfs = scipy.sparse.csr_matrix(alias_tfidfs)
+        self.max_chunk_cells = max_chunk_cells
+        self._alias_tfidfs_t = None
+
+    def __len__(self) -> int:
+        return self.alias_tfidfs.shape[0]
+
+    def knn(
+        self, vectors: scipy.sparse.csr_matrix, k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact k nearest neighbors of each vector
+
+        vectors (scipy.sparse.csr_matrix): L2 normalized query vectors
+        k (int): Number of neighbors
+
+        RETURNS (Tuple[np.ndarray, np.ndarray]): `(n, k)` int32 neighbors and float32
+            similarities, most similar first. Ties keep the alias order.
+        """
+        n_aliases = len(self)
+        k = min(k, n_aliases)
+        n_vectors = vectors.shape[0]
+        neighbors = np.zeros((n_vectors, k), dtype=np.int32)
+        similarities = np.zeros((n_vectors, k), dtype=np.float32)
+        if k == 0 or n_vectors == 0:
+            return neighbors, similarities
+
+        if self._alias_tfidfs_t is None:
+            self._alias_tfidfs_t = scipy.sparse.csr_matrix(self.alias_tfidfs.T)
+        vectors = scipy.sparse.csr_matrix(vectors)
+        chunk_size = max(1, self.max_chunk_cells // n_aliases)
+        for start in range(0, n_vectors, chunk_size):
+            end = min(start + chunk_size, n_vectors)
+            block = (vectors[start:end] @ self._alias_tfidfs_t).toarray()
+            if k < n_aliases:
+                top = np.argpartition(-block, k - 1, axis=1)[:, :k]
+            else:
+                top = np.broadcast_to(np.arange(n_aliases), (end - start, n_aliases))
+            top_similarities = np.take_along_axis(block, top, axis=1)
+            order = np.lexsort((top, -top_similarities), axis=1)
+            neighbors[start:end] = np.take_along_axis(top, order, axis=1)
+            similarities[start:end] = np.take_along_axis(top_similarities, order, axis=1)
+        return neighbors, similarities
+
+    def knnQueryBatch(
+        self, vectors: scipy.sparse.csr_matrix, k: int = 10, num_threads: int = 0
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        neighbors, similarities = self.knn(vectors, k)
+        return [
+            (row_neighbors, 1.0 - row_similarities)
+            for row_neighbors, row_similarities in zip(neighbors, similarities)
+        ]
+
+
+def use_brute_force(n_aliases: int, max_aliases: int = BRUTE_FORCE_MAX_ALIASES) -> bool:
+    """Whether exact search is expected to be as fast as HNSW.
+    Exact search costs a sparse product with all aliases per query,
+    HNSW a graph walk that grows slowly with the number of aliases.
+
+    n_aliases (int): Number of indexed aliases
+    max_aliases (int): Largest index searched exactly
+
+    RETURNS (bool): True to search exactly
+    """
+    return n_aliases <= max_aliases
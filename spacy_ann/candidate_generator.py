@@ -4,21 +4,48 @@
 # Adapted from https://github.com/allenai/scispacy/blob/master/scispacy/candidate_generation.py
 # for use with spaCy InMemoryLookupKB
 
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from timeit import default_timer as timer
-from typing import List, Set, Tuple, Dict
+from typing import Any, Iterable, List, Optional, Sequence, Set, Tuple, Dict
 import joblib
-import nmslib
 import numpy as np
 import scipy
 import srsly
-from nmslib.dist import FloatIndex
 from sklearn.feature_extraction.text import TfidfVectorizer
-from spacy.util import from_disk, to_disk
+from spacy.util import ensure_path, from_disk, to_disk
 from wasabi import Printer
 from .types import AliasCandidate
+from .backends import AnnBackend, AnnIndex, get_backend, nmslib_index_params
+from .brute_force import BruteForceIndex, use_brute_force
+from .char_vectorizer import make_query_vectorizer
+from .exact_aliases import ExactAliasIndex
 from .consts import stopwords
-from .util import FrequencyCache
+from .sharded_index import (
+    build_sharded_index,
+    count_terms,
+    merge_term_counts,
+    shard_bounds,
+)
+from .string_table import StringTable
+from .util import CacheStats, FrequencyCache, knn_to_alias_candidates
+
+# Version of the on-disk layout written by `CandidateGenerator.to_disk`
+FORMAT_VERSION = 2
+INDEX_TYPES = ("auto", "hnsw", "brute_force")
+
+# Maximum number of extra neighbors queried from the main index to make up
+# for removed aliases. Compact the index if many more aliases are removed.
+MAX_TOMBSTONE_OVERFETCH = 100
+
+LEGACY_FILES = (
+    "aliases.json",
+    "short_aliases.json",
+    "ann_index.bin",
+    "tfidf_vectorizer.joblib",
+    "tfidf_vectors_sparse.npz",
+)
 
 
 class CandidateGenerator:
@@ -40,7 +67,13 @@ class CandidateGenerator:
         ef_search: int = 200,
         ef_construction: int = 2000,
         n_threads: int = 60,
-        max_cache_size: int = 10000
+        max_cache_size: int = 10000,
+        max_cache_bytes: Optional[int] = None,
+        n_shards: int = 1,
+        exact_match: bool = True,
+        index_type: str = "auto",
+        backend: str = "nmslib",
+        backend_params: Optional[Dict[str, Any]] = None,
     ):
         """Initialize a CandidateGenerator
 
@@ -52,78 +85,313 @@ class CandidateGenerator:
             Improves recall at the expense of longer **indexing** time
         n_threads (int): Number of threads to use when creating the index. 
             Change based on your machine.
+        max_cache_size (int): Maximum number of mentions in the candidate cache
+        max_cache_bytes (Optional[int]): Maximum approximate memory of the candidate
+            cache in bytes. If None the cache is bounded by `max_cache_size` only.
+        n_shards (int): Number of HNSW indexes to split the aliases into. Shards are
+            built in parallel processes and queried together.
+        exact_match (bool): Resolve mentions equal to an alias after the vectorizer's
+            normalization (case, whitespace) with similarity 1.0, without querying
+            the ANN index.
+        index_type (str): "hnsw" to always build and query the HNSW index,
+            "brute_force" to search exactly without building one, or "auto" to search
+            exactly when there are at most `BRUTE_FORCE_MAX_ALIASES` aliases and to
+            build the HNSW index otherwise.
+        backend (str): Registered AnnBackend building the ANN index: "nmslib",
+            "hnswlib" (needs the hnswlib package) or "dense", see `spacy_ann.backends`
+        backend_params (Optional[Dict[str, Any]]): Backend specific params,
+            like `n_components` and `dtype` of the dense backend
         """
+        if index_type not in INDEX_TYPES:
+            raise ValueError(
+                f"Unknown index_type {index_type}, expected one of {INDEX_TYPES}"
+            )
         self.k = k
         self.m_parameter = m_parameter
         self.ef_search = ef_search
         self.ef_construction = ef_construction
         self.n_threads = n_threads
+        self.n_shards = n_shards
+        self.exact_match = exact_match
+        self.index_type = index_type
+        self.backend = backend
+        self.backend_params = dict(backend_params or {})
+        # raises for unknown backends before anything is fitted
+        get_backend(self.backend, **self.backend_params)
         self.ann_index = True
-        self.cache = FrequencyCache(max_size=max_cache_size)
-        self._cache_hits = 0
-        self._cache_misses = 0
+        self.cache = FrequencyCache(max_size=max_cache_size, max_bytes=max_cache_bytes)
+        # incremented whenever the searchable aliases change
+        self.revision = 0
+        self._reset_delta()
+
+    @property
+    def cache_stats(self) -> CacheStats:
+        """Hit, miss and eviction counters of the candidate cache
+
+        RETURNS (CacheStats): Cache statistics
+        """
+        return self.cache.stats
 
     def _initialize(
         self,
         aliases: List[str],
         short_aliases: Set[str],
-        ann_index: FloatIndex,
+        ann_index: AnnIndex,
         vectorizer: TfidfVectorizer,
         alias_tfidfs: scipy.sparse.csr_matrix,
+        exact_aliases: Optional[ExactAliasIndex] = None,
     ):
         """Used in `fit` and `from_disk` to initialize the CandidateGenerator with computed
         # TF-IDF Vectorizer and ANN Index
 
         aliases (List[str]): Aliases with vectors contained in the ANN Index
         short_aliases (Set[str]): Aliases too short for a TF-IDF representation
-        ann_index (FloatIndex): Computed ANN Index of TF-IDF representations for aliases
+        ann_index (AnnIndex): Computed ANN Index of TF-IDF representations for aliases
         vectorizer (TfidfVectorizer): TF-IDF Vectorizer to get vector representation of aliases
         alias_tfidfs (scipy.sparse.csr_matrix): Computed TF-IDF Sparse Vectors for aliases
+        exact_aliases (Optional[ExactAliasIndex]): Rows of the aliases by normal form,
+            built from the aliases if None
         """
         self.aliases = aliases
         self.short_aliases = short_aliases
         self.ann_index = ann_index
         self.vectorizer = vectorizer
         self.alias_tfidfs = alias_tfidfs
+        self._preprocess = vectorizer.build_preprocessor()
+        # numerically identical to `vectorizer.transform`, but faster on small batches
+        self._query_vectorizer = make_query_vectorizer(vectorizer)
+        # built before `freeze_loaded_objects` rather than on the first query
+        if exact_aliases is None:
+            exact_aliases = ExactAliasIndex.build(self._normalize(a) for a in aliases)
+        self.exact_aliases = exact_aliases
+        self._reset_delta()
+        self.cache.clear()
+
+    def _reset_delta(self):
+        """Clear the delta segment and the tombstones of removed aliases"""
+        # aliases added since the ANN index was built, searched exactly
+        self.delta_aliases: List[str] = []
+        self.delta_tfidfs: Optional[scipy.sparse.csr_matrix] = None
+        # removed rows of the ANN index
+        self.tombstones: Optional[np.ndarray] = None
+        self._alias_rows: Optional[Dict[str, int]] = None
+        # delta aliases by normal form, the delta segment is small
+        self._delta_exact_aliases: Dict[str, List[str]] = {}
+
+    @property
+    def n_removed(self) -> int:
+        """Number of removed aliases still stored in the ANN index"""
+        return 0 if self.tombstones is None else int(self.tombstones.sum())
+
+    def _get_alias_rows(self) -> Dict[str, int]:
+        """Row of each alias in the ANN index, built on first use"""
+        if self._alias_rows is None:
+            self._alias_rows = {alias: i for i, alias in enumerate(self.aliases)}
+        return self._alias_rows
+
+    def contains_alias(self, alias: str) -> bool:
+        """Whether an alias is searchable, taking added and removed aliases into account
+
+        alias (str): Alias to check
+
+        RETURNS (bool): True if the alias is in the index, the delta segment or
+            the short aliases
+        """
+        row = self._get_alias_rows().get(alias)
+        if row is not None and not (self.tombstones is not None and self.tombstones[row]):
+            return True
+        return alias in self.delta_aliases or alias in self.short_aliases
+
+    def add_aliases(self, aliases: Iterable[str]) -> int:
+        """Make new aliases searchable without rebuilding the ANN index.
+        New aliases are vectorized with the fitted vectorizer and stored in a
+        small delta segment that is searched exactly, removed aliases of the
+        ANN index are restored. Use `compact` to fold the delta into the index.
+
+        aliases (Iterable[str]): Aliases to add
+
+        RETURNS (int): Number of aliases added. Like in `fit`, short aliases are
+            matched exactly, other aliases with an empty TF-IDF vector can't be
+            found and are not added
+        """
+        self.require_ann_index()
+        alias_rows = self._get_alias_rows()
+        new_aliases = []
+        n_added = 0
+        for alias in dict.fromkeys(aliases):
+            if self.contains_alias(alias):
+                continue
+            row = alias_rows.get(alias)
+            if row is not None:
+                self.tombstones[row] = False
+                n_added += 1
+                if len(alias) < 4:
+                    self.short_aliases.add(alias)
+            else:
+                new_aliases.append(alias)
+
+        if new_aliases:
+            # short aliases are matched exactly, even with empty vectors, see `fit`
+            self.short_aliases.update(alias for alias in new_aliases if len(alias) < 4)
+            tfidfs = scipy.sparse.csr_matrix(self._query_vectorizer.transform(new_aliases))
+            non_empty = np.asarray(tfidfs.sum(axis=1)).reshape(-1) != 0
+            n_added += sum(
+                1 for alias, flag in zip(new_aliases, non_empty) if flag or len(alias) < 4
+            )
+            new_aliases = [alias for alias, flag in zip(new_aliases, non_empty) if flag]
+            self.delta_aliases.extend(new_aliases)
+            tfidfs = tfidfs[non_empty]
+            self.delta_tfidfs = (
+                tfidfs if self.delta_tfidfs is None
+                else scipy.sparse.vstack([self.delta_tfidfs, tfidfs], format="csr")
+            )
+
+        if n_added:
+            self._aliases_changed()
+        return n_added
+
+    def remove_aliases(self, aliases: Iterable[str]) -> int:
+        """Stop returning aliases as candidates without rebuilding the ANN index.
+        Aliases of the ANN index are marked in a tombstone bitmap and
+        filtered from query results, aliases of the delta segment are deleted.
+
+        aliases (Iterable[str]): Aliases to remove
+
+        RETURNS (int): Number of aliases removed
+        """
+        self.require_ann_index()
+        alias_rows = self._get_alias_rows()
+        to_remove = set(aliases)
+        n_removed = 0
+        for alias in to_remove:
+            row = alias_rows.get(alias)
+            if row is not None:
+                if self.tombstones is None:
+                    self.tombstones = np.zeros(len(self.aliases), dtype=bool)
+                if not self.tombstones[row]:
+                    self.tombstones[row] = True
+                    n_removed += 1
+            elif alias in self.short_aliases and alias not in self.delta_aliases:
+                n_removed += 1
+            self.short_aliases.discard(alias)
+
+        keep = [i for i, alias in enumerate(self.delta_aliases) if alias not in to_remove]
+        if len(keep) < len(self.delta_aliases):
+            n_removed += len(self.delta_aliases) - len(keep)
+            self.delta_aliases = [self.delta_aliases[i] for i in keep]
+            self.delta_tfidfs = self.delta_tfidfs[keep] if keep else None
+
+        if n_removed:
+            self._aliases_changed()
+        return n_removed
+
+    def compact(self, verbose: bool = False):
+        """Rebuild the ANN index from its remaining aliases and the delta segment.
+        The fitted vectorizer is kept so the vectors of existing aliases don't change.
+
+        verbose (bool): Print progress while building the index
+
+        RETURNS (CandidateGenerator): The compacted CandidateGenerator
+        """
+        self.require_ann_index()
+        if not self.delta_aliases and not self.n_removed:
+            return self
+        keep = (
+            np.ones(len(self.aliases), dtype=bool)
+            if self.tombstones is None else ~self.tombstones
+        )
+        aliases = [self.aliases[i] for i in np.flatnonzero(keep).tolist()]
+        aliases.extend(self.delta_aliases)
+        blocks = [scipy.sparse.csr_matrix(self.alias_tfidfs)[keep]]
+        if self.delta_tfidfs is not None:
+            blocks.append(self.delta_tfidfs)
+        alias_tfidfs = scipy.sparse.vstack(blocks, format="csr").astype(np.float32)
+
+        ann_index = self._build_index(alias_tfidfs, verbose=verbose)
+        self._initialize(
+            aliases, self.short_aliases, ann_index, self.vectorizer, alias_tfidfs
+        )
+        self.revision += 1
+        return self
+
+    def _aliases_changed(self):
+        self.cache.clear()
+        self._index_delta_aliases()
+        self.revision += 1
+
+    def _index_delta_aliases(self):
+        delta_exact_aliases: Dict[str, List[str]] = {}
+        for alias in self.delta_aliases:
+            delta_exact_aliases.setdefault(self._normalize(alias), []).append(alias)
+        self._delta_exact_aliases = delta_exact_aliases
+
+    def _normalize(self, text: str) -> str:
+        """Normalize a mention or alias like the vectorizer does before
+        extracting n-grams, so equal normal forms have equal TF-IDF vectors.
+        """
+        return " ".join(self._preprocess(text).split())
+
+    def _exact_candidates(self, mention: str) -> Optional[List[AliasCandidate]]:
+        """AliasCandidates of a mention found without the ANN index
 
-    def fit(self, kb_aliases: List[str], verbose: bool = False):
+        mention (str): Entity mention
+
+        RETURNS (Optional[List[AliasCandidate]]): The short alias or aliases equal to
+            the mention after normalization, None if it has to be searched
+        """
+        if mention in self.short_aliases:
+            return [AliasCandidate(alias=mention, similarity=1.0)]
+        if not self.exact_match:
+            return None
+        normal_form = self._normalize(mention)
+        aliases = []
+        for row in self.exact_aliases.lookup(normal_form).tolist():
+            if self.tombstones is not None and self.tombstones[row]:
+                continue
+            alias = self.aliases[row]
+            # normal forms with the same hash share a key
+            if self._normalize(alias) == normal_form:
+                aliases.append(alias)
+        aliases.extend(self._delta_exact_aliases.get(normal_form, []))
+        if not aliases:
+            return None
+        return [AliasCandidate(alias=alias, similarity=1.0) for alias in aliases[:self.k]]
+
+    def fit(
+        self,
+        kb_aliases: List[str],
+        verbose: bool = False,
+        n_processes: Optional[int] = None,
+    ):
         """Build tfidf vectorizer and ann index.
         Warning: Running this function can take a lot of memory
 
         kb_aliases (List[str]): Aliases in the KnoweledgeBase to fit 
             the ANN index on.
         verbose (bool, optional): Set to True to get print updates while fitting the index. Defaults to False.
+        n_processes (Optional[int]): Worker processes for a sharded build, defaults to `n_shards`
 
         RETURNS (CandidateGenerator): An initialized CandidateGenerator
         """
+        if (
+            self.n_shards > 1
+            and self._get_backend().supports_shards
+            and self._needs_hnsw(len(kb_aliases))
+        ):
+            return self._fit_sharded(kb_aliases, verbose=verbose, n_processes=n_processes)
+
         msg = Printer(no_print=verbose)
 
         # kb_aliases = self.kb.get_alias_strings()
         short_aliases = set([a for a in kb_aliases if len(a) < 4])
 
-        # nmslib hyperparameters (very important)
-        # guide: https://github.com/nmslib/nmslib/blob/master/python_bindings/parameters.md
-        # m_parameter = 100
-        # # `C` for Construction. Set to the maximum recommended value
-        # # Improves recall at the expense of longer indexing time
-        # construction = 2000
-        # num_threads = 60  # set based on the machine
-        index_params = {
-            "M": self.m_parameter,
-            "indexThreadQty": self.n_threads,
-            "efConstruction": self.ef_construction,
-            "post": 0,
-        }
-
         # NOTE: here we are creating the tf-idf vectorizer with float32 type, but we can serialize the
         # resulting vectors using float16, meaning they take up half the memory on disk. Unfortunately
         # we can't use the float16 format to actually run the vectorizer, because of this bug in sparse
         # matrix representations in scipy: https://github.com/scipy/scipy/issues/7408
 
         msg.text(f"Fitting tfidf vectorizer on {len(kb_aliases)} aliases")
-        tfidf_vectorizer = TfidfVectorizer(
-            analyzer="char_wb", ngram_range=(1, 2), min_df=1, dtype=np.float32, binary=True, stop_words=stopwords+["是", "的", " ", "\t"]
-        )
+        tfidf_vectorizer = _make_vectorizer()
         start_time = timer()
         alias_tfidfs = tfidf_vectorizer.fit_transform(kb_aliases)
         end_time = timer()
@@ -152,15 +420,7 @@ class CandidateGenerator:
 
         msg.text(f"Fitting ann index on {len(aliases)} aliases")
         start_time = timer()
-        ann_index = nmslib.init(
-            method="hnsw",
-            space="cosinesimil_sparse",
-            data_type=nmslib.DataType.SPARSE_VECTOR,
-        )
-        ann_index.addDataPointBatch(alias_tfidfs)
-        ann_index.createIndex(index_params, print_progress=verbose)
-        query_time_params = {"efSearch": self.ef_search}
-        ann_index.setQueryTimeParams(query_time_params)
+        ann_index = self._build_index(alias_tfidfs, verbose=verbose)
         end_time = timer()
         total_time = end_time - start_time
         msg.text(f"Fitting ann index took {round(total_time)} seconds")
@@ -170,61 +430,211 @@ class CandidateGenerator:
         )
         return self
 
+    def _fit_sharded(
+        self,
+        kb_aliases: List[str],
+        verbose: bool = False,
+        n_processes: Optional[int] = None,
+    ):
+        """Fit the vectorizer and build `n_shards` nmslib indexes in parallel processes.
+        Each process counts the terms of a range of aliases, the counts are merged into
+        the same vocabulary and idf a single `fit` computes, then each process
+        vectorizes its range and builds the HNSW index of its shard.
+
+        kb_aliases (List[str]): Aliases in the KnoweledgeBase to fit the ANN index on.
+        verbose (bool): Print progress while fitting the index
+        n_processes (Optional[int]): Number of worker processes, defaults to `n_shards`
+
+        RETURNS (CandidateGenerator): An initialized CandidateGenerator
+        """
+        msg = Printer(no_print=not verbose)
+        short_aliases = set([a for a in kb_aliases if len(a) < 4])
+
+        msg.text(f"Counting terms of {len(kb_aliases)} aliases in {self.n_shards} shards")
+        start_time = timer()
+        vectorizer = _make_vectorizer()
+        bounds = shard_bounds(len(kb_aliases), self.n_shards)
+        with ProcessPoolExecutor(max_workers=n_processes or self.n_shards) as pool:
+            shard_counts = list(pool.map(
+                count_terms,
+                [vectorizer] * len(bounds),
+                [kb_aliases[start:end] for start, end in bounds],
+            ))
+        vectorizer = merge_term_counts(vectorizer, shard_counts, len(kb_aliases))
+        msg.text(f"Fitting vectorizer took {round(timer() - start_time)} seconds")
+
+        msg.text(f"Building {self.n_shards} ann index shards")
+        start_time = timer()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            ann_index, non_empty, alias_tfidfs = build_sharded_index(
+                vectorizer,
+                nmslib_index_params(self._build_params()),
+                self.ef_search,
+                self.n_shards,
+                Path(tmp_dir),
+                aliases=kb_aliases,
+                n_processes=n_processes,
+            )
+        msg.text(f"Building ann index shards took {round(timer() - start_time)} seconds")
+
+        aliases = [alias for alias, flag in zip(kb_aliases, non_empty) if flag]
+        self._initialize(aliases, short_aliases, ann_index, vectorizer, alias_tfidfs)
+        return self
+
+    def _build_params(self) -> Dict[str, Any]:
+        """Params passed to `AnnBackend.build`"""
+        return {
+            "m_parameter": self.m_parameter,
+            "ef_construction": self.ef_construction,
+            "ef_search": self.ef_search,
+            "n_threads": self.n_threads,
+            "n_shards": self.n_shards,
+        }
+
+    def _get_backend(self) -> AnnBackend:
+        """The configured AnnBackend"""
+        return get_backend(self.backend, **self.backend_params)
+
+    @property
+    def ann_backend(self) -> AnnBackend:
+        """AnnBackend of the current ANN index, the brute force backend if
+        the aliases are searched exactly
+
+        RETURNS (AnnBackend): The backend
+        """
+        self.require_ann_index()
+        if isinstance(self.ann_index, BruteForceIndex):
+            return get_backend("brute_force")
+        return self._get_backend()
+
+    def _needs_hnsw(self, n_aliases: int) -> bool:
+        """Whether `index_type` requires an HNSW index for `n_aliases` aliases"""
+        if self.index_type == "auto":
+            return not use_brute_force(n_aliases)
+        return self.index_type == "hnsw"
+
+    def _build_index(
+        self, alias_tfidfs: scipy.sparse.csr_matrix, verbose: bool = False
+    ) -> AnnIndex:
+        """Build the HNSW index over TF-IDF vectors with the configured backend.
+        If `index_type` doesn't need one, the aliases are searched exactly instead.
+
+        alias_tfidfs (scipy.sparse.csr_matrix): Non-empty TF-IDF vectors of the aliases
+        verbose (bool): Print progress while building the index
+
+        RETURNS (AnnIndex): ANN index with query time params set
+        """
+        if self._needs_hnsw(alias_tfidfs.shape[0]):
+            backend = self._get_backend()
+        else:
+            backend = get_backend("brute_force")
+        return backend.build(alias_tfidfs, self._build_params(), verbose=verbose)
+
     def _nmslib_knn_with_zero_vectors(
-        self, vectors: np.ndarray, k: int
-    ) -> Tuple[np.ndarray, np.ndarray]:
+        self, vectors: scipy.sparse.csr_matrix, k: int
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """ann_index.knnQueryBatch crashes if any of the vectors is all zeros.
         This function is a wrapper around `ann_index.knnQueryBatch` that solves this problem. It works as follows:
         - remove empty vectors from `vectors`.
-        - call `ann_index.knnQueryBatch` with the non-empty vectors only. This returns `neighbors`,
-        a list of list of neighbors. `len(neighbors)` equals the length of the non-empty vectors.
-        - extend the list `neighbors` with `None`s in place of empty vectors.
-        - return the extended list of neighbors and distances.
+        - call `ann_index.knnQueryBatch` with the non-empty vectors only.
+        - scatter the results into dense `(n, k)` arrays. Rows of empty vectors and
+        positions past the number of neighbors found are marked invalid in `mask`.
 
-        vectors (np.ndarray): Vectors used to query index for neighbors and distances
+        vectors (scipy.sparse.csr_matrix): Vectors used to query index for neighbors and similarities
         k (int): k neighbors to consider
 
-        RETURNS (Tuple[np.ndarray, np.ndarray]): Tuple of [neighbors, distances]
+        RETURNS (Tuple[np.ndarray, np.ndarray, np.ndarray]): Tuple of int32 neighbors,
+            float32 similarities and a boolean validity mask, all of shape `(n, k)`
         """
-
-        empty_vectors_boolean_flags = np.array(
-            vectors.sum(axis=1) != 0).reshape(-1,)
-        empty_vectors_count = vectors.shape[0] - \
-            sum(empty_vectors_boolean_flags)
-
-        # init extended_neighbors with a list of Nones
-        extended_neighbors = np.empty(
-            (len(empty_vectors_boolean_flags),), dtype=object)
-        extended_distances = np.empty(
-            (len(empty_vectors_boolean_flags),), dtype=object)
-
-        if vectors.shape[0] - empty_vectors_count == 0:
-            return extended_neighbors, extended_distances
+        n_vectors = vectors.shape[0]
+        neighbors = np.zeros((n_vectors, k), dtype=np.int32)
+        similarities = np.zeros((n_vectors, k), dtype=np.float32)
+        mask = np.zeros((n_vectors, k), dtype=bool)
+
+        non_empty_rows = np.flatnonzero(np.asarray(vectors.sum(axis=1)).reshape(-1) != 0)
+        if len(non_empty_rows) == 0:
+            return neighbors, similarities, mask
+
+        if isinstance(self.ann_index, BruteForceIndex):
+            found_neighbors, found_similarities = self.ann_index.knn(
+                vectors[non_empty_rows], k
+            )
+            n_found = found_neighbors.shape[1]
+            neighbors[non_empty_rows, :n_found] = found_neighbors
+            similarities[non_empty_rows, :n_found] = found_similarities
+            mask[non_empty_rows, :n_found] = True
+            return neighbors, similarities, mask
 
         # remove empty vectors before calling `ann_index.knnQueryBatch`
-        vectors = vectors[empty_vectors_boolean_flags]
-
-        # call `knnQueryBatch` to get neighbors
-        original_neighbours = self.ann_index.knnQueryBatch(vectors, k=k)
-
-        neighbors, distances = zip(
-            *[(x[0].tolist(), x[1].tolist()) for x in original_neighbours]
+        results = self.ann_index.knnQueryBatch(vectors[non_empty_rows], k=k)
+
+        if all(len(idx) == k for idx, _ in results):
+            neighbors[non_empty_rows] = np.stack([idx for idx, _ in results])
+            similarities[non_empty_rows] = 1.0 - np.stack([dist for _, dist in results])
+            mask[non_empty_rows] = True
+        else:
+            for row, (idx, dist) in zip(non_empty_rows, results):
+                n_found = len(idx)
+                neighbors[row, :n_found] = idx
+                similarities[row, :n_found] = 1.0 - dist
+                mask[row, :n_found] = True
+
+        return neighbors, similarities, mask
+
+    def _knn(
+        self, vectors: scipy.sparse.csr_matrix
+    ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Top k neighbors of the ANN index and the delta segment, without
+        removed aliases. Neighbors of the delta segment are numbered after
+        the aliases of the ANN index, see `_searchable_aliases`.
+
+        vectors (scipy.sparse.csr_matrix): Query vectors
+
+        RETURNS (Tuple[np.ndarray, np.ndarray, np.ndarray]): Neighbors, similarities
+            and validity mask, see `_nmslib_knn_with_zero_vectors`
+        """
+        n_removed = self.n_removed
+        if not self.delta_aliases and not n_removed:
+            return self._nmslib_knn_with_zero_vectors(vectors, self.k)
+
+        k_main = min(self.k + min(n_removed, MAX_TOMBSTONE_OVERFETCH), len(self.aliases))
+        neighbors, similarities, mask = self._nmslib_knn_with_zero_vectors(vectors, k_main)
+        if n_removed:
+            mask &= ~self.tombstones[neighbors]
+
+        if self.delta_aliases:
+            delta_similarities = np.asarray(
+                (vectors @ self.delta_tfidfs.T).todense(), dtype=np.float32
+            )
+            k_delta = min(self.k, len(self.delta_aliases))
+            delta_neighbors = np.argsort(
+                -delta_similarities, axis=1, kind="stable"
+            )[:, :k_delta].astype(np.int32)
+            delta_similarities = np.take_along_axis(
+                delta_similarities, delta_neighbors, axis=1
+            )
+            # empty query vectors have no neighbors, like in the ANN index
+            non_empty = np.asarray(vectors.sum(axis=1)).reshape(-1, 1) != 0
+            delta_mask = np.broadcast_to(non_empty, delta_neighbors.shape)
+            neighbors = np.hstack([neighbors, delta_neighbors + len(self.aliases)])
+            similarities = np.hstack([similarities, delta_similarities])
+            mask = np.hstack([mask, delta_mask])
+
+        # keep the k most similar valid neighbors, valid neighbors first
+        order = np.argsort(
+            np.where(mask, -similarities, np.inf), axis=1, kind="stable"
+        )[:, :self.k]
+        return (
+            np.take_along_axis(neighbors, order, axis=1),
+            np.take_along_axis(similarities, order, axis=1),
+            np.take_along_axis(mask, order, axis=1),
         )
-        neighbors = list(neighbors)
-        distances = list(distances)
-
-        # neighbors need to be converted to an np.array of objects instead of ndarray of dimensions len(vectors)xk
-        # Solution: add a row to `neighbors` with any length other than k. This way, calling np.array(neighbors)
-        # returns an np.array of objects
-        neighbors.append([])
-        distances.append([])
-        # interleave `neighbors` and Nones in `extended_neighbors`
-        extended_neighbors[empty_vectors_boolean_flags] = np.array(neighbors, dtype=object)[
-            :-1]
-        extended_distances[empty_vectors_boolean_flags] = np.array(distances, dtype=object)[
-            :-1]
-
-        return extended_neighbors, extended_distances
+
+    def _searchable_aliases(self) -> Sequence[str]:
+        """Aliases indexed by the neighbors returned from `_knn`"""
+        if not self.delta_aliases:
+            return self.aliases
+        return _ConcatAliases(self.aliases, self.delta_aliases)
 
     def require_ann_index(self):
         """Raise an error if the ann_index is not initialized
@@ -259,60 +669,57 @@ class CandidateGenerator:
         for idx, mention in enumerate(mention_texts):
             cached_result = self.cache.get(mention)
             if cached_result is not None:
-                self._cache_hits += 1
                 batch_candidates[idx] = cached_result  # 直接放入对应位置
             else:
-                self._cache_misses += 1
                 mentions_to_process.append(mention)
                 process_indices.append(idx)  # 记录原始位置
 
-        # 如果所有mention都在缓存中找到,直接返回
+        # 3. 精确匹配别名的mention不需要查询ANN索引
+        misses = []
+        miss_indices = []
+        for mention, orig_idx in zip(mentions_to_process, process_indices):
+            candidates = self._exact_candidates(mention)
+            if candidates is None:
+                misses.append(mention)
+                miss_indices.append(orig_idx)
+            else:
+                self.cache.add(mention, candidates)
+                batch_candidates[orig_idx] = candidates
+        mentions_to_process, process_indices = misses, miss_indices
+
+        # 如果所有mention都在缓存中找到或精确匹配,直接返回
         if not mentions_to_process:
             return batch_candidates
-        # 3. 处理未缓存的mentions
-        tfidfs = self.vectorizer.transform(mentions_to_process)
-        batch_neighbors, batch_distances = self._nmslib_knn_with_zero_vectors(
-            tfidfs, self.k
+        # 4. 处理剩余的mentions
+        tfidfs = self._query_vectorizer.transform(mentions_to_process)
+        neighbors, similarities, mask = self._knn(tfidfs)
+        processed_candidates = knn_to_alias_candidates(
+            mentions_to_process, self._searchable_aliases(), self.short_aliases,
+            neighbors, similarities, mask
         )
 
-        # 4. 处理结果并更新缓存,同时保持顺序
-        for result_idx, (mention, orig_idx) in enumerate(zip(mentions_to_process, process_indices)):
-            neighbors = batch_neighbors[result_idx]
-            distances = batch_distances[result_idx]
-            
-            if mention in self.short_aliases:
-                candidates = [AliasCandidate(alias=mention, similarity=1.0)]
-            else:
-                candidates = []
-                if neighbors is not None and distances is not None:
-                    for neighbor_index, distance in zip(neighbors, distances):
-                        alias = self.aliases[neighbor_index]
-                        similarity = 1.0 - distance
-                        candidates.append(
-                            AliasCandidate(alias=alias, similarity=similarity)
-                        )
-            
+        # 5. 处理结果并更新缓存,同时保持顺序
+        for mention, orig_idx, candidates in zip(
+            mentions_to_process, process_indices, processed_candidates
+        ):
             # 更新缓存
             self.cache.add(mention, candidates)
             # 将结果放入原始位置
             batch_candidates[orig_idx] = candidates
-        # 5. 确保所有位置都已填充
+        # 6. 确保所有位置都已填充
         assert None not in batch_candidates, "Some mentions were not processed"
         return batch_candidates
 
     def from_disk(self, path: Path, **kwargs):
-        """Deserialize CandidateGenerator data from disk
+        """Deserialize CandidateGenerator data from disk.
+        Both the legacy layout (format version 1) and the memory-mappable
+        layout (format version 2) written by `to_disk` are supported.
 
         path (Path): Directory to deserialize data from
 
         RETURNS (CandidateGenerator): Initialized Candidate Generator
         """
-        aliases_path = f"{path}/aliases.json"
-        short_aliases_path = f"{path}/short_aliases.json"
-        ann_index_path = f"{path}/ann_index.bin"
-        tfidf_vectorizer_path = f"{path}/tfidf_vectorizer.joblib"
-        tfidf_vectors_path = f"{path}/tfidf_vectors_sparse.npz"
-
+        path = ensure_path(path)
         cfg = {}
         deserializers = {"cg_cfg": lambda p: cfg.update(srsly.read_json(p))}
         from_disk(path, deserializers, {})
@@ -322,19 +729,43 @@ class CandidateGenerator:
         self.ef_search = cfg.get("ef_search", 200)
         self.ef_construction = cfg.get("ef_construction", 2000)
         self.n_threads = cfg.get("n_threads", 60)
+        self.n_shards = cfg.get("n_shards", 1)
+        self.exact_match = cfg.get("exact_match", True)
+        self.index_type = cfg.get("index_type", "hnsw")
+        self.backend = cfg.get("backend", "nmslib")
+        self.backend_params = cfg.get("backend_params", {})
+        self.revision = cfg.get("revision", 0)
+
+        format_version = cfg.get("format_version", 1)
+        if format_version == 1:
+            self._from_disk_v1(path)
+        elif format_version == 2:
+            self._from_disk_v2(path / "cg", cfg)
+        else:
+            raise ValueError(
+                f"Unsupported CandidateGenerator format version {format_version}. "
+                f"Supported versions are 1 and {FORMAT_VERSION}."
+            )
+        return self
+
+    def _from_disk_v1(self, path: Path):
+        """Load the legacy layout with json aliases, a pickled vectorizer
+        and an index that has to be re-populated with the TF-IDF vectors.
+
+        path (Path): Directory to deserialize data from
+        """
+        aliases_path = f"{path}/aliases.json"
+        short_aliases_path = f"{path}/short_aliases.json"
+        ann_index_path = f"{path}/ann_index.bin"
+        tfidf_vectorizer_path = f"{path}/tfidf_vectorizer.joblib"
+        tfidf_vectors_path = f"{path}/tfidf_vectors_sparse.npz"
 
         aliases = srsly.read_json(aliases_path)
         short_aliases = set(srsly.read_json(short_aliases_path))
         tfidf_vectorizer = joblib.load(tfidf_vectorizer_path)
         alias_tfidfs = scipy.sparse.load_npz(
             tfidf_vectors_path).astype(np.float32)
-        ann_index = nmslib.init(
-            method="hnsw",
-            space="cosinesimil_sparse",
-            data_type=nmslib.DataType.SPARSE_VECTOR,
-        )
-        ann_index.addDataPointBatch(alias_tfidfs)
-        ann_index.loadIndex(str(ann_index_path))
+        ann_index = get_backend("nmslib").load(ann_index_path, alias_tfidfs, {})
         query_time_params = {"efSearch": self.ef_search}
         ann_index.setQueryTimeParams(query_time_params)
 
@@ -342,33 +773,212 @@ class CandidateGenerator:
             aliases, short_aliases, ann_index, tfidf_vectorizer, alias_tfidfs
         )
 
-        return self
+    def _from_disk_v2(self, path: Path, cfg: Dict[str, Any]):
+        """Load the format version 2 layout. String tables and arrays are
+        memory-mapped and the ANN index is loaded together with its data.
+
+        path (Path): Directory with the format version 2 files
+        cfg (Dict[str, Any]): Contents of `cg_cfg`
+        """
+        aliases = StringTable.from_disk(path / "aliases")
+        short_aliases = set(StringTable.from_disk(path / "short_aliases"))
+        tfidf_vectorizer = _load_vectorizer(path, cfg["vectorizer"])
+        alias_tfidfs = scipy.sparse.csr_matrix(
+            (
+                np.load(path / "tfidf_vectors.data.npy", mmap_mode="r"),
+                np.load(path / "tfidf_vectors.indices.npy", mmap_mode="r"),
+                np.load(path / "tfidf_vectors.indptr.npy", mmap_mode="r"),
+            ),
+            shape=tuple(cfg["tfidf_vectors_shape"]),
+            copy=False,
+        )
+        # "hnsw" was written before the backend was configurable
+        backend_name = cfg.get("ann_index", "nmslib")
+        if backend_name == "hnsw":
+            backend_name = "nmslib"
+        if backend_name == self.backend:
+            backend = self._get_backend()
+        else:
+            backend = get_backend(backend_name)
+        ann_index = backend.load(path / "ann_index.bin", alias_tfidfs, cfg)
+        ann_index.setQueryTimeParams({"efSearch": self.ef_search})
+        # models saved without the exact alias index build it on load
+        exact_aliases = None
+        if (path / "exact_aliases.keys.npy").exists():
+            exact_aliases = ExactAliasIndex.from_disk(path / "exact_aliases")
+
+        self._initialize(
+            aliases, short_aliases, ann_index, tfidf_vectorizer, alias_tfidfs,
+            exact_aliases,
+        )
+        if "delta_tfidfs_shape" in cfg:
+            self.delta_aliases = list(StringTable.from_disk(path / "delta_aliases"))
+            self.delta_tfidfs = scipy.sparse.csr_matrix(
+                (
+                    np.load(path / "delta_tfidfs.data.npy"),
+                    np.load(path / "delta_tfidfs.indices.npy"),
+                    np.load(path / "delta_tfidfs.indptr.npy"),
+                ),
+                shape=tuple(cfg["delta_tfidfs_shape"]),
+            )
+        if (path / "tombstones.npy").exists():
+            self.tombstones = np.zeros(len(aliases), dtype=bool)
+            self.tombstones[np.load(path / "tombstones.npy")] = True
+        self._index_delta_aliases()
 
     def to_disk(self, path: Path, **kwargs):
-        """Serialize CandidateGenerator to disk
+        """Serialize CandidateGenerator to disk using the format version 2 layout.
 
         path (Path): Directory to serialize to
         """
+        path = ensure_path(path)
         cfg = {
             "k": self.k,
             "m_parameter": self.m_parameter,
             "ef_search": self.ef_search,
             "ef_construction": self.ef_construction,
             "n_threads": self.n_threads,
+            "format_version": FORMAT_VERSION,
+            "vectorizer": _vectorizer_params(self.vectorizer),
+            "tfidf_vectors_shape": list(self.alias_tfidfs.shape),
+            "revision": self.revision,
+            "n_shards": self.n_shards,
+            "exact_match": self.exact_match,
+            "index_type": self.index_type,
+            "backend": self.backend,
+            "backend_params": self.backend_params,
+            "ann_index": self.ann_backend.name,
         }
+        if self.delta_tfidfs is not None:
+            cfg["delta_tfidfs_shape"] = list(self.delta_tfidfs.shape)
+        # the index is saved first, the backend may add entries to `cg_cfg`
         serializers = {
+            "cg": lambda p: cfg.update(self._to_disk_v2(p)),
             "cg_cfg": lambda p: srsly.write_json(p, cfg),
-            "aliases": lambda p: srsly.write_json(p.with_suffix(".json"), self.aliases),
-            "short_aliases": lambda p: srsly.write_json(
-                p.with_suffix(".json"), list(self.short_aliases)
-            ),
-            "ann_index": lambda p: self.ann_index.saveIndex(str(p.with_suffix(".bin"))),
-            "tfidf_vectorizer": lambda p: joblib.dump(
-                self.vectorizer, p.with_suffix(".joblib")
-            ),
-            "tfidf_vectors_sparse": lambda p: scipy.sparse.save_npz(
-                p.with_suffix(".npz"), self.alias_tfidfs
-            ),
         }
 
         to_disk(path, serializers, {})
+
+    def _to_disk_v2(self, path: Path) -> Dict[str, Any]:
+        """Write the format version 2 files
+
+        path (Path): Directory to write the files to
+
+        RETURNS (Dict[str, Any]): `cg_cfg` entries of the ANN backend
+        """
+        if not path.exists():
+            path.mkdir(parents=True)
+        StringTable.from_strings(self.aliases).to_disk(path / "aliases")
+        StringTable.from_strings(sorted(self.short_aliases)).to_disk(
+            path / "short_aliases"
+        )
+        vocabulary = sorted(self.vectorizer.vocabulary_.items(), key=lambda x: x[1])
+        StringTable.from_strings([term for term, _ in vocabulary]).to_disk(
+            path / "vocabulary"
+        )
+        np.save(path / "idf.npy", self.vectorizer.idf_.astype(np.float32))
+
+        alias_tfidfs = scipy.sparse.csr_matrix(self.alias_tfidfs)
+        np.save(path / "tfidf_vectors.data.npy", alias_tfidfs.data.astype(np.float32))
+        np.save(path / "tfidf_vectors.indices.npy", alias_tfidfs.indices)
+        np.save(path / "tfidf_vectors.indptr.npy", alias_tfidfs.indptr)
+        self.exact_aliases.to_disk(path / "exact_aliases")
+
+        for index_path in path.glob("ann_index.bin*"):
+            index_path.unlink()
+        index_cfg = self.ann_backend.save(self.ann_index, path / "ann_index.bin")
+
+        # aliases added or removed since the index was built
+        for name in ("delta_aliases.offsets.npy", "delta_aliases.data.npy",
+                     "delta_tfidfs.data.npy", "delta_tfidfs.indices.npy",
+                     "delta_tfidfs.indptr.npy", "tombstones.npy"):
+            if (path / name).exists():
+                (path / name).unlink()
+        if self.delta_tfidfs is not None:
+            StringTable.from_strings(self.delta_aliases).to_disk(path / "delta_aliases")
+            np.save(path / "delta_tfidfs.data.npy", self.delta_tfidfs.data.astype(np.float32))
+            np.save(path / "delta_tfidfs.indices.npy", self.delta_tfidfs.indices)
+            np.save(path / "delta_tfidfs.indptr.npy", self.delta_tfidfs.indptr)
+        if self.n_removed:
+            np.save(path / "tombstones.npy", np.flatnonzero(self.tombstones))
+        return index_cfg
+
+
+def _make_vectorizer() -> TfidfVectorizer:
+    """Unfitted TF-IDF vectorizer of the alias character n-grams"""
+    return TfidfVectorizer(
+        analyzer="char_wb", ngram_range=(1, 2), min_df=1, dtype=np.float32, binary=True, stop_words=stopwords+["是", "的", " ", "\t"]
+    )
+
+
+class _ConcatAliases:
+    """Read only view of the ANN index aliases followed by the delta aliases"""
+
+    def __init__(self, aliases: Sequence[str], delta_aliases: List[str]):
+        self.aliases = aliases
+        self.delta_aliases = delta_aliases
+
+    def __len__(self) -> int:
+        return len(self.aliases) + len(self.delta_aliases)
+
+    def __getitem__(self, i: int) -> str:
+        n_main = len(self.aliases)
+        return self.aliases[i] if i < n_main else self.delta_aliases[i - n_main]
+
+
+def _vectorizer_params(vectorizer: TfidfVectorizer) -> Dict[str, Any]:
+    """JSON serializable constructor params of a fitted TfidfVectorizer
+
+    vectorizer (TfidfVectorizer): Fitted vectorizer
+
+    RETURNS (Dict[str, Any]): Params without the vocabulary
+    """
+    params = vectorizer.get_params()
+    params.pop("vocabulary", None)
+    params["dtype"] = np.dtype(params["dtype"]).name
+    params["ngram_range"] = list(params["ngram_range"])
+    for key in ("analyzer", "preprocessor", "tokenizer"):
+        if callable(params.get(key)):
+            raise ValueError(
+                f"TfidfVectorizer with a callable `{key}` can't be serialized"
+            )
+    return params
+
+
+def _load_vectorizer(path: Path, params: Dict[str, Any]) -> TfidfVectorizer:
+    """Rebuild a fitted TfidfVectorizer from its flat vocabulary and idf arrays
+
+    path (Path): Directory with the `vocabulary` string table and `idf.npy`
+    params (Dict[str, Any]): Params returned by `_vectorizer_params`
+
+    RETURNS (TfidfVectorizer): Fitted vectorizer
+    """
+    params = dict(params)
+    params["dtype"] = np.dtype(params["dtype"]).type
+    params["ngram_range"] = tuple(params["ngram_range"])
+    terms = StringTable.from_disk(path / "vocabulary")
+    vectorizer = TfidfVectorizer(
+        vocabulary={term: i for i, term in enumerate(terms)}, **params
+    )
+    vectorizer.idf_ = np.load(path / "idf.npy")
+    return vectorizer
+
+
+def convert_to_v2(path: Path, remove_legacy: bool = False) -> Path:
+    """Convert a CandidateGenerator saved in the legacy layout (format version 1)
+    to the memory-mappable format version 2 layout in place.
+
+    path (Path): Directory containing `cg_cfg`
+    remove_legacy (bool): Delete the format version 1 files after converting
+
+    RETURNS (Path): The converted directory
+    """
+    path = ensure_path(path)
+    cg = CandidateGenerator().from_disk(path)
+    cg.to_disk(path)
+    if remove_legacy:
+        for name in LEGACY_FILES:
+            legacy_path = path / name
+            if legacy_path.exists():
+                legacy_path.unlink()
+    return path
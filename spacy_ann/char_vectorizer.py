@@ -0,0 +1,183 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from typing import List, Tuple, Union
+
+import numpy as np
+import scipy
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.utils.sparsefuncs_fast import (
+    inplace_csr_row_normalize_l1,
+    inplace_csr_row_normalize_l2,
+)
+
+# bits of a unicode code point, n-grams of up to 3 characters fit an uint64 key
+CODE_POINT_BITS = 21
+MAX_NGRAM_SIZE = 3
+
+
+class CharNgramVectorizer:
+    """Query time replacement of a fitted `char_wb` TfidfVectorizer.
+    N-grams of a whole batch are extracted with numpy from the code points
+    of the padded words and looked up in sorted n-gram keys instead of
+    building a string and a dict lookup per n-gram. The count matrix is
+    built directly in CSR format and weighted in place with the same
+    operations and normalization kernels as the vectorizer's TF-IDF
+    transformer, so the output is identical to `vectorizer.transform`
+    without its per call input validation.
+    """
+
+    def __init__(self, vectorizer: TfidfVectorizer):
+        """Initialize a CharNgramVectorizer
+
+        vectorizer (TfidfVectorizer): Fitted vectorizer, see `supports`
+        """
+        self.vectorizer = vectorizer
+        self.preprocess = vectorizer.build_preprocessor()
+        self.min_n, self.max_n = vectorizer.ngram_range
+        self.binary = vectorizer.binary
+        self.dtype = vectorizer.dtype
+        self.n_features = len(vectorizer.vocabulary_)
+        self.sublinear_tf = vectorizer.sublinear_tf
+        self.idf = vectorizer.idf_ if vectorizer.use_idf else None
+        self.norm = vectorizer.norm
+
+        # sorted keys and columns of the vocabulary n-grams of each size
+        self.keys: List[np.ndarray] = []
+        self.columns: List[np.ndarray] = []
+        terms_by_size: List[List[Tuple[str, int]]] = [
+            [] for _ in range(self.max_n + 1)
+        ]
+        for term, column in vectorizer.vocabulary_.items():
+            if self.min_n <= len(term) <= self.max_n:
+                terms_by_size[len(term)].append((term, column))
+        for n, terms in enumerate(terms_by_size):
+            if not terms:
+                self.keys.append(np.zeros(0, dtype=np.uint64))
+                self.columns.append(np.zeros(0, dtype=np.int32))
+                continue
+            code_points = _code_points("".join(term for term, _ in terms))
+            keys = _ngram_keys(code_points, np.arange(0, len(code_points), n), n)
+            order = np.argsort(keys)
+            self.keys.append(keys[order])
+            self.columns.append(
+                np.array([column for _, column in terms], dtype=np.int32)[order]
+            )
+
+    @staticmethod
+    def supports(vectorizer: TfidfVectorizer) -> bool:
+        """Whether a vectorizer can be replaced by a CharNgramVectorizer
+
+        vectorizer (TfidfVectorizer): Fitted vectorizer
+
+        RETURNS (bool): True for `char_wb` analyzers of n-grams of up to 3 characters
+        """
+        min_n, max_n = vectorizer.ngram_range
+        return (
+            vectorizer.analyzer == "char_wb"
+            and vectorizer.input == "content"
+            and vectorizer.preprocessor is None
+            and 1 <= min_n <= max_n <= MAX_NGRAM_SIZE
+            and hasattr(vectorizer, "vocabulary_")
+            and (hasattr(vectorizer, "idf_") or not vectorizer.use_idf)
+        )
+
+    def transform(self, texts: List[str]) -> scipy.sparse.csr_matrix:
+        """TF-IDF vectors of a batch of texts, equal to `vectorizer.transform(texts)`
+
+        texts (List[str]): Texts to vectorize
+
+        RETURNS (scipy.sparse.csr_matrix): `(len(texts), n_features)` TF-IDF vectors
+        """
+        # every word is padded with a space on both sides, like `_char_wb_ngrams`
+        padded = []
+        word_lengths = []
+        word_rows = []
+        for row, text in enumerate(texts):
+            words = self.preprocess(text).split()
+            if not words:
+                continue
+            padded.append(" " + "  ".join(words) + " ")
+            word_lengths.extend(len(word) + 2 for word in words)
+            word_rows.extend([row] * len(words))
+
+        rows = []
+        columns = []
+        if padded:
+            code_points = _code_points("".join(padded))
+            word_lengths = np.array(word_lengths, dtype=np.int64)
+            word_starts = np.cumsum(word_lengths) - word_lengths
+            word_rows = np.array(word_rows, dtype=np.int64)
+            for n in range(self.min_n, self.max_n + 1):
+                if not len(self.keys[n]):
+                    continue
+                # start of every n-gram inside a padded word
+                counts = word_lengths - n + 1
+                group_starts = np.repeat(np.cumsum(counts) - counts, counts)
+                starts = (
+                    np.repeat(word_starts, counts)
+                    + np.arange(counts.sum())
+                    - group_starts
+                )
+                keys = _ngram_keys(code_points, starts, n)
+                positions = np.searchsorted(self.keys[n], keys)
+                positions[positions == len(self.keys[n])] = 0
+                found = self.keys[n][positions] == keys
+                rows.append(np.repeat(word_rows, counts)[found])
+                columns.append(self.columns[n][positions[found]])
+
+        if rows:
+            rows = np.concatenate(rows)
+            columns = np.concatenate(columns).astype(np.int64)
+        else:
+            rows = columns = np.zeros(0, dtype=np.int64)
+        # sorted unique (row, column) cells, like the sorted indices of `_count_vocab`
+        cells, counts = np.unique(rows * self.n_features + columns, return_counts=True)
+        indptr = np.searchsorted(cells // self.n_features, np.arange(len(texts) + 1))
+        data = (
+            np.ones(len(cells), dtype=self.dtype)
+            if self.binary else counts.astype(self.dtype)
+        )
+        indices = (cells % self.n_features).astype(np.int32)
+        if self.sublinear_tf:
+            np.log(data, data)
+            data += 1.0
+        if self.idf is not None:
+            data *= self.idf[indices]
+        tfidfs = scipy.sparse.csr_matrix(
+            (data, indices, indptr), shape=(len(texts), self.n_features)
+        )
+        if self.norm == "l2":
+            inplace_csr_row_normalize_l2(tfidfs)
+        elif self.norm == "l1":
+            inplace_csr_row_normalize_l1(tfidfs)
+        return tfidfs
+
+
+def make_query_vectorizer(
+    vectorizer: TfidfVectorizer,
+) -> Union[CharNgramVectorizer, TfidfVectorizer]:
+    """Fast query time vectorizer if the vectorizer is supported, the vectorizer itself otherwise
+
+    vectorizer (TfidfVectorizer): Fitted vectorizer
+
+    RETURNS (Union[CharNgramVectorizer, TfidfVectorizer]): Object with a compatible `transform`
+    """
+    if CharNgramVectorizer.supports(vectorizer):
+        return CharNgramVectorizer(vectorizer)
+    return vectorizer
+
+
+def _code_points(text: str) -> np.ndarray:
+    return np.frombuffer(
+        text.encode("utf-32-le", errors="surrogatepass"), dtype=np.uint32
+    ).astype(np.uint64)
+
+
+def _ngram_keys(code_points: np.ndarray, starts: np.ndarray, n: int) -> np.ndarray:
+    """Pack the code points of the n-grams starting at `starts` into one uint64 each"""
+    keys = code_points[starts].copy()
+    for i in range(1, n):
+        keys <<= np.uint64(CODE_POINT_BITS)
+        keys |= code_points[starts + i]
+    return keys
@@ -6,6 +6,10 @@ def main():
     import sys
 
     import typer
+    from spacy_ann.cli.autotune import autotune
+    from spacy_ann.cli.benchmark import benchmark
+    from spacy_ann.cli.compact_index import compact_index
+    from spacy_ann.cli.convert_index import convert_index
     from spacy_ann.cli.create_index import create_index
     from spacy_ann.cli.example_data import example_data
     from spacy_ann.cli.serve import serve
@@ -13,8 +17,12 @@ def main():
 
     commands = {
         "create_index": create_index,
+        "convert_index": convert_index,
+        "compact_index": compact_index,
         "example_data": example_data,
         "serve": serve,
+        "benchmark": benchmark,
+        "autotune": autotune,
     }
     if len(sys.argv) == 1:
         msg.info("Available commands", ", ".join(commands), exits=1)
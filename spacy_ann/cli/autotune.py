@@ -0,0 +1,97 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from pathlib import Path
+from typing import Optional
+
+import srsly
+import typer
+from spacy_ann.autotune import autotune as autotune_cg
+from spacy_ann.benchmark import generate_mentions
+from spacy_ann.candidate_generator import CandidateGenerator
+from wasabi import Printer
+
+
+def autotune(
+    model_dir: Path,
+    mentions_path: Optional[Path] = None,
+    n_mentions: int = 1000,
+    recall_target: Optional[float] = 0.95,
+    latency_budget_ms: Optional[float] = None,
+    tune_build: bool = False,
+    sample_size: int = 50000,
+    seed: int = 0,
+    verbose: bool = True,
+):
+    """Choose the HNSW efSearch (and optionally M and efConstruction) of an
+    AnnLinker index for a recall target or latency budget and write them to cg_cfg
+
+    model_dir (Path): path to a spaCy model with an ann_linker pipe
+        or to the ann_linker directory itself
+    mentions_path (Optional[Path]): mentions to tune for, a .jsonl file with a "text"
+        field per line or a text file with one mention per line. Defaults to
+        mentions sampled from the aliases with typos.
+    n_mentions (int): maximum number of mentions to use
+    recall_target (Optional[float]): minimum recall@k against exact search
+    latency_budget_ms (Optional[float]): maximum mean query latency per mention in ms
+    tune_build (bool): also tune M and efConstruction on `sample_size` aliases.
+        They take effect the next time the index is built.
+    """
+    msg = Printer(no_print=not verbose)
+
+    path = model_dir
+    if not (path / "cg_cfg").exists() and (path / "ann_linker" / "cg_cfg").exists():
+        path = path / "ann_linker"
+    if not (path / "cg_cfg").exists():
+        msg.fail(f"No CandidateGenerator found in {model_dir}", exits=1)
+
+    cg = CandidateGenerator().from_disk(path)
+    if mentions_path is None:
+        mentions = generate_mentions(cg.aliases, n_mentions, seed=seed)
+    elif mentions_path.suffix == ".jsonl":
+        mentions = [m["text"] for m in srsly.read_jsonl(mentions_path)][:n_mentions]
+    else:
+        mentions = [line for line in mentions_path.read_text().splitlines() if line]
+        mentions = mentions[:n_mentions]
+
+    msg.info(f"Tuning on {len(mentions)} mentions")
+    try:
+        report = autotune_cg(
+            cg,
+            mentions,
+            recall_target=recall_target,
+            latency_budget_ms=latency_budget_ms,
+            tune_build=tune_build,
+            sample_size=sample_size,
+            seed=seed,
+        )
+    except ValueError as e:
+        msg.fail(str(e), exits=1)
+    for point in report["ef_search_points"]:
+        msg.text(
+            f"efSearch {point['ef_search']}: recall@{report['k']} {point['recall']:.4f}, "
+            f"{point['latency_ms']:.3f} ms"
+        )
+    if tune_build:
+        for point in report["build_points"]:
+            msg.text(
+                f"M {point['m_parameter']}, efConstruction {point['ef_construction']}: "
+                f"efSearch {point['ef_search']}, recall {point['recall']:.4f}, "
+                f"{point['latency_ms']:.3f} ms, build {point['build_seconds']:.1f} s"
+            )
+
+    cfg = srsly.read_json(path / "cg_cfg")
+    cfg["ef_search"] = cg.ef_search
+    cfg["m_parameter"] = cg.m_parameter
+    cfg["ef_construction"] = cg.ef_construction
+    cfg["autotune"] = report
+    srsly.write_json(path / "cg_cfg", cfg)
+    chosen = report["ef_search"]
+    msg.good(
+        f"efSearch {cg.ef_search} (recall {chosen['recall']:.4f}, "
+        f"{chosen['latency_ms']:.3f} ms) written to {path / 'cg_cfg'}"
+    )
+
+
+if __name__ == "__main__":
+    typer.run(autotune)
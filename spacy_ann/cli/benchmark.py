@@ -0,0 +1,115 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+import srsly
+import typer
+from spacy_ann.benchmark import (
+    environment,
+    generate_aliases,
+    generate_mentions,
+    run_benchmark,
+)
+from wasabi import Printer
+
+
+def benchmark(
+    output_path: Path,
+    size: List[int] = typer.Option([10000, 100000], help="Number of aliases, repeat for several runs"),
+    batch_size: List[int] = typer.Option([1, 16, 256], help="Query batch size, repeat for several"),
+    aliases_path: Optional[Path] = None,
+    n_queries: int = 1000,
+    noise: float = 0.5,
+    k: int = 5,
+    m_parameter: int = 100,
+    ef_search: int = 200,
+    ef_construction: int = 2000,
+    n_threads: int = 60,
+    n_shards: int = 1,
+    index_type: str = "auto",
+    backend: str = "nmslib",
+    backend_params: str = "{}",
+    seed: int = 0,
+    work_dir: Optional[Path] = None,
+    verbose: bool = True,
+):
+    """Measure how CandidateGenerator fit, load and query performance scale
+    with the number of aliases and write the results to JSON
+
+    output_path (Path): path of the JSON results
+    size (List[int]): numbers of aliases to benchmark
+    batch_size (List[int]): query batch sizes
+    aliases_path (Optional[Path]): aliases.jsonl (with an "alias" field per line)
+        or a text file with one alias per line. Synthetic aliases are generated if not set.
+    n_queries (int): number of query mentions sampled from the aliases
+    noise (float): probability of a typo in a query mention
+    index_type (str): "auto", "hnsw" or "brute_force"
+    backend (str): ANN backend building the index, "nmslib", "hnswlib" or "dense"
+    backend_params (str): JSON object of backend specific params, e.g. '{"dtype": "int8"}'
+    work_dir (Optional[Path]): directory to save the indexes to, defaults to a temporary directory
+    """
+    msg = Printer(no_print=not verbose)
+
+    all_aliases: Optional[List[str]] = None
+    if aliases_path is not None:
+        if aliases_path.suffix == ".jsonl":
+            all_aliases = [a["alias"] for a in srsly.read_jsonl(aliases_path)]
+        else:
+            all_aliases = [line for line in aliases_path.read_text().splitlines() if line]
+        all_aliases = list(dict.fromkeys(all_aliases))
+
+    cg_params = {
+        "k": k,
+        "m_parameter": m_parameter,
+        "ef_search": ef_search,
+        "ef_construction": ef_construction,
+        "n_threads": n_threads,
+        "n_shards": n_shards,
+        "index_type": index_type,
+        "backend": backend,
+        "backend_params": srsly.json_loads(backend_params),
+    }
+    results = {"environment": environment(), "params": cg_params, "runs": []}
+
+    with tempfile.TemporaryDirectory(dir=work_dir) as tmp_dir:
+        for n_aliases in size:
+            if all_aliases is None:
+                aliases = generate_aliases(n_aliases, seed=seed)
+            else:
+                aliases = all_aliases[:n_aliases]
+                if len(aliases) < n_aliases:
+                    msg.warn(f"Only {len(aliases)} aliases available")
+            mentions = generate_mentions(aliases, n_queries, noise=noise, seed=seed)
+
+            msg.divider(f"{len(aliases)} aliases")
+            run = run_benchmark(
+                aliases,
+                Path(tmp_dir) / str(len(aliases)),
+                cg_params,
+                mentions,
+                batch_size,
+            )
+            results["runs"].append(run)
+
+            msg.text(
+                f"fit {run['fit']['seconds']:.1f} s, peak RSS {run['fit']['peak_rss_mb']:.0f} MB, "
+                f"disk {run['disk']['bytes'] / 2 ** 20:.1f} MB "
+                f"(index {run['disk']['index_bytes'] / 2 ** 20:.1f} MB), load {run['load']['seconds']:.2f} s"
+            )
+            for query in run["query"]:
+                latency = query["latency_ms"]
+                msg.text(
+                    f"batch {query['batch_size']}: {query['mentions_per_second']:.0f} mentions/s, "
+                    f"p50 {latency['p50']:.2f} ms, p95 {latency['p95']:.2f} ms, p99 {latency['p99']:.2f} ms"
+                )
+            msg.text(f"recall@{run['recall']['k']} {run['recall']['recall_at_k']:.4f}")
+            srsly.write_json(output_path, results)
+
+    msg.good(f"Results written to {output_path}")
+
+
+if __name__ == "__main__":
+    typer.run(benchmark)
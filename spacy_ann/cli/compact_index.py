@@ -0,0 +1,41 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from pathlib import Path
+
+import typer
+from spacy_ann.candidate_generator import CandidateGenerator
+from wasabi import Printer
+
+
+def compact_index(model_dir: Path, verbose: bool = True):
+    """Fold aliases added with `add_aliases` and removed with `remove_aliases`
+    into a rebuilt ANN index of an AnnLinker
+
+    model_dir (Path): path to a spaCy model with an ann_linker pipe
+        or to the ann_linker directory itself
+    """
+    msg = Printer(hide_animation=not verbose)
+
+    path = model_dir
+    if not (path / "cg_cfg").exists() and (path / "ann_linker" / "cg_cfg").exists():
+        path = path / "ann_linker"
+    if not (path / "cg_cfg").exists():
+        msg.fail(f"No CandidateGenerator found in {model_dir}", exits=1)
+
+    cg = CandidateGenerator().from_disk(path)
+    n_added, n_removed = len(cg.delta_aliases), cg.n_removed
+    if not n_added and not n_removed:
+        msg.good("Nothing to compact.")
+        return
+
+    with msg.loading(
+        f"Rebuilding ANN index with {n_added} added and {n_removed} removed aliases"
+    ):
+        cg.compact()
+        cg.to_disk(path)
+    msg.good("Done.")
+
+
+if __name__ == "__main__":
+    typer.run(compact_index)
@@ -0,0 +1,33 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from pathlib import Path
+
+import typer
+from spacy_ann.candidate_generator import convert_to_v2
+from wasabi import Printer
+
+
+def convert_index(model_dir: Path, remove_legacy: bool = False, verbose: bool = True):
+    """Convert the ANN index of an AnnLinker saved with the legacy layout
+    to the memory-mappable format version 2 layout
+
+    model_dir (Path): path to a spaCy model with an ann_linker pipe
+        or to the ann_linker directory itself
+    remove_legacy (bool): delete the legacy files after converting
+    """
+    msg = Printer(hide_animation=not verbose)
+
+    path = model_dir
+    if not (path / "cg_cfg").exists() and (path / "ann_linker" / "cg_cfg").exists():
+        path = path / "ann_linker"
+    if not (path / "cg_cfg").exists():
+        msg.fail(f"No CandidateGenerator found in {model_dir}", exits=1)
+
+    with msg.loading(f"Converting CandidateGenerator in {path}"):
+        convert_to_v2(path, remove_legacy=remove_legacy)
+    msg.good("Done.")
+
+
+if __name__ == "__main__":
+    typer.run(convert_index)
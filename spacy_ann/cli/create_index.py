@@ -21,6 +21,12 @@ def create_index(
     new_model_name: str = "ann_linker",
     cg_threshold: float = 0.8,
     n_iter: int = 5,
+    n_shards: int = 1,
+    index_type: str = "auto",
+    backend: str = "nmslib",
+    backend_params: str = "{}",
+    partition_by_label: bool = False,
+    label_groups: str = "{}",
     verbose: bool = True,
 ):
 
@@ -30,6 +36,14 @@ def create_index(
     model (str): spaCy language model directory or name to load
     kb_dir (Path): path to the directory with kb entities.jsonl and aliases.jsonl files
     output_dir (Path): path to output_dir for spaCy model with ann_linker pipe
+    n_shards (int): Number of ANN index shards built in parallel processes
+    index_type (str): "auto", "hnsw" or "brute_force", see CandidateGenerator
+    backend (str): ANN backend building the index, "nmslib", "hnswlib" or "dense"
+    backend_params (str): JSON object of backend specific params, e.g. '{"dtype": "int8"}'
+    partition_by_label (bool): Build an ANN index per entity label, mentions are only
+        searched in the index of their label
+    label_groups (str): JSON object of entity labels per index, e.g.
+        '{"food": ["ingredient", "fragrance"]}', implies `partition_by_label`
 
 
     kb File Formats
@@ -104,12 +118,23 @@ def create_index(
 
     msg.divider("Create ANN Index")
 
-    cg = CandidateGenerator().fit(kb.get_alias_strings(), verbose=True)
+    cg = CandidateGenerator(
+        n_shards=n_shards,
+        index_type=index_type,
+        backend=backend,
+        backend_params=srsly.json_loads(backend_params),
+    ).fit(kb.get_alias_strings(), verbose=True)
 
     ann_linker = nlp.add_pipe("ann_linker", last=True)
     ann_linker.set_kb(kb)
     ann_linker.set_cg(cg)
     ann_linker.set_entity_lables(ent_label_map)
+
+    groups = srsly.json_loads(label_groups)
+    if partition_by_label or groups:
+        with msg.loading("Creating ANN indexes per entity label"):
+            partitions = ann_linker.fit_partitions(groups or None, verbose=True)
+            msg.good(f"Done, {len(partitions)} label indexes")
     if nlp.has_pipe("ner"):
         nlp.disable_pipe("ner")
     nlp.meta["name"] = new_model_name
@@ -1,9 +1,18 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
-import multiprocessing
+from functools import partial
+from typing import Optional
 
 import spacy
+from spacy_ann.api.memory import (
+    MB,
+    compute_n_workers,
+    format_memory_usage,
+    freeze_loaded_objects,
+    get_memory_usage,
+)
+from wasabi import msg
 
 
 def serve(
@@ -12,18 +21,66 @@ def serve(
     host: str = "127.0.0.1",
     port: int = 8080,
     use_gunicorn: bool = False,
-    n_workers: int = (multiprocessing.cpu_count() * 2) + 1,
+    n_workers: Optional[int] = None,
+    n_threads: int = 4,
+    worker_memory_mb: Optional[int] = None,
+    memory_budget_mb: Optional[int] = None,
+    micro_batch_wait_ms: float = 0.0,
+    micro_batch_size: int = 256,
+    gzip_min_size: int = 0,
 ):
+    """Serve the AnnLinker of a spaCy model as a Web Service
+
+    The model is loaded once in the main process and frozen (`gc.freeze`)
+    before gunicorn forks its workers, so all workers share the pages
+    holding the model, the ANN index and the alias tables.
+
+    model (str): spaCy model with an ann_linker pipe
+    n_workers (Optional[int]): Number of gunicorn workers. Derived from the CPU and
+        memory budgets if not set.
+    n_threads (int): Linking threads in each worker
+    worker_memory_mb (Optional[int]): Memory to reserve per worker. Defaults to the
+        memory used by loading the model, i.e. assumes nothing stays shared.
+    memory_budget_mb (Optional[int]): Memory for all workers. Defaults to 80% of the
+        available memory.
+    micro_batch_wait_ms (float): If > 0, collect spans of concurrent /link requests
+        for up to this many milliseconds and link them in one batch
+    micro_batch_size (int): Number of collected spans that flushes a micro batch early
+    gzip_min_size (int): If > 0, gzip responses of at least this many bytes
+        for clients that accept it
+    """
 
     import uvicorn
-    from spacy_ann.api.app import app
+    from spacy_ann.api.app import app, configure_executor, link_batch
+    from spacy_ann.api.batching import MicroBatcher
+    from starlette.middleware.gzip import GZipMiddleware
     from starlette.requests import Request
 
+    rss_before = get_memory_usage().get("rss", 0)
     nlp = spacy.load(model)
+    # build the alias table now so it's shared by all workers
+    if nlp.has_pipe("ann_linker"):
+        nlp.get_pipe("ann_linker").get_alias_table()
+    model_memory = get_memory_usage().get("rss", 0) - rss_before
+    msg.info(f"Loaded {model}: {format_memory_usage(get_memory_usage())}")
+
+    executor = configure_executor(n_threads)
+    batcher = None
+    if micro_batch_wait_ms > 0:
+        batcher = MicroBatcher(
+            partial(link_batch, nlp),
+            max_batch_size=micro_batch_size,
+            max_wait_ms=micro_batch_wait_ms,
+            executor=executor,
+        )
+
+    if gzip_min_size > 0:
+        app.add_middleware(GZipMiddleware, minimum_size=gzip_min_size)
 
     @app.middleware("http")
     async def update_request_state(request: Request, call_next):
         request.state.nlp = nlp
+        request.state.batcher = batcher
         # request.state.api_key = api_key
         response = await call_next(request)
         return response
@@ -49,11 +106,26 @@ def serve(
             def load(self):
                 return self.application
 
+        if n_workers is None:
+            worker_memory = worker_memory_mb * MB if worker_memory_mb else model_memory
+            n_workers = compute_n_workers(
+                n_threads,
+                worker_memory,
+                memory_budget=memory_budget_mb * MB if memory_budget_mb else None,
+            )
+        msg.info(f"Starting {n_workers} workers with {n_threads} linking threads each")
+
+        def post_worker_init(worker):
+            msg.info(f"Worker {worker.pid}: {format_memory_usage(get_memory_usage())}")
+
         options = {
             "bind": f"{host}:{port}",
             "workers": n_workers,
             "worker_class": "uvicorn.workers.UvicornWorker",
+            "preload_app": True,
+            "post_worker_init": post_worker_init,
         }
+        freeze_loaded_objects()
         FastAPIApplication(app, options).run()
     else:
         uvicorn.run(app, host=host, port=port)
@@ -0,0 +1,345 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from pathlib import Path
+from typing import List, Optional, Tuple, Union
+
+import numpy as np
+import scipy
+from sklearn.cluster import KMeans
+from sklearn.decomposition import TruncatedSVD
+
+from .ann_index import AnnIndex
+from .brute_force import MAX_CHUNK_CELLS
+
+# approximate neighbors fetched per requested neighbor before exact re-scoring
+RESCORE_FACTOR = 10
+# storage types of the projected alias vectors of a DenseIndex
+DENSE_DTYPES = ("float32", "float16", "int8")
+# smallest number of aliases split into inverted lists by default, smaller
+# indexes are scanned
+IVF_MIN_ALIASES = 100000
+# inverted lists searched per query
+N_PROBE = 32
+# k-means training vectors per inverted list
+IVF_TRAIN_VECTORS_PER_LIST = 64
+
+
+class DenseProjection:
+    """Linear projection of sparse TF-IDF vectors to L2 normalized dense
+    vectors of a few hundred dimensions, fitted with a truncated SVD of the
+    alias vectors. Dense ANN engines index the projected vectors.
+    """
+
+    def __init__(self, components: np.ndarray):
+        """Initialize a DenseProjection
+
+        components (np.ndarray): `(n_components, n_features)` projection matrix
+        """
+        self.components = np.asarray(components, dtype=np.float32)
+
+    @classmethod
+    def fit(
+        cls, alias_tfidfs: scipy.sparse.csr_matrix, n_components: int = 256, seed: int = 0
+    ) -> "DenseProjection":
+        """Fit the projection on the alias vectors
+
+        alias_tfidfs (scipy.sparse.csr_matrix): TF-IDF vectors of the aliases
+        n_components (int): Dimension of the dense vectors, at most the
+            number of aliases and features
+        seed (int): Random seed of the randomized SVD
+
+        RETURNS (DenseProjection): The fitted projection
+        """
+        n_rows, n_features = alias_tfidfs.shape
+        n_components = max(1, min(n_components, n_rows, n_features - 1))
+        svd = TruncatedSVD(n_components=n_components, random_state=seed)
+        svd.fit(alias_tfidfs)
+        return cls(svd.components_)
+
+    @property
+    def n_components(self) -> int:
+        return self.components.shape[0]
+
+    def transform(self, vectors: scipy.sparse.csr_matrix) -> np.ndarray:
+        """Project and L2 normalize sparse vectors
+
+        vectors (scipy.sparse.csr_matrix): TF-IDF vectors
+
+        RETURNS (np.ndarray): `(n, n_components)` float32 dense vectors
+        """
+        dense = np.asarray(vectors @ self.components.T, dtype=np.float32)
+        norms = np.linalg.norm(dense, axis=1, keepdims=True)
+        dense /= np.maximum(norms, np.finfo(np.float32).tiny)
+        return dense
+
+    def to_disk(self, path: Path):
+        np.save(path, self.components)
+
+    @classmethod
+    def from_disk(cls, path: Path) -> "DenseProjection":
+        return cls(np.load(path))
+
+
+def rescore(
+    alias_tfidfs: scipy.sparse.csr_matrix,
+    vectors: scipy.sparse.csr_matrix,
+    candidates: np.ndarray,
+    k: int,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Exact cosine similarities of approximate neighbors, keeping the k most
+    similar. Dense engines search the projected vectors, re-scoring on the
+    TF-IDF vectors gives the same similarities as the sparse indexes.
+
+    alias_tfidfs (scipy.sparse.csr_matrix): L2 normalized alias vectors
+    vectors (scipy.sparse.csr_matrix): L2 normalized query vectors
+    candidates (np.ndarray): `(n, c)` candidate neighbors of each vector
+    k (int): Number of neighbors to keep
+
+    RETURNS (Tuple[np.ndarray, np.ndarray]): `(n, min(k, c))` int32 neighbors and
+        float32 similarities, most similar first
+    """
+    n_vectors, n_candidates = candidates.shape
+    rows = np.repeat(np.arange(n_vectors), n_candidates)
+    similarities = np.asarray(
+        vectors[rows].multiply(alias_tfidfs[candidates.reshape(-1)]).sum(axis=1),
+        dtype=np.float32,
+    ).reshape(n_vectors, n_candidates)
+    order = np.lexsort((candidates, -similarities), axis=1)[:, :k]
+    return (
+        np.take_along_axis(candidates, order, axis=1).astype(np.int32),
+        np.take_along_axis(similarities, order, axis=1),
+    )
+
+
+def quantize(dense: np.ndarray, dtype: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """Store dense vectors in a smaller type. int8 vectors are scaled per row
+    so the largest absolute value of each row maps to 127.
+
+    dense (np.ndarray): `(n, d)` float32 vectors
+    dtype (str): One of `DENSE_DTYPES`
+
+    RAISES:
+        ValueError: Unknown dtype
+
+    RETURNS (Tuple[np.ndarray, Optional[np.ndarray]]): Stored vectors and the float32
+        scale of each row for int8, None otherwise
+    """
+    if dtype not in DENSE_DTYPES:
+        raise ValueError(f"Unknown dtype {dtype}, expected one of {DENSE_DTYPES}")
+    if dtype != "int8":
+        return dense.astype(dtype), None
+    scales = np.abs(dense).max(axis=1) / 127
+    scales = np.maximum(scales, np.finfo(np.float32).tiny).astype(np.float32)
+    return np.rint(dense / scales[:, None]).astype(np.int8), scales
+
+
+def fit_inverted_lists(
+    dense: np.ndarray,
+    n_lists: int,
+    seed: int = 0,
+    max_chunk_cells: int = MAX_CHUNK_CELLS,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Split L2 normalized vectors into inverted lists with a spherical
+    k-means fitted on a sample of the vectors. Each vector belongs to the
+    list of its most similar centroid.
+
+    dense (np.ndarray): `(n, d)` float32 vectors
+    n_lists (int): Number of lists, at most n
+    seed (int): Random seed of the sample and the k-means
+    max_chunk_cells (int): Maximum number of cells of a similarity block
+
+    RETURNS (Tuple[np.ndarray, np.ndarray, np.ndarray]): `(n_lists, d)` float32
+        centroids, int32 rows of the vectors ordered by list and the int64
+        offsets of each list in these rows
+    """
+    n_vectors = dense.shape[0]
+    n_lists = max(1, min(n_lists, n_vectors))
+    rng = np.random.RandomState(seed)
+    n_train = min(n_vectors, n_lists * IVF_TRAIN_VECTORS_PER_LIST)
+    train = dense[np.sort(rng.choice(n_vectors, n_train, replace=False))]
+    kmeans = KMeans(n_clusters=n_lists, n_init=1, max_iter=20, random_state=seed)
+    centroids = kmeans.fit(train).cluster_centers_.astype(np.float32)
+    norms = np.linalg.norm(centroids, axis=1, keepdims=True)
+    centroids /= np.maximum(norms, np.finfo(np.float32).tiny)
+
+    assignments = np.empty(n_vectors, dtype=np.int64)
+    chunk_size = max(1, max_chunk_cells // n_lists)
+    for start in range(0, n_vectors, chunk_size):
+        end = min(start + chunk_size, n_vectors)
+        assignments[start:end] = np.argmax(dense[start:end] @ centroids.T, axis=1)
+    rows = np.argsort(assignments, kind="stable").astype(np.int32)
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=n_lists), out=offsets[1:])
+    return centroids, rows, offsets
+
+
+def top_k(
+    neighbors: np.ndarray, similarities: np.ndarray, k: int
+) -> Tuple[np.ndarray, np.ndarray]:
+    """The k most similar neighbors of each row, in no particular order
+
+    neighbors (np.ndarray): `(n, c)` neighbors
+    similarities (np.ndarray): `(n, c)` similarities of the neighbors
+    k (int): Number of neighbors to keep
+
+    RETURNS (Tuple[np.ndarray, np.ndarray]): `(n, min(k, c))` neighbors and similarities
+    """
+    if neighbors.shape[1] <= k:
+        return neighbors, similarities
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    return (
+        np.take_along_axis(neighbors, top, axis=1),
+        np.take_along_axis(similarities, top, axis=1),
+    )
+
+
+class DenseIndex(AnnIndex):
+    """Search of quantized dense projections of the alias vectors, taking
+    `n_components` bytes per alias for int8. Without inverted lists, all rows
+    are converted back to float32 in blocks and multiplied with the projected
+    queries in one BLAS matrix product per block. With inverted lists, the rows
+    are stored by list and each query only scores the rows of the `n_probe`
+    lists with the most similar centroids. The top candidates are optionally
+    re-scored exactly on the TF-IDF vectors.
+    """
+
+    def __init__(
+        self,
+        vectors: np.ndarray,
+        scales: Optional[np.ndarray],
+        projection: DenseProjection,
+        alias_tfidfs: Optional[scipy.sparse.csr_matrix] = None,
+        rescore_factor: int = RESCORE_FACTOR,
+        max_chunk_cells: int = MAX_CHUNK_CELLS,
+        centroids: Optional[np.ndarray] = None,
+        list_rows: Optional[np.ndarray] = None,
+        list_offsets: Optional[np.ndarray] = None,
+        n_probe: int = N_PROBE,
+    ):
+        """Initialize a DenseIndex
+
+        vectors (np.ndarray): `(n, n_components)` quantized projected alias vectors,
+            ordered by list if there are inverted lists
+        scales (Optional[np.ndarray]): Row scales of int8 vectors, see `quantize`
+        projection (DenseProjection): Projection of the TF-IDF vectors
+        alias_tfidfs (Optional[scipy.sparse.csr_matrix]): TF-IDF vectors of the aliases
+            to re-score the candidates with, None to return the dense similarities
+        rescore_factor (int): Candidates re-scored per requested neighbor
+        max_chunk_cells (int): Maximum number of cells of a dense similarity block
+        centroids (Optional[np.ndarray]): Centroids of the inverted lists, None to
+            scan all vectors, see `fit_inverted_lists`
+        list_rows (Optional[np.ndarray]): Alias row of each vector
+        list_offsets (Optional[np.ndarray]): Offsets of each list in the vectors
+        n_probe (int): Inverted lists searched per query
+        """
+        self.vectors = vectors
+        self.scales = scales
+        self.projection = projection
+        self.alias_tfidfs = (
+            None if alias_tfidfs is None else scipy.sparse.csr_matrix(alias_tfidfs)
+        )
+        self.rescore_factor = rescore_factor
+        self.max_chunk_cells = max_chunk_cells
+        self.centroids = centroids
+        self.list_rows = list_rows
+        self.list_offsets = list_offsets
+        self.n_probe = n_probe
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+    def _similarities(
+        self, queries: np.ndarray, rows: Union[slice, np.ndarray]
+    ) -> np.ndarray:
+        """Dense similarities of the queries and some of the stored vectors"""
+        similarities = queries @ np.asarray(self.vectors[rows], dtype=np.float32).T
+        if self.scales is not None:
+            similarities *= self.scales[rows]
+        return similarities
+
+    def knn_dense(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Top k aliases of projected queries by dense similarity
+
+        queries (np.ndarray): `(n, n_components)` projected query vectors
+        k (int): Number of neighbors
+
+        RETURNS (Tuple[np.ndarray, np.ndarray]): `(n, k)` int64 neighbors and float32
+            similarities, most similar first
+        """
+        k = min(k, len(self))
+        if self.centroids is None:
+            neighbors, similarities = self._scan(queries, k)
+        else:
+            neighbors, similarities = self._search_lists(queries, k)
+        order = np.lexsort((neighbors, -similarities), axis=1)[:, :k]
+        return (
+            np.take_along_axis(neighbors, order, axis=1),
+            np.take_along_axis(similarities, order, axis=1),
+        )
+
+    def _scan(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Unordered top k of all vectors"""
+        n_aliases = len(self)
+        n_queries, n_components = queries.shape
+        # bounds both the similarity block and the float32 copy of the vectors
+        block_size = max(
+            k, self.max_chunk_cells // max(n_queries, n_components, 1)
+        )
+        neighbors = np.empty((n_queries, 0), dtype=np.int64)
+        similarities = np.empty((n_queries, 0), dtype=np.float32)
+        for start in range(0, n_aliases, block_size):
+            end = min(start + block_size, n_aliases)
+            block_similarities = self._similarities(queries, slice(start, end))
+            block_neighbors = np.broadcast_to(
+                np.arange(start, end), block_similarities.shape
+            )
+            block_neighbors, block_similarities = top_k(
+                block_neighbors, block_similarities, k
+            )
+            # merge into the running top k so memory doesn't grow with the aliases
+            neighbors, similarities = top_k(
+                np.hstack([neighbors, block_neighbors]),
+                np.hstack([similarities, block_similarities]),
+                k,
+            )
+        return neighbors, similarities
+
+    def _search_lists(self, queries: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Unordered top k of the vectors in the inverted lists probed by each query"""
+        n_queries = queries.shape[0]
+        list_sizes = np.diff(self.list_offsets)
+        probe_order = np.argsort(-(queries @ self.centroids.T), axis=1)
+        neighbors = np.empty((n_queries, k), dtype=np.int64)
+        similarities = np.empty((n_queries, k), dtype=np.float32)
+        for i, query in enumerate(queries):
+            lists = probe_order[i]
+            # probe more lists if the first ones hold fewer than k vectors
+            n_probe = max(
+                self.n_probe, int(np.searchsorted(np.cumsum(list_sizes[lists]), k)) + 1
+            )
+            rows = np.concatenate([
+                np.arange(self.list_offsets[l], self.list_offsets[l + 1])
+                for l in lists[:n_probe]
+            ])
+            row_neighbors, row_similarities = top_k(
+                rows[None], self._similarities(query[None], rows), k
+            )
+            neighbors[i] = self.list_rows[row_neighbors[0]]
+            similarities[i] = row_similarities[0]
+        return neighbors, similarities
+
+    def knnQueryBatch(
+        self, vectors: scipy.sparse.csr_matrix, k: int = 10, num_threads: int = 0
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        vectors = scipy.sparse.csr_matrix(vectors)
+        queries = self.projection.transform(vectors)
+        if self.alias_tfidfs is None:
+            neighbors, similarities = self.knn_dense(queries, k)
+        else:
+            candidates, _ = self.knn_dense(queries, k * self.rescore_factor)
+            neighbors, similarities = rescore(self.alias_tfidfs, vectors, candidates, k)
+        return [
+            (row_neighbors.astype(np.int32), 1.0 - row_similarities)
+            for row_neighbors, row_similarities in zip(neighbors, similarities)
+        ]
@@ -0,0 +1,78 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from pathlib import Path
+from typing import Iterable
+
+import numpy as np
+from spacy.strings import hash_string
+
+
+class ExactAliasIndex:
+    """Rows of the aliases with a given normal form, stored as the sorted
+    64 bit hashes of the normal forms and the alias row of each hash. Both
+    arrays can be saved as `.npy` files and memory-mapped on load, so a
+    lookup is a binary search and loading doesn't read the aliases.
+    """
+
+    def __init__(self, keys: np.ndarray, rows: np.ndarray):
+        """Initialize an ExactAliasIndex
+
+        keys (np.ndarray): Sorted uint64 hashes of the alias normal forms
+        rows (np.ndarray): int32 alias row of each hash, ascending for equal hashes
+        """
+        self.keys = keys
+        self.rows = rows
+
+    @classmethod
+    def build(cls, normal_forms: Iterable[str]) -> "ExactAliasIndex":
+        """Build the index from the normal form of each alias
+
+        normal_forms (Iterable[str]): Normal form of each alias, in row order
+
+        RETURNS (ExactAliasIndex): Index of the aliases
+        """
+        keys = np.fromiter(
+            (hash_string(normal_form) for normal_form in normal_forms), dtype=np.uint64
+        )
+        order = np.argsort(keys, kind="stable")
+        return cls(keys[order], order.astype(np.int32))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def lookup(self, normal_form: str) -> np.ndarray:
+        """Rows of the aliases with a normal form, in row order. Rows of other
+        normal forms with the same hash are included, compare the aliases to
+        rule them out.
+
+        normal_form (str): Normal form to look up
+
+        RETURNS (np.ndarray): int32 alias rows
+        """
+        key = np.uint64(hash_string(normal_form))
+        start = np.searchsorted(self.keys, key, side="left")
+        end = np.searchsorted(self.keys, key, side="right")
+        return self.rows[start:end]
+
+    def to_disk(self, path: Path):
+        """Save the index as `{path}.keys.npy` and `{path}.rows.npy`
+
+        path (Path): Path prefix to save to
+        """
+        np.save(f"{path}.keys.npy", self.keys)
+        np.save(f"{path}.rows.npy", self.rows)
+
+    @classmethod
+    def from_disk(cls, path: Path, mmap: bool = True) -> "ExactAliasIndex":
+        """Load an index saved with `to_disk`
+
+        path (Path): Path prefix to load from
+        mmap (bool): Memory-map the arrays instead of reading them into memory
+
+        RETURNS (ExactAliasIndex): Loaded ExactAliasIndex
+        """
+        mmap_mode = "r" if mmap else None
+        keys = np.load(f"{path}.keys.npy", mmap_mode=mmap_mode)
+        rows = np.load(f"{path}.rows.npy", mmap_mode=mmap_mode)
+        return cls(keys, rows)
@@ -1,16 +1,22 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any, Dict, Generator, List, Tuple
+from typing import Any, Dict, Generator, List, NamedTuple, Optional, Tuple
 
 import requests
 import srsly
-from requests import HTTPError
+from requests import RequestException
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from spacy.language import Language
 from spacy.pipeline import Pipe
 from spacy.tokens import Doc, Span
 from spacy.util import ensure_path, from_disk, minibatch, to_disk
+from spacy_ann.util import CacheStats, LRUCache
 
 
 @Language.factory(
@@ -19,7 +25,18 @@ from spacy.util import ensure_path, from_disk, minibatch, to_disk
     assigns=["span._.kb_alias"],
     default_config={
         'base_url': 'http://localhost:8080',
-        'headers': {}
+        'headers': {},
+        'connect_timeout': 5.0,
+        'read_timeout': 60.0,
+        'max_retries': 3,
+        'backoff_factor': 0.5,
+        'max_in_flight': 4,
+        'mention_mode': False,
+        'candidates_url': '',
+        'wire_format': 'msgpack',
+        'cache_size': 0,
+        'cache_ttl': 0.0,
+        'version_check_interval': 60.0,
     },
     default_score_weights={
         "ents_f": 1.0,
@@ -32,32 +49,170 @@ def make_remobe_ann_linker(
     nlp: Language,
     name: str,
     base_url: str,
-    headers: dict
+    headers: dict,
+    connect_timeout: float,
+    read_timeout: float,
+    max_retries: int,
+    backoff_factor: float,
+    max_in_flight: int,
+    mention_mode: bool,
+    candidates_url: str,
+    wire_format: str,
+    cache_size: int,
+    cache_ttl: float,
+    version_check_interval: float,
 ):
     return RemoteAnnLinker(
         nlp,
         name,
         base_url = base_url,
-        headers = headers
+        headers = headers,
+        connect_timeout = connect_timeout,
+        read_timeout = read_timeout,
+        max_retries = max_retries,
+        backoff_factor = backoff_factor,
+        max_in_flight = max_in_flight,
+        mention_mode = mention_mode,
+        candidates_url = candidates_url,
+        wire_format = wire_format,
+        cache_size = cache_size,
+        cache_ttl = cache_ttl,
+        version_check_interval = version_check_interval,
     )
 
+
+class _BatchRequest(NamedTuple):
+    """Request for a batch of docs. `url` is None if every mention is cached."""
+
+    url: Optional[str]
+    params: Dict[str, Any]
+    payload: Dict[str, Any]
+    # spans sent to the server, in response order
+    sent: List[Span]
+    # cached kb ids of the (text, label) mentions that are not sent
+    cached: Dict[Tuple[str, str], str] = {}
+    # a span of each cached mention, to link it again if the model version changed
+    cached_spans: List[Span] = []
+    # model version of the cached kb ids
+    model_version: Optional[str] = None
+
+
 class RemoteAnnLinker(Pipe):
     """The RemoteAnnLinker interfaces with a Remote Server to handle 
     Entity Linking when the KnowledgeBase and ANN Index cannot be in memory.
     """
 
+    # Statuses worth retrying: the server is overloaded or restarting workers.
+    # Linking requests don't change server state so POSTs are safe to retry.
+    RETRY_STATUSES = (429, 502, 503, 504)
+    MSGPACK_MEDIA_TYPE = "application/msgpack"
+    MODEL_VERSION_HEADER = "X-Model-Version"
+    # only the ids of the /link response are used
+    LINK_PARAMS = {"include_candidates": "false", "include_context": "false"}
+
     def __init__(self, nlp, name, **cfg):
         """Initialize the RemoteAnnLinker
         
         nlp (Language): spaCy Language object
+        base_url (str): URL of the /link endpoint
+        headers (dict): Headers sent with every request
+        connect_timeout (float): Seconds to wait for a connection
+        read_timeout (float): Seconds to wait for a response
+        max_retries (int): Retries of failed connections and retryable statuses
+        backoff_factor (float): Exponential backoff between retries in seconds
+        max_in_flight (int): Number of batches `pipe` keeps in flight at once
+        mention_mode (bool): Send only the distinct mention texts and labels of each
+            batch to the /candidates endpoint instead of the full documents.
+            Context similarity on the server can't use the documents in this mode.
+        candidates_url (str): URL of the /candidates endpoint, derived from
+            `base_url` if not set
+        wire_format (str): "msgpack" to ask the server for msgpack responses or "json"
+        cache_size (int): Number of (mention text, label) kb ids to cache, 0 disables
+            the cache. Cached mentions are not sent to the server and the cache is
+            cleared when the server reports a new model version.
+        cache_ttl (float): Seconds a cached kb id stays valid, 0 keeps it until evicted
+        version_check_interval (float): Seconds without a server response after
+            which the model version is checked with an empty request before
+            cached kb ids are used again
         """
         Span.set_extension("kb_alias", default="", force=True)
 
         self.nlp = nlp
         self.name = name
         self.cfg = dict(cfg)
+        self._session: Optional[requests.Session] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.model_version: Optional[str] = None
+        # time.monotonic() of the last response reporting the model version
+        self._version_checked_at = 0.0
+        self._configure(self.cfg)
+
+    def _configure(self, cfg: Dict[str, Any]):
+        """Apply the client config. The HTTP session and thread pool
+        are (re)created on next use.
+
+        cfg (Dict[str, Any]): RemoteAnnLinker config
+        """
         self.base_url = cfg.get("base_url")
         self.headers = cfg.get("headers", {})
+        self.timeout = (cfg.get("connect_timeout", 5.0), cfg.get("read_timeout", 60.0))
+        self.max_retries = cfg.get("max_retries", 3)
+        self.backoff_factor = cfg.get("backoff_factor", 0.5)
+        self.max_in_flight = max(1, cfg.get("max_in_flight", 4))
+        self.mention_mode = cfg.get("mention_mode", False)
+        self.candidates_url = cfg.get("candidates_url") or self._derive_candidates_url()
+        self.wire_format = cfg.get("wire_format", "msgpack")
+        accept = (
+            f"{self.MSGPACK_MEDIA_TYPE}, application/json"
+            if self.wire_format == "msgpack"
+            else "application/json"
+        )
+        self.request_headers = {"Content-Type": "application/json", "Accept": accept}
+        cache_size = cfg.get("cache_size", 0)
+        self.cache = (
+            LRUCache(cache_size, ttl=cfg.get("cache_ttl") or None) if cache_size else None
+        )
+        self.version_check_interval = cfg.get("version_check_interval", 60.0)
+        self.close()
+
+    def _derive_candidates_url(self) -> str:
+        base_url = (self.base_url or "").rstrip("/")
+        if base_url.endswith("/link"):
+            base_url = base_url[: -len("/link")]
+        return f"{base_url}/candidates"
+
+    @property
+    def session(self) -> requests.Session:
+        """Pooled keep-alive HTTP session with retries and backoff
+        
+        RETURNS (requests.Session): Session used for all requests
+        """
+        if self._session is None:
+            retry = Retry(
+                total=self.max_retries,
+                backoff_factor=self.backoff_factor,
+                status_forcelist=self.RETRY_STATUSES,
+                allowed_methods=None,
+                raise_on_status=False,
+            )
+            adapter = HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.max_in_flight, max_retries=retry
+            )
+            session = requests.Session()
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update(self.headers)
+            self._session = session
+        return self._session
+
+    def close(self):
+        """Close pooled connections and stop the request threads"""
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
 
     @property
     def aliases(self) -> List[str]:
@@ -93,14 +248,8 @@ class RemoteAnnLinker(Pipe):
         RETURNS (Doc): spaCy Doc with updated annotations
         """
 
-        documents = [{"spans": self._ents_to_json(doc.ents), "context": doc.text}]
-
-        data = self._make_request(documents)
-        for ent, span in zip(doc.ents, data["documents"][0]["spans"]):
-            if span["id"]:
-                for t in ent:
-                    t.ent_kb_id_ = span["id"]
-
+        request = self._prepare_batch([doc])
+        self._apply_batch([doc], request, self._send(request))
         return doc
 
     def pipe(
@@ -117,21 +266,230 @@ class RemoteAnnLinker(Pipe):
         RETURNS (Generator[Doc]): Stream of spaCy Docs with updated annotations
         """
 
-        for docs in minibatch(stream, size=batch_size):
-            documents = [
-                {"spans": self._ents_to_json(doc.ents), "context": doc.text}
-                for doc in docs
-            ]
+        if self.max_in_flight == 1:
+            for docs in minibatch(stream, size=batch_size):
+                request = self._prepare_batch(docs)
+                yield from self._apply_batch(docs, request, self._send(request))
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_in_flight, thread_name_prefix="remote_ann_linker"
+            )
+        # Send the next batches while the results of the oldest one are applied.
+        # Results are consumed in submission order so docs keep their order.
+        in_flight = deque()
+        try:
+            for docs in minibatch(stream, size=batch_size):
+                request = self._prepare_batch(docs)
+                future = self._executor.submit(self._send, request)
+                in_flight.append((docs, request, future))
+                if len(in_flight) >= self.max_in_flight:
+                    docs, request, future = in_flight.popleft()
+                    yield from self._apply_batch(docs, request, future.result())
+            while in_flight:
+                docs, request, future = in_flight.popleft()
+                yield from self._apply_batch(docs, request, future.result())
+        finally:
+            for _, _, future in in_flight:
+                future.cancel()
+
+    def _prepare_batch(self, docs: List[Doc]) -> _BatchRequest:
+        """Build the request for a batch of docs. With the cache enabled, mentions
+        with a cached id and repeated mentions are not sent.
+        
+        docs (List[Doc]): Batch of spaCy docs
+        
+        RETURNS (_BatchRequest): Request for the batch
+        """
+        if self.cache is None and not self.mention_mode:
+            # send every span in its document
+            sent = [ent for doc in docs for ent in doc.ents]
+            if not sent:
+                return _BatchRequest(None, {}, {}, sent)
+            return _BatchRequest(
+                self.base_url,
+                self.LINK_PARAMS,
+                {"documents": self._docs_to_json(docs)},
+                sent,
+            )
+
+        if self.cache is not None and len(self.cache) and self._version_check_due():
+            self._check_model_version()
+        cached = {}
+        cached_spans = []
+        sent = []
+        seen = set()
+        for doc in docs:
+            for ent in doc.ents:
+                key = (ent.text, ent.label_)
+                if key in seen:
+                    continue
+                seen.add(key)
+                if self.cache is not None:
+                    kb_id = self.cache.get((self.model_version,) + key)
+                    if kb_id is not None:
+                        cached[key] = kb_id
+                        cached_spans.append(ent)
+                        continue
+                sent.append(ent)
+        return self._link_request(sent)._replace(
+            cached=cached, cached_spans=cached_spans, model_version=self.model_version
+        )
+
+    def _link_request(self, spans: List[Span]) -> _BatchRequest:
+        """Request to link distinct mentions, each sent once in the first doc
+        it occurs in or as a mention text in mention mode
+
+        spans (List[Span]): Spans to link, in doc order
+
+        RETURNS (_BatchRequest): Request for the spans
+        """
+        if not spans:
+            return _BatchRequest(None, {}, {}, spans)
+        if self.mention_mode:
+            payload = {
+                "texts": [ent.text for ent in spans],
+                "labels": [ent.label_ for ent in spans],
+                # only the ids are used
+                "max_candidates": 0,
+            }
+            return _BatchRequest(self.candidates_url, {}, payload, spans)
+        doc_spans: Dict[int, Tuple[Doc, List[Span]]] = {}
+        for ent in spans:
+            doc_spans.setdefault(id(ent.doc), (ent.doc, []))[1].append(ent)
+        documents = [
+            {"spans": self._ents_to_json(ents), "context": doc.text}
+            for doc, ents in doc_spans.values()
+        ]
+        return _BatchRequest(
+            self.base_url, self.LINK_PARAMS, {"documents": documents}, spans
+        )
+
+    def _version_check_due(self) -> bool:
+        return time.monotonic() - self._version_checked_at >= self.version_check_interval
+
+    def _check_model_version(self):
+        """Ask the server for its model version with an empty request and
+        clear the cache if the version changed
+        """
+        if self.mention_mode:
+            request = _BatchRequest(
+                self.candidates_url, {}, {"texts": [], "labels": [], "max_candidates": 0}, []
+            )
+        else:
+            request = _BatchRequest(self.base_url, self.LINK_PARAMS, {"documents": []}, [])
+        res = self._post_raw(request.url, request.payload, request.params)
+        self._update_model_version(res.headers.get(self.MODEL_VERSION_HEADER))
+
+    def _update_model_version(self, model_version: Optional[str]):
+        """Record the model version reported by the server, clearing the
+        cache if it changed
+
+        model_version (Optional[str]): Model version reported by the server
+        """
+        self._version_checked_at = time.monotonic()
+        if model_version != self.model_version:
+            if self.cache is not None:
+                self.cache.clear()
+            self.model_version = model_version
+
+    def _send(self, request: _BatchRequest) -> Tuple[Dict[str, Any], Optional[str]]:
+        """Send a batch request, if there is anything to send
+        
+        request (_BatchRequest): Request built by `_prepare_batch`
+        
+        RETURNS (Tuple[Dict[str, Any], Optional[str]]): Decoded response and
+            model version reported by the server
+        """
+        if request.url is None:
+            return {}, self.model_version
+        res = self._post_raw(request.url, request.payload, request.params)
+        return self._decode(res), res.headers.get(self.MODEL_VERSION_HEADER)
+
+    def _apply_batch(
+        self,
+        docs: List[Doc],
+        request: _BatchRequest,
+        response: Tuple[Dict[str, Any], Optional[str]],
+    ) -> List[Doc]:
+        """Set the kb ids of a server response on the batch of docs
+        and cache them
+        
+        docs (List[Doc]): Batch of spaCy docs
+        request (_BatchRequest): Request of the batch
+        response (Tuple[Dict[str, Any], Optional[str]]): Server response
+            for the batch and model version
+        
+        RETURNS (List[Doc]): The annotated docs
+        """
+        data, model_version = response
+        ids = self._response_ids(request, data)
+
+        cached = request.cached
+        if self.cache is not None and request.url is not None:
+            self._update_model_version(model_version)
+            if cached and model_version != request.model_version:
+                # the cached ids are from the previous model version, don't mix them
+                # with the ids of the new one
+                relink = self._link_request(request.cached_spans)
+                relink_data, relink_version = self._send(relink)
+                self._update_model_version(relink_version)
+                relink_ids = self._response_ids(relink, relink_data)
+                cached = {
+                    (ent.text, ent.label_): kb_id
+                    for ent, kb_id in zip(relink.sent, relink_ids)
+                }
+                self._cache_ids(relink.sent, relink_ids, relink_version)
+            self._cache_ids(request.sent, ids, model_version)
+
+        kb_ids = dict(cached)
+        sent_ids = {}
+        for ent, kb_id in zip(request.sent, ids):
+            sent_ids[(ent.start_char, ent.end_char, id(ent.doc))] = kb_id
+            kb_ids.setdefault((ent.text, ent.label_), kb_id)
+        for doc in docs:
+            for ent in doc.ents:
+                kb_id = sent_ids.get((ent.start_char, ent.end_char, id(doc)))
+                if kb_id is None:
+                    kb_id = kb_ids.get((ent.text, ent.label_))
+                if kb_id:
+                    for t in ent:
+                        t.ent_kb_id_ = kb_id
+        return docs
 
-            data = self._make_request(documents)
+    def _response_ids(self, request: _BatchRequest, data: Dict[str, Any]) -> List[str]:
+        """Kb ids of the spans sent with a request, in order"""
+        if not request.sent:
+            return []
+        if self.mention_mode:
+            return data["ids"]
+        return [span["id"] for doc in data["documents"] for span in doc["spans"]]
 
-            for spacy_doc, res_doc in zip(docs, data["documents"]):
-                for ent, span in zip(spacy_doc.ents, res_doc["spans"]):
-                    if span["id"]:
-                        for t in ent:
-                            t.ent_kb_id_ = span["id"]
+    def _cache_ids(self, spans: List[Span], ids: List[str], model_version: Optional[str]):
+        for ent, kb_id in zip(spans, ids):
+            if kb_id is not None:
+                self.cache.add((model_version, ent.text, ent.label_), kb_id)
+
+    @property
+    def cache_stats(self) -> Optional[CacheStats]:
+        """Hits, misses and evictions of the mention cache
+        
+        RETURNS (Optional[CacheStats]): Cache stats or None if the cache is disabled
+        """
+        return self.cache.stats if self.cache is not None else None
 
-            yield from docs
+    def _docs_to_json(self, docs: List[Doc]) -> List[Dict[str, Any]]:
+        """Convert a batch of spaCy docs to request documents
+        
+        docs (List[Doc]): Batch of spaCy docs
+        
+        RETURNS (List[Dict[str, Any]]): JSON documents
+        """
+        return [
+            {"spans": self._ents_to_json(doc.ents), "context": doc.text}
+            for doc in docs
+        ]
 
     def _make_request(self, documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Make request to remote Web Service with batch
@@ -145,16 +503,51 @@ class RemoteAnnLinker(Pipe):
         
         RETURNS (Dict[str, Any]): List of Documents with id prop set on each span
         """
+        return self._post(self.base_url, {"documents": documents}, self.LINK_PARAMS)
 
-        res = requests.post(
-            self.base_url, headers=self.headers, json={"documents": documents}
-        )
+    def _post(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        params: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """POST a JSON payload to the remote Web Service and decode the
+        response according to its content type
+        
+        url (str): Endpoint URL
+        payload (Dict[str, Any]): JSON payload
+        params (Optional[Dict[str, Any]]): Query parameters
+        
+        RAISES:
+            ValueError: If there is a server error, raise and exit
+        
+        RETURNS (Dict[str, Any]): Decoded response
+        """
+        return self._decode(self._post_raw(url, payload, params))
+
+    def _post_raw(
+        self,
+        url: str,
+        payload: Dict[str, Any],
+        params: Optional[Dict[str, Any]] = None,
+    ) -> requests.Response:
         try:
+            res = self.session.post(
+                url,
+                data=srsly.json_dumps(payload),
+                params=params,
+                headers=self.request_headers,
+                timeout=self.timeout,
+            )
             res.raise_for_status()
-        except HTTPError as e:
+        except RequestException as e:
             raise ValueError("Error in making request to the server.", e)
-        data = res.json()
-        return data
+        return res
+
+    def _decode(self, res: requests.Response) -> Dict[str, Any]:
+        if res.headers.get("Content-Type", "").startswith(self.MSGPACK_MEDIA_TYPE):
+            return srsly.msgpack_loads(res.content)
+        return srsly.json_loads(res.content)
 
     def from_disk(self, path: Path, **kwargs):
         """Deserialize saved RemoteAnnLinker from disk.
@@ -168,8 +561,7 @@ class RemoteAnnLinker(Pipe):
         deserializers = {"cfg": lambda p: cfg.update(srsly.read_json(p))}
         from_disk(path, deserializers, {})
         self.cfg.update(cfg)
-        self.base_url = cfg.get("base_url")
-        self.headers = cfg.get("headers", {})
+        self._configure(self.cfg)
 
         return self
 
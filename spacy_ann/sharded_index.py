@@ -0,0 +1,242 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import nmslib
+import numpy as np
+import scipy
+from nmslib.dist import FloatIndex
+from sklearn.base import clone
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .ann_index import AnnIndex
+
+
+class ShardedIndex(AnnIndex):
+    """Several HNSW indexes over consecutive ranges of the aliases, queried
+    as one index. Neighbors of shard `i` are offset by `offsets[i]`, so they
+    index the concatenated aliases of all shards.
+    """
+
+    def __init__(self, shards: List[FloatIndex], offsets: Sequence[int]):
+        """Initialize a ShardedIndex
+
+        shards (List[FloatIndex]): HNSW index of each shard
+        offsets (Sequence[int]): Row offset of each shard in the aliases
+        """
+        self.shards = shards
+        self.offsets = list(offsets)
+
+    def __len__(self) -> int:
+        return sum(len(shard) for shard in self.shards)
+
+    def knnQueryBatch(
+        self, vectors: scipy.sparse.csr_matrix, k: int = 10, num_threads: int = 0
+    ) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Query every shard and merge the k nearest neighbors of each vector
+
+        vectors (scipy.sparse.csr_matrix): Non-empty query vectors
+        k (int): Number of neighbors
+        num_threads (int): Query threads of each shard, 0 uses all cores
+
+        RETURNS (List[Tuple[np.ndarray, np.ndarray]]): Neighbors and distances
+            of each vector, nearest first
+        """
+        shard_results = [
+            shard.knnQueryBatch(vectors, k=k, num_threads=num_threads)
+            for shard in self.shards
+        ]
+        results = []
+        for row_results in zip(*shard_results):
+            ids = np.concatenate([
+                idx.astype(np.int32) + offset
+                for (idx, _), offset in zip(row_results, self.offsets)
+            ])
+            dists = np.concatenate([dist for _, dist in row_results])
+            order = np.argsort(dists, kind="stable")[:k]
+            results.append((ids[order], dists[order]))
+        return results
+
+    def setQueryTimeParams(self, params: Dict[str, Any]):
+        for shard in self.shards:
+            shard.setQueryTimeParams(params)
+
+    def saveIndex(self, path: str, save_data: bool = True):
+        """Save each shard to `{path}.shard{i}`"""
+        for i, shard in enumerate(self.shards):
+            shard.saveIndex(f"{path}.shard{i}", save_data=save_data)
+
+    @classmethod
+    def load(cls, path: str, offsets: Sequence[int]) -> "ShardedIndex":
+        """Load shards saved with `saveIndex` together with their data
+
+        path (str): Path passed to `saveIndex`
+        offsets (Sequence[int]): Row offset of each shard in the aliases
+
+        RETURNS (ShardedIndex): The loaded index
+        """
+        shards = []
+        for i in range(len(offsets)):
+            shard = _init_index()
+            shard.loadIndex(f"{path}.shard{i}", load_data=True)
+            shards.append(shard)
+        return cls(shards, offsets)
+
+
+def _init_index() -> FloatIndex:
+    return nmslib.init(
+        method="hnsw",
+        space="cosinesimil_sparse",
+        data_type=nmslib.DataType.SPARSE_VECTOR,
+    )
+
+
+def count_terms(
+    vectorizer: TfidfVectorizer, aliases: List[str]
+) -> Tuple[List[str], np.ndarray]:
+    """Document frequency of each term in a range of aliases. Runs in a worker process.
+
+    vectorizer (TfidfVectorizer): Unfitted vectorizer with the analyzer params
+    aliases (List[str]): Aliases to count
+
+    RETURNS (Tuple[List[str], np.ndarray]): Terms and their document frequencies
+    """
+    counter = clone(vectorizer).set_params(use_idf=False, norm=None)
+    counts = scipy.sparse.csr_matrix(counter.fit_transform(aliases))
+    terms = [None] * len(counter.vocabulary_)
+    for term, i in counter.vocabulary_.items():
+        terms[i] = term
+    # binary per alias, so each alias counts a term once
+    counts.sum_duplicates()
+    return terms, np.bincount(counts.indices, minlength=len(terms))
+
+
+def merge_term_counts(
+    vectorizer: TfidfVectorizer,
+    shard_counts: List[Tuple[List[str], np.ndarray]],
+    n_aliases: int,
+) -> TfidfVectorizer:
+    """Merge the term counts of all shards into the vocabulary and idf
+    `TfidfVectorizer.fit` computes for all aliases
+
+    vectorizer (TfidfVectorizer): Unfitted vectorizer with `smooth_idf` enabled
+    shard_counts (List[Tuple[List[str], np.ndarray]]): Result of `count_terms` for each shard
+    n_aliases (int): Total number of aliases
+
+    RETURNS (TfidfVectorizer): Fitted copy of the vectorizer
+    """
+    df: Dict[str, int] = {}
+    for terms, counts in shard_counts:
+        for term, count in zip(terms, counts.tolist()):
+            df[term] = df.get(term, 0) + count
+    # sklearn sorts the vocabulary by term
+    terms = sorted(df)
+    vocabulary = {term: i for i, term in enumerate(terms)}
+    dtype = vectorizer.dtype if vectorizer.dtype in (np.float32, np.float64) else np.float64
+    term_df = np.array([df[term] for term in terms], dtype=dtype) + 1
+    idf = np.full_like(term_df, fill_value=n_aliases + 1, dtype=dtype)
+    idf /= term_df
+    np.log(idf, out=idf)
+    idf += 1.0
+
+    fitted = clone(vectorizer).set_params(vocabulary=vocabulary)
+    fitted.idf_ = idf
+    return fitted
+
+
+def build_shard(
+    vectorizer: TfidfVectorizer,
+    aliases: Optional[List[str]],
+    alias_tfidfs: Optional[scipy.sparse.csr_matrix],
+    index_params: Dict[str, Any],
+    path: str,
+) -> Tuple[np.ndarray, scipy.sparse.csr_matrix]:
+    """Vectorize a range of aliases and build their HNSW index. Runs in a worker
+    process, the index is saved with its data to `path` because nmslib indexes
+    can't be pickled.
+
+    vectorizer (TfidfVectorizer): Fitted vectorizer
+    aliases (Optional[List[str]]): Aliases to vectorize
+    alias_tfidfs (Optional[scipy.sparse.csr_matrix]): Already computed vectors, used
+        instead of `aliases` if set
+    index_params (Dict[str, Any]): HNSW index params
+    path (str): Path to save the index to
+
+    RETURNS (Tuple[np.ndarray, scipy.sparse.csr_matrix]): Mask of the aliases with
+        a non-empty vector and their vectors
+    """
+    if alias_tfidfs is None:
+        alias_tfidfs = scipy.sparse.csr_matrix(vectorizer.transform(aliases))
+    non_empty = np.asarray(alias_tfidfs.sum(axis=1)).reshape(-1) != 0
+    alias_tfidfs = alias_tfidfs[non_empty]
+    index = _init_index()
+    index.addDataPointBatch(alias_tfidfs)
+    index.createIndex(index_params, print_progress=False)
+    index.saveIndex(path, save_data=True)
+    return non_empty, alias_tfidfs
+
+
+def shard_bounds(n_rows: int, n_shards: int) -> List[Tuple[int, int]]:
+    """Split `n_rows` into `n_shards` consecutive ranges of (almost) equal size"""
+    edges = np.linspace(0, n_rows, n_shards + 1).astype(int).tolist()
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def build_sharded_index(
+    vectorizer: TfidfVectorizer,
+    index_params: Dict[str, Any],
+    ef_search: int,
+    n_shards: int,
+    path: Path,
+    aliases: Optional[List[str]] = None,
+    alias_tfidfs: Optional[scipy.sparse.csr_matrix] = None,
+    n_processes: Optional[int] = None,
+) -> Tuple[ShardedIndex, np.ndarray, scipy.sparse.csr_matrix]:
+    """Build the HNSW shards of a list of aliases in parallel worker processes
+
+    vectorizer (TfidfVectorizer): Fitted vectorizer
+    index_params (Dict[str, Any]): HNSW index params of each shard
+    ef_search (int): Query time efSearch param
+    n_shards (int): Number of shards
+    path (Path): Directory to write the shard indexes to
+    aliases (Optional[List[str]]): Aliases to vectorize and index
+    alias_tfidfs (Optional[scipy.sparse.csr_matrix]): Already computed vectors to index
+    n_processes (Optional[int]): Number of worker processes, defaults to `n_shards`
+
+    RETURNS (Tuple[ShardedIndex, np.ndarray, scipy.sparse.csr_matrix]): The index, mask of
+        the aliases with a non-empty vector and the indexed vectors
+    """
+    n_rows = len(aliases) if alias_tfidfs is None else alias_tfidfs.shape[0]
+    bounds = shard_bounds(n_rows, n_shards)
+    with ProcessPoolExecutor(max_workers=n_processes or n_shards) as pool:
+        futures = [
+            pool.submit(
+                build_shard,
+                vectorizer,
+                aliases[start:end] if alias_tfidfs is None else None,
+                alias_tfidfs[start:end] if alias_tfidfs is not None else None,
+                index_params,
+                str(path / f"shard{i}.bin"),
+            )
+            for i, (start, end) in enumerate(bounds)
+        ]
+        results = [future.result() for future in futures]
+
+    shards = []
+    offsets = []
+    n_indexed = 0
+    for i, (non_empty, _) in enumerate(results):
+        shard = _init_index()
+        shard.loadIndex(str(path / f"shard{i}.bin"), load_data=True)
+        shards.append(shard)
+        offsets.append(n_indexed)
+        n_indexed += int(non_empty.sum())
+
+    index = ShardedIndex(shards, offsets)
+    index.setQueryTimeParams({"efSearch": ef_search})
+    non_empty = np.concatenate([mask for mask, _ in results])
+    alias_tfidfs = scipy.sparse.vstack([tfidfs for _, tfidfs in results], format="csr")
+    return index, non_empty, alias_tfidfs
@@ -0,0 +1,84 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from pathlib import Path
+from typing import Iterable, Iterator, List, Sequence, Union
+
+import numpy as np
+
+
+class StringTable(Sequence):
+    """An immutable list of strings stored as one flat utf-8 byte buffer
+    plus an offsets array. Both arrays can be saved as `.npy` files and
+    memory-mapped on load, so opening a table with millions of strings
+    is O(1) and strings are only decoded when accessed.
+    """
+
+    def __init__(self, offsets: np.ndarray, data: np.ndarray):
+        """Initialize a StringTable
+
+        offsets (np.ndarray): int64 array of len(table) + 1 byte offsets into `data`
+        data (np.ndarray): uint8 array with the utf-8 encoded strings
+        """
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_strings(cls, strings: Iterable[str]) -> "StringTable":
+        """Build a StringTable from a list of strings
+
+        strings (Iterable[str]): Strings to store
+
+        RETURNS (StringTable): StringTable with the encoded strings
+        """
+        encoded = [s.encode("utf8") for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+        return cls(offsets, data)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: Union[int, slice]):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.data[start:end].tobytes().decode("utf8")
+
+    def __iter__(self) -> Iterator[str]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def take(self, indices: Iterable[int]) -> List[str]:
+        """Get the strings at a list of positions
+
+        indices (Iterable[int]): Positions to look up
+
+        RETURNS (List[str]): Decoded strings
+        """
+        return [self[int(i)] for i in indices]
+
+    def to_disk(self, path: Path):
+        """Save the table as `{path}.offsets.npy` and `{path}.data.npy`
+
+        path (Path): Path prefix to save to
+        """
+        np.save(f"{path}.offsets.npy", self.offsets)
+        np.save(f"{path}.data.npy", self.data)
+
+    @classmethod
+    def from_disk(cls, path: Path, mmap: bool = True) -> "StringTable":
+        """Load a table saved with `to_disk`
+
+        path (Path): Path prefix to load from
+        mmap (bool): Memory-map the arrays instead of reading them into memory
+
+        RETURNS (StringTable): Loaded StringTable
+        """
+        mmap_mode = "r" if mmap else None
+        offsets = np.load(f"{path}.offsets.npy", mmap_mode=mmap_mode)
+        data = np.load(f"{path}.data.npy", mmap_mode=mmap_mode)
+        return cls(offsets, data)
@@ -1,10 +1,48 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+from typing import Any, Dict
+
 from pydantic import BaseModel
 
 
-class AliasCandidate(BaseModel):
+class _Record:
+    """Base class for the lightweight candidate records used in the
+    linking hot path. Records use `__slots__` and skip validation, use
+    `to_model` to get the validated pydantic model.
+    """
+
+    __slots__ = ()
+    model = BaseModel
+
+    def dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def to_model(self) -> BaseModel:
+        """Convert to the pydantic model, e.g. for the API response
+
+        RETURNS (BaseModel): Validated pydantic model
+        """
+        return self.model(**self.dict())
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, type(self)):
+            return NotImplemented
+        return all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{n}={getattr(self, n)!r}" for n in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __getstate__(self):
+        return tuple(getattr(self, n) for n in self.__slots__)
+
+    def __setstate__(self, state):
+        for name, value in zip(self.__slots__, state):
+            setattr(self, name, value)
+
+
+class AliasCandidateModel(BaseModel):
     """A data class representing a candidate alias
     that a NER mention may be linked to.
     """
@@ -13,9 +51,45 @@ class AliasCandidate(BaseModel):
     similarity: float
 
 
-class KnowledgeBaseCandidate(BaseModel):
+class KnowledgeBaseCandidateModel(BaseModel):
     entity: str
     label: str
     similarity: float
     context_similarity: float
     alias_similarity: float
+
+
+class AliasCandidate(_Record):
+    """A candidate alias that a NER mention may be linked to.
+    Lightweight counterpart of `AliasCandidateModel`.
+    """
+
+    __slots__ = ("alias", "similarity")
+    model = AliasCandidateModel
+
+    def __init__(self, alias: str, similarity: float):
+        self.alias = alias
+        self.similarity = similarity
+
+
+class KnowledgeBaseCandidate(_Record):
+    """A candidate KnowledgeBase entity for a NER mention.
+    Lightweight counterpart of `KnowledgeBaseCandidateModel`.
+    """
+
+    __slots__ = ("entity", "label", "similarity", "context_similarity", "alias_similarity")
+    model = KnowledgeBaseCandidateModel
+
+    def __init__(
+        self,
+        entity: str,
+        label: str,
+        similarity: float,
+        context_similarity: float,
+        alias_similarity: float,
+    ):
+        self.entity = entity
+        self.label = label
+        self.similarity = similarity
+        self.context_similarity = context_similarity
+        self.alias_similarity = alias_similarity
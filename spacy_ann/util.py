@@ -1,21 +1,33 @@
 import re
-from typing import Dict, List, Tuple, Optional
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+import numpy as np
 from spacy.tokens import Doc, Span
 from .consts import stopwords, country_regions
 from .types import AliasCandidate
 from dataclasses import dataclass
-from collections import Counter
+from collections import OrderedDict, defaultdict
 import heapq
 
 
+# remove special characters
+PUNCTABLE = str.maketrans("", "", r'!"#$\()*+,:;<=>?@[\\]^_`{|}~')
+STOPWORDS_PATTERN = re.compile('|'.join(re.escape(w) for w in stopwords))
+COUNTRY_REGIONS = frozenset(country_regions)
+# https://www.ling.upenn.edu/courses/Fall_2003/ling001/penn_treebank_pos.html
+SKIP_POS = frozenset(['PART', 'ADV'])
+STOPWORD_LABELS = frozenset(['ingredient', 'sensorial', 'flavor', 'fragrance'])
+LOCATION_LABELS = frozenset(['ORG', 'GPE'])
+# shared by `get_span_text` calls with the same nlp
+_span_normalizer: Optional["MentionNormalizer"] = None
+
+
 def normalize_text(text):
-    # remove special characters
-    PUNCTABLE = str.maketrans("", "", r'!"#$\()*+,:;<=>?@[\\]^_`{|}~')
-    ascii_punc_chars = dict(
-        [it for it in PUNCTABLE.items() if chr(it[0])])
-    text = text.translate(ascii_punc_chars)
+    text = text.translate(PUNCTABLE)
     # remove space if not all english
-    if not all([ord(c) < 128 for c in text]):
+    if not text.isascii():
         text = text.replace(' ', '')
     return text
 
@@ -35,63 +47,304 @@ def get_span_text(nlp, span):
     Returns:
         span text
     """
-    # https://www.ling.upenn.edu/courses/Fall_2003/ling001/penn_treebank_pos.html
-    text = ''.join([w.text for w in span 
-                    if not (
-                        w.pos_ in ['PART', 'ADV'] or
-                        w.text in country_regions
-    )])
-    if len(text) == 0:
-        return span.text
-    elif len(text) > 3:
-        if span.label_ in ('ingredient', 'sensorial', 'flavor', 'fragrance'):
-            exc_words = stopwords
-            text = re.sub('|'.join(exc_words), '', text)
-            # replace GPE
+    global _span_normalizer
+    if _span_normalizer is None or _span_normalizer.nlp is not nlp:
+        _span_normalizer = MentionNormalizer(nlp)
+    return _span_normalizer(span)
+
+
+class MentionNormalizer:
+    """Normalize entity mentions before candidate generation, see `get_span_text`.
+
+    Stopword and region patterns are compiled once, results are memoized
+    per mention text and label, and `normalize_spans` runs the `ner` pipe
+    for all spans of a batch that need it in one `pipe` call.
+    """
+
+    def __init__(self, nlp, cache_size: int = 100000):
+        """Initialize a MentionNormalizer
+
+        nlp (Language): spaCy Language object, its `ner` pipe detects locations to remove
+        cache_size (int): Maximum number of memoized mentions, 0 disables memoization
+        """
+        self.nlp = nlp
+        self.cache = FrequencyCache(max_size=cache_size) if cache_size else None
+
+    def __call__(self, span: Span) -> str:
+        return self.normalize_spans([span])[0]
+
+    def normalize_doc(self, doc: Doc) -> List[str]:
+        """Normalize all spans returned by `get_spans` for a doc
+
+        doc (Doc): spaCy Doc
+
+        RETURNS (List[str]): Normalized text of each span
+        """
+        return self.normalize_spans(get_spans(doc))
+
+    def normalize_spans(self, spans: Sequence[Span]) -> List[str]:
+        """Normalize a batch of spans
+
+        spans (Sequence[Span]): Spans, possibly from different docs
+
+        RETURNS (List[str]): Normalized text of each span
+        """
+        results: List[Optional[str]] = [None] * len(spans)
+        pending = []
+        for i, span in enumerate(spans):
+            text = ''.join([w.text for w in span
+                            if not (w.pos_ in SKIP_POS or w.text in COUNTRY_REGIONS)])
+            if len(text) == 0:
+                results[i] = span.text
+                continue
+            key = (span.text, text, span.label_)
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                results[i] = cached
+                continue
+
             if len(text) > 3:
-                doc = nlp.get_pipe('ner')(nlp.make_doc(span.text))
-                loc_ents = [ent for ent in doc.ents if ent.label_ in ('ORG', 'GPE')]
-                for ent in loc_ents:
-                    text = text.replace(ent.text, '')
-        elif span.label_ == 'brand' and '/' in text:
-            text = text.split('/')[0]
-    text = normalize_text(text)
-    return text.strip()
+                if span.label_ in STOPWORD_LABELS:
+                    text = STOPWORDS_PATTERN.sub('', text)
+                    # replace GPE
+                    if len(text) > 3:
+                        pending.append((i, key, text))
+                        continue
+                elif span.label_ == 'brand' and '/' in text:
+                    text = text.split('/')[0]
+            results[i] = self._finish(key, text)
+
+        if pending:
+            locations = self._get_ner_locations(
+                list(dict.fromkeys(key[0] for _, key, _ in pending))
+            )
+            for i, key, text in pending:
+                for location in locations[key[0]]:
+                    text = text.replace(location, '')
+                results[i] = self._finish(key, text)
+        return results
+
+    def _finish(self, key: Tuple[str, str, str], text: str) -> str:
+        text = normalize_text(text).strip()
+        if self.cache is not None:
+            self.cache.add(key, text)
+        return text
+
+    def _get_ner_locations(self, texts: List[str]) -> Dict[str, List[str]]:
+        """Run the `ner` pipe once for a batch of texts and get their ORG/GPE entities"""
+        if not self.nlp.has_pipe('ner'):
+            return {text: [] for text in texts}
+        ner = self.nlp.get_pipe('ner')
+        docs = ner.pipe(self.nlp.make_doc(text) for text in texts)
+        return {
+            text: [ent.text for ent in doc.ents if ent.label_ in LOCATION_LABELS]
+            for text, doc in zip(texts, docs)
+        }
+
+
+def knn_to_alias_candidates(
+    mention_texts: List[str],
+    aliases: Sequence[str],
+    short_aliases: Set[str],
+    neighbors: np.ndarray,
+    similarities: np.ndarray,
+    mask: np.ndarray,
+) -> List[List[AliasCandidate]]:
+    """Materialize AliasCandidates from dense kNN results.
+    Valid neighbors of all rows are gathered at once and only sliced per mention.
+
+    mention_texts (List[str]): Queried mentions
+    aliases (Sequence[str]): Aliases indexed by ANN index position
+    short_aliases (Set[str]): Aliases too short for a TF-IDF representation
+    neighbors (np.ndarray): `(n, k)` neighbor indices
+    similarities (np.ndarray): `(n, k)` neighbor similarities
+    mask (np.ndarray): `(n, k)` validity mask of neighbors
+
+    RETURNS (List[List[AliasCandidate]]): AliasCandidates for each mention
+    """
+    offsets = np.zeros(len(mention_texts) + 1, dtype=np.int64)
+    np.cumsum(mask.sum(axis=1), out=offsets[1:])
+    valid_aliases = [aliases[i] for i in neighbors[mask].tolist()]
+    valid_similarities = similarities[mask].tolist()
+
+    batch_candidates = []
+    for row, mention in enumerate(mention_texts):
+        if mention in short_aliases:
+            batch_candidates.append([AliasCandidate(alias=mention, similarity=1.0)])
+            continue
+        start, end = offsets[row], offsets[row + 1]
+        batch_candidates.append([
+            AliasCandidate(alias=alias, similarity=similarity)
+            for alias, similarity in zip(
+                valid_aliases[start:end], valid_similarities[start:end]
+            )
+        ])
+    return batch_candidates
 
 
 @dataclass
 class CacheItem:
     candidates: List[AliasCandidate]
     frequency: int = 1
-    last_access: float = 0.0
+    size: int = 0
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+# approximate per-object overhead of an AliasCandidate besides its alias string
+CANDIDATE_OVERHEAD = 72
+
+
+def estimate_candidates_size(key: str, candidates: List[AliasCandidate]) -> int:
+    """Approximate memory footprint in bytes of a cached candidate list
+
+    key (str): Cache key
+    candidates (List[AliasCandidate]): Cached candidates
+
+    RETURNS (int): Approximate size in bytes
+    """
+    size = sys.getsizeof(key) + sys.getsizeof(candidates)
+    for candidate in candidates:
+        size += CANDIDATE_OVERHEAD + sys.getsizeof(getattr(candidate, "alias", ""))
+    return size
+
 
 class FrequencyCache:
-    def __init__(self, max_size: int = 10000):
+    """LFU cache with O(1) lookup, insert and eviction.
+
+    Keys are kept in per-frequency buckets ordered by insertion, so the
+    least frequently (and within one frequency least recently) used key
+    is always at the front of the bucket `self._min_freq`. Every
+    `aging_interval` operations all frequencies are halved so that keys
+    which were hot in the past eventually become evictable.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 10000,
+        max_bytes: Optional[int] = None,
+        aging_interval: Optional[int] = None,
+    ):
+        """Initialize a FrequencyCache
+
+        max_size (int): Maximum number of entries
+        max_bytes (Optional[int]): Maximum approximate size in bytes of all entries.
+            If None, the cache is bounded by `max_size` only.
+        aging_interval (Optional[int]): Number of operations between halving all
+            frequencies. Defaults to 10 * max_size which keeps aging amortized O(1).
+        """
         self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.aging_interval = aging_interval or max(max_size * 10, 1)
+        self.stats = CacheStats()
+        self.nbytes = 0
         self._cache: Dict[str, CacheItem] = {}
-        self._access_count = Counter()
-        
+        self._buckets: Dict[int, "OrderedDict[str, None]"] = defaultdict(OrderedDict)
+        self._min_freq = 0
+        self._ops = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._cache
+
     def get(self, key: str) -> Optional[List[AliasCandidate]]:
         """获取缓存项，并更新访问频率"""
-        if key in self._cache:
-            self._cache[key].frequency += 1
-            return self._cache[key].candidates
-        return None
+        with self._lock:
+            item = self._cache.get(key)
+            if item is None:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            self._touch(key, item)
+            self._tick()
+            return item.candidates
 
     def add(self, key: str, value: List[AliasCandidate]):
         """添加新的缓存项"""
-        if len(self._cache) >= self.max_size:
-            self._remove_least_frequent()
-        self._cache[key] = CacheItem(candidates=value)
+        size = estimate_candidates_size(key, value) if self.max_bytes else 0
+        if self.max_bytes and size > self.max_bytes:
+            return
+        with self._lock:
+            item = self._cache.get(key)
+            if item is not None:
+                self.nbytes += size - item.size
+                item.candidates = value
+                item.size = size
+                self._touch(key, item)
+            else:
+                while self._cache and (
+                    len(self._cache) >= self.max_size
+                    or (self.max_bytes and self.nbytes + size > self.max_bytes)
+                ):
+                    self._remove_least_frequent()
+                self._cache[key] = CacheItem(candidates=value, size=size)
+                self._buckets[1][key] = None
+                self._min_freq = 1
+                self.nbytes += size
+            self._tick()
+
+    def clear(self):
+        """清空缓存，保留统计信息"""
+        with self._lock:
+            self._cache.clear()
+            self._buckets.clear()
+            self._min_freq = 0
+            self.nbytes = 0
+
+    def _touch(self, key: str, item: CacheItem):
+        """将缓存项移动到下一个频率桶"""
+        bucket = self._buckets[item.frequency]
+        del bucket[key]
+        if not bucket:
+            del self._buckets[item.frequency]
+            if self._min_freq == item.frequency:
+                self._min_freq += 1
+        item.frequency += 1
+        self._buckets[item.frequency][key] = None
+
+    def _tick(self):
+        """计数操作次数，定期对所有频率做衰减"""
+        self._ops += 1
+        if self._ops >= self.aging_interval:
+            self._ops = 0
+            self._age()
+
+    def _age(self):
+        """所有频率减半，使过去的热点项最终可以被淘汰"""
+        buckets: Dict[int, "OrderedDict[str, None]"] = defaultdict(OrderedDict)
+        for freq in sorted(self._buckets):
+            new_freq = max(1, freq // 2)
+            for key in self._buckets[freq]:
+                self._cache[key].frequency = new_freq
+                buckets[new_freq][key] = None
+        self._buckets = buckets
+        self._min_freq = min(buckets) if buckets else 0
 
     def _remove_least_frequent(self):
         """移除访问频率最低的项"""
         if not self._cache:
             return
-        
-        # 找到频率最低的项
-        min_freq_item = min(self._cache.items(), key=lambda x: x[1].frequency)
-        self._cache.pop(min_freq_item[0])
+        bucket = self._buckets[self._min_freq]
+        key, _ = bucket.popitem(last=False)
+        if not bucket:
+            del self._buckets[self._min_freq]
+            self._min_freq = min(self._buckets) if self._buckets else 0
+        item = self._cache.pop(key)
+        self.nbytes -= item.size
+        self.stats.evictions += 1
 
     def get_most_frequent(self, n: int = 10) -> List[Tuple[str, int]]:
         """获取访问频率最高的n个项"""
@@ -100,3 +353,62 @@ class FrequencyCache:
             [(k, v.frequency) for k, v in self._cache.items()],
             key=lambda x: x[1]
         )
+
+
+class LRUCache:
+    """LRU cache with an optional time-to-live per entry.
+
+    Entries are kept in access order, the least recently used entry is
+    evicted when the cache is full and entries older than `ttl` seconds
+    are treated as misses.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: Optional[float] = None):
+        """Initialize a LRUCache
+
+        max_size (int): Maximum number of entries
+        ttl (Optional[float]): Seconds an entry stays valid, None keeps entries until evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._cache: "OrderedDict[Any, Tuple[Any, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self._cache
+
+    def get(self, key: Any) -> Optional[Any]:
+        """获取缓存项，过期的项视为未命中"""
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is not None and self.ttl is not None:
+                if time.monotonic() - entry[1] > self.ttl:
+                    del self._cache[key]
+                    entry = None
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            self.stats.hits += 1
+            self._cache.move_to_end(key)
+            return entry[0]
+
+    def add(self, key: Any, value: Any):
+        """添加或更新缓存项"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+            elif len(self._cache) >= self.max_size:
+                self._cache.popitem(last=False)
+                self.stats.evictions += 1
+            self._cache[key] = (value, time.monotonic())
+
+    def clear(self):
+        """清空缓存，保留统计信息"""
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,37 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import numpy as np
+from spacy.kb import InMemoryLookupKB
+
+from spacy_ann.alias_table import AliasEntityTable, rank_entities
+
+
+def test_alias_entity_table(nlp, entities, aliases):
+    kb = InMemoryLookupKB(vocab=nlp.vocab, entity_vector_length=1)
+    for e in entities:
+        kb.add_entity(e["id"], 100, [0.0])
+    for a in aliases:
+        n_ents = len(a["entities"])
+        kb.add_alias(alias=a["alias"], entities=a["entities"], probabilities=[1.0 / n_ents] * n_ents)
+
+    table = AliasEntityTable.from_kb(kb, {"a5": "SKILL"})
+    rows = np.array([table.alias_rows["NLP"], table.alias_rows["OS"]])
+    sources, entity_ids = table.expand(rows)
+
+    assert sources.tolist() == [0, 0, 1]
+    assert [table.entities[i] for i in entity_ids] == ["a3", "a4", "a5"]
+    assert [table.labels[i] for i in table.entity_labels[entity_ids]] == ["", "", "SKILL"]
+
+
+def test_rank_entities():
+    segments = np.array([0, 0, 0, 1, 1])
+    entity_ids = np.array([3, 4, 3, 5, 6])
+    similarities = np.array([0.5, 0.8, 0.9, 0.7, 0.7])
+    labels = np.array([0, 0, 0, 0, 1])
+
+    order, offsets = rank_entities(segments, entity_ids, similarities, labels, 3)
+
+    # best candidate per entity, ranked by similarity then label
+    assert order.tolist() == [2, 1, 4, 3]
+    assert offsets.tolist() == [0, 2, 4, 4]
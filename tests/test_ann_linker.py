@@ -29,4 +29,59 @@ def test_ann_linker_with_discriminate(trained_linker):
     doc = nlp("NLP is a highly researched subset of machine learning.")
     ents = list(doc.ents)
     assert len(ents) == 1
-    assert ents[0].kb_id_ == "a1"
\ No newline at end of file
+    assert ents[0].kb_id_ == "a1"
+
+def test_ann_linker_pipe(trained_linker):
+    nlp = trained_linker
+    ruler = nlp.add_pipe("entity_ruler", before="ann_linker")
+    patterns = [
+        {"label": "SKILL", "pattern": alias}
+        for alias in ["NLP", "researched", "machine learning"]
+    ]
+    ruler.add_patterns(patterns)
+
+    texts = [
+        "NLP is a highly researched subset of machine learning.",
+        "machine learning is not NLP.",
+    ]
+    expected = [[ent.kb_id_ for ent in nlp(text).ents] for text in texts]
+    docs = list(nlp.pipe(texts, batch_size=2))
+
+    assert [[ent.kb_id_ for ent in doc.ents] for doc in docs] == expected
+    assert [ent.kb_id_ for ent in docs[1].ents] == ["a1", "a3"]
+
+
+def test_ann_linker_tagging_pipes(trained_linker):
+    ann_linker = trained_linker.get_pipe("ann_linker")
+    tagging_pipes = ann_linker.get_tagging_pipes()
+
+    assert "tagger" in tagging_pipes
+    assert "parser" not in tagging_pipes
+    assert "ann_linker" not in tagging_pipes
+
+
+def test_ann_linker_partitions(trained_linker, tmp_path):
+    nlp = trained_linker
+    ann_linker = nlp.get_pipe("ann_linker")
+    ent_label_map = {entity: "SKILL" for entity in ann_linker.kb.get_entity_strings()}
+    ent_label_map.update({"a1": "ORG", "a2": "ORG"})
+    ann_linker.set_entity_lables(ent_label_map)
+    partitions = ann_linker.fit_partitions()
+    assert set(partitions) == {"ORG", "SKILL"}
+    assert set(partitions["ORG"].aliases) == {"Meta Language", "Machine learning", "ML", "AI"}
+    assert "ML" not in partitions["SKILL"].aliases
+
+    ruler = nlp.add_pipe("entity_ruler", before="ann_linker")
+    ruler.add_patterns([
+        {"label": "SKILL", "pattern": "NLP"},
+        {"label": "ORG", "pattern": "machine learning"},
+        {"label": "PRODUCT", "pattern": "researched"},
+    ])
+    text = "NLP is a highly researched subset of machine learning."
+    expected = ["a3", "a15", "a1"]
+    assert [ent.kb_id_ for ent in nlp(text).ents] == expected
+
+    nlp.to_disk(tmp_path)
+    ann_linker.from_disk(tmp_path / "ann_linker")
+    assert ann_linker.label_groups == {"ORG": ["ORG"], "SKILL": ["SKILL"]}
+    assert [ent.kb_id_ for ent in nlp(text).ents] == expected
@@ -4,7 +4,8 @@
 from pathlib import Path
 
 import srsly
-from spacy_ann.api.app import app
+from spacy_ann.api.app import LinkingOptions, app, link_batch
+from spacy_ann.api.types import LinkingRecord
 from starlette.requests import Request
 from starlette.testclient import TestClient
 from fastapi import FastAPI
@@ -52,3 +53,142 @@ def test_link(trained_linker):
     for doc in data["documents"]:
         for span in doc["spans"]:
             assert "id" in span
+
+
+def test_link_batch(trained_linker):
+    app = create_test_app(trained_linker)
+    client = TestClient(app)
+
+    request = {
+        "documents": [
+            {
+                "context": "NLP is a highly researched subset of Machine learning.",
+                "spans": [{"text": "NLP", "start": 0, "end": 3, "label": "SKILL"}],
+            },
+            {
+                "context": "Machine learning, NLP",
+                # the first span doesn't map to tokens and is skipped
+                "spans": [
+                    {"text": "x", "start": 3, "end": 4, "label": "SKILL"},
+                    {"text": "NLP", "start": 18, "end": 21, "label": "SKILL"},
+                ],
+            },
+        ]
+    }
+    res = client.post("/link", json=request)
+    assert res.status_code == 200
+
+    documents = res.json()["documents"]
+    assert [span["id"] for span in documents[0]["spans"]] == ["a3"]
+    assert [span["id"] for span in documents[1]["spans"]] == [None, "a3"]
+
+
+def test_link_batch_options(trained_linker):
+    ann_linker = trained_linker.get_pipe("ann_linker")
+    pipe_calls = []
+    pipe = ann_linker.pipe
+
+    def counting_pipe(docs, **kwargs):
+        pipe_calls.append(kwargs.get("threshold"))
+        return pipe(docs, **kwargs)
+
+    ann_linker.pipe = counting_pipe
+    documents = [
+        LinkingRecord(
+            context="NLP is a highly researched subset of Machine learning.",
+            spans=[{"text": "NLP", "start": 0, "end": 3, "label": "SKILL"}],
+        )
+    ]
+    responses = link_batch(
+        trained_linker,
+        [
+            (documents, LinkingOptions()),
+            (documents, LinkingOptions(max_candidates=0, include_context=False)),
+            (documents, LinkingOptions(max_candidates=1)),
+            (documents, LinkingOptions(similarity_threshold=0.99)),
+        ],
+    )
+    # only the threshold splits the batch, the other options format the responses
+    assert pipe_calls == [None, 0.99]
+    assert [r["documents"][0]["spans"][0]["id"] for r in responses] == ["a3"] * 4
+    assert "context" in responses[0]["documents"][0]
+    assert "context" not in responses[1]["documents"][0]
+    assert "kb_candidates" not in responses[1]["documents"][0]["spans"][0]
+    assert len(responses[2]["documents"][0]["spans"][0]["kb_candidates"]) <= 1
+
+
+def test_link_threshold(trained_linker):
+    app = create_test_app(trained_linker)
+    client = TestClient(app)
+
+    request = {
+        "documents": [
+            {
+                "context": "NLP is a highly researched subset of Machine learning.",
+                "spans": [{"text": "researched", "start": 16, "end": 26, "label": "SKILL"}],
+            }
+        ]
+    }
+    ids = []
+    for threshold in (0.5, 0.99):
+        res = client.post("/link", json=request, params={"similarity_threshold": threshold})
+        ids.append(res.json()["documents"][0]["spans"][0]["id"])
+    assert ids == ["a15", ""]
+
+    # without the parameter the threshold of the ann_linker pipe applies
+    trained_linker.get_pipe("ann_linker").threshold = 0.99
+    res = client.post("/link", json=request)
+    assert res.json()["documents"][0]["spans"][0]["id"] == ""
+
+
+def test_link_response_schema():
+    schema = TestClient(app).get("/openapi.json").json()["components"]["schemas"]
+    assert "context" not in schema["LinkingResponseRecord"].get("required", [])
+    assert "context" in schema["LinkingRecord"]["required"]
+
+
+def test_candidates(trained_linker):
+    app = create_test_app(trained_linker)
+    client = TestClient(app)
+
+    request = {"texts": ["NLP", "Machine learning"], "labels": ["SKILL", "SKILL"]}
+    res = client.post("/candidates", json=request)
+    assert res.status_code == 200
+
+    data = res.json()
+    assert data["ids"] == ["a3", "a1"]
+    assert len(data["offsets"]) == 3
+    assert len(data["entities"]) == len(data["similarities"]) == data["offsets"][-1]
+
+    res = client.post("/candidates", json={"texts": ["NLP"], "labels": []})
+    assert res.status_code == 422
+
+
+def test_link_wire_format(trained_linker):
+    app = create_test_app(trained_linker)
+    client = TestClient(app)
+
+    example_request = srsly.read_json(
+        Path(__file__).parent.parent / "spacy_ann/api/example_request.json"
+    )
+
+    res = client.post(
+        "/link",
+        json=example_request,
+        params={"include_candidates": "false", "include_context": "false"},
+        headers={"Accept": "application/msgpack"},
+    )
+    assert res.status_code == 200
+    assert res.headers["content-type"] == "application/msgpack"
+
+    data = srsly.msgpack_loads(res.content)
+    for doc in data["documents"]:
+        assert "context" not in doc
+        for span in doc["spans"]:
+            assert "id" in span
+            assert "kb_candidates" not in span
+
+    res = client.post("/link", json=example_request, params={"max_candidates": 1})
+    for doc in res.json()["documents"]:
+        for span in doc["spans"]:
+            assert len(span["kb_candidates"]) <= 1
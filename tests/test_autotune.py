@@ -0,0 +1,55 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import pytest
+
+from spacy_ann.autotune import TuningPoint, autotune, pareto_front, select_point
+from spacy_ann.benchmark import generate_aliases, generate_mentions
+from spacy_ann.candidate_generator import CandidateGenerator
+
+POINTS = [
+    TuningPoint(10, 0.80, 0.1),
+    TuningPoint(20, 0.90, 0.2),
+    TuningPoint(40, 0.85, 0.3),
+    TuningPoint(80, 0.99, 0.5),
+]
+
+
+def test_select_point():
+    assert [p.ef_search for p in pareto_front(POINTS)] == [10, 20, 80]
+    assert select_point(POINTS, recall_target=0.9).ef_search == 20
+    assert select_point(POINTS, recall_target=0.999).ef_search == 80
+    assert select_point(POINTS, recall_target=None, latency_budget_ms=0.4).ef_search == 20
+    assert select_point(POINTS, recall_target=0.95, latency_budget_ms=0.4).ef_search == 20
+    assert select_point(POINTS, latency_budget_ms=0.01).ef_search == 10
+
+
+def test_autotune():
+    aliases = generate_aliases(500)
+    cg = CandidateGenerator(
+        k=3, m_parameter=8, ef_construction=20, n_threads=2, index_type="hnsw"
+    )
+    cg.fit(aliases)
+    report = autotune(
+        cg,
+        generate_mentions(aliases, 100),
+        recall_target=0.9,
+        ef_values=(5, 50, 500),
+        tune_build=True,
+        m_values=(8, 16),
+        ef_construction_values=(20,),
+        sample_size=200,
+    )
+    assert cg.ef_search == report["ef_search"]["ef_search"]
+    assert report["ef_search"]["recall"] >= 0.9
+    assert len(report["ef_search_points"]) == 3
+    assert len(report["build_points"]) == 2
+    assert cg.m_parameter == report["build"]["m_parameter"]
+
+
+@pytest.mark.parametrize("params", [{}, {"index_type": "hnsw", "backend": "dense"}])
+def test_autotune_without_ef_search(params):
+    aliases = generate_aliases(200)
+    cg = CandidateGenerator(k=3, **params).fit(aliases)
+    with pytest.raises(ValueError):
+        autotune(cg, generate_mentions(aliases, 20))
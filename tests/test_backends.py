@@ -0,0 +1,165 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import numpy as np
+import pytest
+import scipy
+from sklearn.preprocessing import normalize
+
+from spacy_ann.backends import BACKENDS, AnnIndex, get_backend
+from spacy_ann.brute_force import BruteForceIndex
+from spacy_ann.dense import (
+    DenseIndex,
+    DenseProjection,
+    fit_inverted_lists,
+    quantize,
+    rescore,
+)
+
+PARAMS = {
+    "m_parameter": 16,
+    "ef_construction": 100,
+    "ef_search": 100,
+    "n_threads": 1,
+    "n_shards": 1,
+}
+
+
+@pytest.fixture()
+def alias_tfidfs():
+    return normalize(
+        scipy.sparse.random(200, 60, density=0.1, random_state=0, format="csr", dtype=np.float32)
+    )
+
+
+@pytest.fixture()
+def vectors(alias_tfidfs):
+    return alias_tfidfs[:10] + normalize(
+        scipy.sparse.random(10, 60, density=0.05, random_state=1, format="csr", dtype=np.float32)
+    )
+
+
+def test_get_backend():
+    assert {"nmslib", "brute_force", "hnswlib", "dense"} <= set(BACKENDS)
+    assert get_backend("hnswlib", n_components=32).n_components == 32
+    with pytest.raises(ValueError):
+        get_backend("annoy")
+    with pytest.raises(ValueError):
+        get_backend("dense", dtype="int4")
+
+
+@pytest.mark.parametrize(
+    "name,params",
+    [
+        ("nmslib", {}),
+        ("brute_force", {}),
+        ("dense", {"n_components": 16}),
+        ("dense", {"n_components": 16, "dtype": "float16", "rescore": False}),
+        ("dense", {"n_components": 16, "n_lists": 8, "n_probe": 8}),
+    ],
+)
+def test_backend_save_load(name, params, alias_tfidfs, vectors, tmp_path):
+    backend = get_backend(name, **params)
+    index = backend.build(alias_tfidfs, PARAMS)
+    assert isinstance(index, AnnIndex) and len(index) == 200
+    expected = index.knnQueryBatch(vectors, k=3)
+    if params.get("rescore", True):
+        assert [ids[0] for ids, _ in expected] == list(range(10))
+
+    path = tmp_path / "ann_index.bin"
+    cfg = backend.save(index, path)
+    assert (backend.size(path) > 0) == (name != "brute_force")
+    loaded = backend.load(path, alias_tfidfs, cfg)
+    for (ids, dists), (expected_ids, expected_dists) in zip(
+        loaded.knnQueryBatch(vectors, k=3), expected
+    ):
+        np.testing.assert_array_equal(ids, expected_ids)
+        np.testing.assert_allclose(dists, expected_dists, atol=1e-6)
+
+
+def test_dense_projection_rescore(alias_tfidfs, vectors, tmp_path):
+    projection = DenseProjection.fit(alias_tfidfs, n_components=16)
+    dense = projection.transform(alias_tfidfs)
+    assert dense.shape == (200, 16) and dense.dtype == np.float32
+    np.testing.assert_allclose(np.linalg.norm(dense, axis=1), 1.0, rtol=1e-5)
+    projection.to_disk(tmp_path / "projection.npy")
+    loaded = DenseProjection.from_disk(tmp_path / "projection.npy")
+    np.testing.assert_array_equal(loaded.components, projection.components)
+
+    exact_neighbors, exact_similarities = BruteForceIndex(alias_tfidfs).knn(vectors, 3)
+    candidates = np.hstack([exact_neighbors[:, ::-1], np.zeros((10, 2), dtype=np.int32) + 199])
+    neighbors, similarities = rescore(alias_tfidfs, vectors, candidates, 3)
+    np.testing.assert_array_equal(neighbors, exact_neighbors)
+    np.testing.assert_allclose(similarities, exact_similarities, rtol=1e-5)
+
+
+def test_hnswlib_backend(alias_tfidfs, vectors, tmp_path):
+    pytest.importorskip("hnswlib")
+    backend = get_backend("hnswlib", n_components=32)
+    index = backend.build(alias_tfidfs, PARAMS)
+    assert isinstance(index, AnnIndex) and len(index) == 200
+    results = index.knnQueryBatch(vectors, k=3)
+    assert [ids[0] for ids, _ in results] == list(range(10))
+
+    path = tmp_path / "ann_index.bin"
+    cfg = backend.save(index, path)
+    loaded = backend.load(path, alias_tfidfs, {**cfg, "ef_search": 100})
+    for (ids, _), (expected_ids, _) in zip(loaded.knnQueryBatch(vectors, k=3), results):
+        np.testing.assert_array_equal(ids, expected_ids)
+
+
+def test_quantize():
+    dense = DenseProjection.fit(
+        normalize(scipy.sparse.random(50, 30, density=0.3, random_state=0, format="csr")), 8
+    ).transform(normalize(scipy.sparse.random(50, 30, density=0.3, random_state=1, format="csr")))
+    vectors, scales = quantize(dense, "int8")
+    assert vectors.dtype == np.int8 and np.abs(vectors).max() == 127
+    np.testing.assert_allclose(vectors * scales[:, None], dense, atol=0.01)
+    vectors, scales = quantize(dense, "float16")
+    assert vectors.dtype == np.float16 and scales is None
+
+
+def test_dense_index(alias_tfidfs, vectors):
+    projection = DenseProjection.fit(alias_tfidfs, n_components=32)
+    dense = projection.transform(alias_tfidfs)
+    index = DenseIndex(*quantize(dense, "float32"), projection, max_chunk_cells=64)
+    neighbors, similarities = index.knn_dense(projection.transform(vectors), 5)
+    expected = projection.transform(vectors) @ dense.T
+    np.testing.assert_allclose(similarities, -np.sort(-expected, axis=1)[:, :5], rtol=1e-5)
+
+    exact_neighbors, exact_similarities = BruteForceIndex(alias_tfidfs).knn(vectors, 3)
+    index = DenseIndex(*quantize(dense, "int8"), projection, alias_tfidfs, rescore_factor=20)
+    for (ids, dists), row_neighbors, row_similarities in zip(
+        index.knnQueryBatch(vectors, k=3), exact_neighbors, exact_similarities
+    ):
+        np.testing.assert_array_equal(ids, row_neighbors)
+        np.testing.assert_allclose(1.0 - dists, row_similarities, rtol=1e-5)
+
+
+def test_inverted_lists(alias_tfidfs, vectors):
+    projection = DenseProjection.fit(alias_tfidfs, n_components=32)
+    dense = projection.transform(alias_tfidfs)
+    centroids, list_rows, list_offsets = fit_inverted_lists(dense, 8)
+    assert centroids.shape == (8, 32) and list_offsets[-1] == 200
+    assert sorted(list_rows.tolist()) == list(range(200))
+
+    queries = projection.transform(vectors)
+    # probing every list finds the same neighbors as the scan
+    scan = DenseIndex(*quantize(dense, "float32"), projection)
+    index = DenseIndex(
+        *quantize(dense[list_rows], "float32"),
+        projection,
+        centroids=centroids,
+        list_rows=list_rows,
+        list_offsets=list_offsets,
+        n_probe=8,
+    )
+    neighbors, similarities = index.knn_dense(queries, 5)
+    expected_neighbors, expected_similarities = scan.knn_dense(queries, 5)
+    np.testing.assert_array_equal(neighbors, expected_neighbors)
+    np.testing.assert_allclose(similarities, expected_similarities, rtol=1e-5)
+
+    # lists are added until they hold k vectors
+    index.n_probe = 1
+    neighbors, _ = index.knn_dense(queries, 100)
+    assert neighbors.shape == (10, 100) and (neighbors >= 0).all()
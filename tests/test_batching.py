@@ -0,0 +1,36 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import asyncio
+
+from spacy_ann.api.batching import Histogram, MicroBatcher
+
+
+def test_histogram():
+    histogram = Histogram([1, 10])
+    for value in [0.5, 5, 50]:
+        histogram.observe(value)
+
+    assert histogram.to_dict() == {
+        "buckets": {"1": 1, "10": 2, "+Inf": 3},
+        "count": 3,
+        "sum": 55.5,
+    }
+
+
+def test_micro_batcher():
+    batches = []
+
+    def process_batch(items):
+        batches.append(items)
+        return [item.upper() for item in items]
+
+    batcher = MicroBatcher(process_batch, max_batch_size=3, max_wait_ms=50)
+
+    async def submit_all():
+        return await asyncio.gather(*[batcher.submit(item) for item in "abcd"])
+
+    assert asyncio.run(submit_all()) == ["A", "B", "C", "D"]
+    # the first batch is flushed by size, the rest by the timer
+    assert batches == [["a", "b", "c"], ["d"]]
+    assert batcher.stats()["batch_size"]["count"] == 2
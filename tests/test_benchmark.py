@@ -0,0 +1,56 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import numpy as np
+
+from spacy_ann.benchmark import (
+    exact_knn,
+    generate_aliases,
+    generate_mentions,
+    recall_at_k,
+    run_benchmark,
+)
+from spacy_ann.candidate_generator import CandidateGenerator
+
+
+def test_generate_aliases():
+    aliases = generate_aliases(500, seed=1)
+    assert len(aliases) == len(set(aliases)) == 500
+    assert aliases == generate_aliases(500, seed=1)
+    mentions = generate_mentions(aliases, 100, noise=0.0)
+    assert set(mentions) <= set(aliases)
+
+
+def test_exact_knn_and_recall(aliases):
+    cg = CandidateGenerator(ef_construction=200, n_threads=2)
+    cg.fit([a["alias"] for a in aliases])
+    vectors = cg.vectorizer.transform(["researched", "machine learnin", "!!"])
+    neighbors, similarities = exact_knn(cg.alias_tfidfs, vectors, 3)
+
+    dense = (vectors @ cg.alias_tfidfs.T).toarray()
+    np.testing.assert_allclose(similarities, -np.sort(-dense, axis=1)[:, :3], rtol=1e-6)
+    assert cg.aliases[neighbors[0, 0]] == "Research"
+    assert cg.aliases[neighbors[1, 0]] == "Machine learning"
+
+    mask = np.ones_like(similarities, dtype=bool)
+    assert recall_at_k(similarities, mask, similarities) == 1.0
+    mask[:, 1:] = False
+    assert recall_at_k(similarities, mask, similarities) < 1.0
+
+
+def test_run_benchmark(tmp_path):
+    aliases = generate_aliases(300)
+    mentions = generate_mentions(aliases, 40)
+    result = run_benchmark(
+        aliases,
+        tmp_path / "cg",
+        {"k": 3, "ef_construction": 50, "n_threads": 2},
+        mentions,
+        [1, 16],
+    )
+    assert result["n_aliases"] == 300
+    assert result["fit"]["seconds"] > 0 and result["fit"]["peak_rss_mb"] > 0
+    assert result["disk"]["bytes"] > 0
+    assert [q["batch_size"] for q in result["query"]] == [1, 16]
+    assert set(result["query"][0]["latency_ms"]) == {"p50", "p95", "p99"}
+    assert result["recall"]["recall_at_k"] > 0.9
@@ -0,0 +1,38 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import numpy as np
+import scipy
+from sklearn.preprocessing import normalize
+
+from spacy_ann.brute_force import BruteForceIndex, use_brute_force
+
+
+def test_brute_force_index():
+    rng = np.random.default_rng(0)
+    alias_tfidfs = normalize(scipy.sparse.random(50, 30, density=0.2, random_state=0, format="csr"))
+    vectors = normalize(scipy.sparse.random(7, 30, density=0.3, random_state=1, format="csr"))
+    expected = (vectors @ alias_tfidfs.T).toarray()
+
+    for max_chunk_cells in (50, 10 ** 6):
+        index = BruteForceIndex(alias_tfidfs, max_chunk_cells=max_chunk_cells)
+        neighbors, similarities = index.knn(vectors, 4)
+        assert neighbors.shape == similarities.shape == (7, 4)
+        np.testing.assert_allclose(
+            similarities, -np.sort(-expected, axis=1)[:, :4], rtol=1e-6
+        )
+        np.testing.assert_allclose(
+            np.take_along_axis(expected, neighbors, axis=1), similarities, rtol=1e-6
+        )
+
+    neighbors, _ = BruteForceIndex(alias_tfidfs[:3]).knn(vectors, 10)
+    assert neighbors.shape == (7, 3)
+    ids, distances = BruteForceIndex(alias_tfidfs).knnQueryBatch(vectors, k=2)[0]
+    assert len(ids) == len(distances) == 2
+
+
+def test_use_brute_force():
+    assert use_brute_force(1000)
+    assert use_brute_force(100000)
+    assert not use_brute_force(200000)
+    assert not use_brute_force(10 ** 7, max_aliases=10 ** 6)
@@ -0,0 +1,217 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import joblib
+import numpy as np
+import pytest
+import scipy
+import srsly
+
+from spacy_ann.brute_force import BruteForceIndex
+from spacy_ann.candidate_generator import CandidateGenerator, convert_to_v2
+from spacy_ann.exact_aliases import ExactAliasIndex
+
+
+@pytest.fixture()
+def fitted_cg(aliases):
+    cg = CandidateGenerator(ef_construction=200, n_threads=2, index_type="hnsw")
+    return cg.fit([a["alias"] for a in aliases])
+
+
+def candidate_tuples(batch_candidates):
+    return [
+        [(c.alias, round(c.similarity, 5)) for c in candidates]
+        for candidates in batch_candidates
+    ]
+
+
+MENTIONS = ["researched", "NLP", "machine learnin", "!!"]
+
+
+def test_candidate_generator(fitted_cg):
+    batch_candidates = fitted_cg(MENTIONS)
+    assert batch_candidates[0][0].alias == "Research"
+    assert batch_candidates[1][0].alias == "NLP"
+    assert batch_candidates[1][0].similarity == 1.0
+    assert batch_candidates[2][0].alias == "Machine learning"
+
+
+def test_to_from_disk(fitted_cg, tmp_path):
+    fitted_cg.to_disk(tmp_path)
+    assert srsly.read_json(tmp_path / "cg_cfg")["format_version"] == 2
+
+    cg = CandidateGenerator().from_disk(tmp_path)
+    assert candidate_tuples(cg(MENTIONS)) == candidate_tuples(fitted_cg(MENTIONS))
+
+
+def test_convert_to_v2(fitted_cg, tmp_path):
+    # write the legacy format version 1 layout
+    srsly.write_json(tmp_path / "cg_cfg", {"k": fitted_cg.k})
+    srsly.write_json(tmp_path / "aliases.json", list(fitted_cg.aliases))
+    srsly.write_json(tmp_path / "short_aliases.json", list(fitted_cg.short_aliases))
+    fitted_cg.ann_index.saveIndex(str(tmp_path / "ann_index.bin"))
+    joblib.dump(fitted_cg.vectorizer, tmp_path / "tfidf_vectorizer.joblib")
+    scipy.sparse.save_npz(tmp_path / "tfidf_vectors_sparse.npz", fitted_cg.alias_tfidfs)
+
+    expected = candidate_tuples(fitted_cg(MENTIONS))
+    assert candidate_tuples(CandidateGenerator().from_disk(tmp_path)(MENTIONS)) == expected
+
+    convert_to_v2(tmp_path, remove_legacy=True)
+    assert not (tmp_path / "aliases.json").exists()
+    assert (tmp_path / "cg" / "exact_aliases.keys.npy").exists()
+    assert candidate_tuples(CandidateGenerator().from_disk(tmp_path)(MENTIONS)) == expected
+
+
+def test_knn_with_zero_vectors(fitted_cg):
+    n_aliases = len(fitted_cg.aliases)
+    vectors = fitted_cg.vectorizer.transform(["", "research"])
+    neighbors, similarities, mask = fitted_cg._nmslib_knn_with_zero_vectors(
+        vectors, n_aliases + 5
+    )
+
+    assert neighbors.shape == similarities.shape == mask.shape == (2, n_aliases + 5)
+    assert neighbors.dtype == np.int32 and similarities.dtype == np.float32
+    assert mask.sum(axis=1).tolist() == [0, n_aliases]
+    assert fitted_cg([""]) == [[]]
+
+
+def test_add_remove_aliases(fitted_cg, tmp_path):
+    assert fitted_cg(["deep learnin"])[0][0].alias != "Deep learning"
+    assert fitted_cg.add_aliases(["Deep learning", "NLP"]) == 1
+    assert fitted_cg(["deep learnin"])[0][0].alias == "Deep learning"
+    # like in `fit`, short aliases are matched exactly even with an empty TF-IDF vector
+    assert fitted_cg.add_aliases([" "]) == 1
+    assert fitted_cg([" "])[0][0].alias == " "
+    assert fitted_cg.add_aliases([" "]) == 0
+    # longer aliases with an empty TF-IDF vector can't be found
+    revision = fitted_cg.revision
+    assert fitted_cg.add_aliases(["    "]) == 0
+    assert fitted_cg.revision == revision and "    " not in fitted_cg.short_aliases
+
+    assert fitted_cg.remove_aliases(["NLP", "Deep learning"]) == 2
+    assert "NLP" not in [c.alias for c in fitted_cg(["NLP"])[0]]
+    assert "Deep learning" not in [c.alias for c in fitted_cg(["deep learnin"])[0]]
+
+    fitted_cg.add_aliases(["NLP", "Deep learning"])
+    fitted_cg.remove_aliases(["Research"])
+    expected = candidate_tuples(fitted_cg(MENTIONS + ["deep learnin"]))
+    assert "Research" not in [c.alias for c in fitted_cg(["researched"])[0]]
+
+    fitted_cg.to_disk(tmp_path)
+    cg = CandidateGenerator().from_disk(tmp_path)
+    assert candidate_tuples(cg(MENTIONS + ["deep learnin"])) == expected
+
+    cg.compact()
+    assert not cg.delta_aliases and cg.n_removed == 0
+    assert "Research" not in cg.aliases
+    assert cg(["deep learnin"])[0][0].alias == "Deep learning"
+    assert cg(["NLP"])[0][0].alias == "NLP"
+
+
+def test_sharded_fit(aliases, fitted_cg, tmp_path):
+    kb_aliases = [a["alias"] for a in aliases]
+    cg = CandidateGenerator(ef_construction=200, n_threads=2, n_shards=3, index_type="hnsw")
+    cg.fit(kb_aliases, n_processes=2)
+
+    assert cg.vectorizer.vocabulary_ == fitted_cg.vectorizer.vocabulary_
+    np.testing.assert_allclose(cg.vectorizer.idf_, fitted_cg.vectorizer.idf_)
+    assert cg.aliases == fitted_cg.aliases
+    expected = candidate_tuples(fitted_cg(MENTIONS))
+    assert candidate_tuples(cg(MENTIONS)) == expected
+
+    cg.to_disk(tmp_path)
+    assert srsly.read_json(tmp_path / "cg_cfg")["n_shards"] == 3
+    loaded = CandidateGenerator().from_disk(tmp_path)
+    assert len(loaded.ann_index.shards) == 3
+    assert len(loaded.ann_index) == len(loaded.aliases)
+    assert candidate_tuples(loaded(MENTIONS)) == expected
+
+    loaded.remove_aliases(["Research"])
+    loaded.compact()
+    assert "Research" not in [c.alias for c in loaded(["researched"])[0]]
+
+
+def test_exact_match(fitted_cg, tmp_path):
+    assert candidate_tuples(fitted_cg([" machine  LEARNING", "NLP"])) == [
+        [("Machine learning", 1.0)],
+        [("NLP", 1.0)],
+    ]
+    fitted_cg.remove_aliases(["Machine learning"])
+    assert "Machine learning" not in [c.alias for c in fitted_cg(["machine learning"])[0]]
+    fitted_cg.add_aliases(["Deep learning"])
+    assert candidate_tuples(fitted_cg(["deep learning"])) == [[("Deep learning", 1.0)]]
+
+    # the exact alias index is saved and memory-mapped on load
+    fitted_cg.to_disk(tmp_path)
+    loaded = CandidateGenerator().from_disk(tmp_path)
+    assert isinstance(loaded.exact_aliases.keys, np.memmap)
+    mentions = ["deep learning", "machine learning", " nlp"]
+    assert candidate_tuples(loaded(mentions)) == candidate_tuples(fitted_cg(mentions))
+
+    fitted_cg.exact_match = False
+    fitted_cg.cache.clear()
+    candidates = fitted_cg(["deep learning"])[0]
+    assert candidates[0].alias == "Deep learning" and len(candidates) > 1
+
+
+def test_exact_alias_index(tmp_path):
+    index = ExactAliasIndex.build(["machine learning", "nlp", "machine learning"])
+    assert index.lookup("machine learning").tolist() == [0, 2]
+    assert index.lookup("deep learning").tolist() == []
+
+    index.to_disk(tmp_path / "exact_aliases")
+    loaded = ExactAliasIndex.from_disk(tmp_path / "exact_aliases")
+    assert loaded.lookup("nlp").tolist() == [1]
+
+
+def test_brute_force(aliases, fitted_cg, tmp_path):
+    cg = CandidateGenerator().fit([a["alias"] for a in aliases])
+    assert isinstance(cg.ann_index, BruteForceIndex)
+    assert [c[0] for c in candidate_tuples(cg(MENTIONS)) if c] == [
+        c[0] for c in candidate_tuples(fitted_cg(MENTIONS)) if c
+    ]
+
+    cg.to_disk(tmp_path)
+    assert not list(tmp_path.glob("ann_index.bin*"))
+    loaded = CandidateGenerator().from_disk(tmp_path)
+    assert isinstance(loaded.ann_index, BruteForceIndex)
+    assert candidate_tuples(loaded(MENTIONS)) == candidate_tuples(cg(MENTIONS))
+
+    loaded.remove_aliases(["Research"])
+    loaded.add_aliases(["Deep learning"])
+    loaded.compact()
+    assert isinstance(loaded.ann_index, BruteForceIndex)
+    assert "Research" not in [c.alias for c in loaded(["researched"])[0]]
+    assert loaded(["deep learnin"])[0][0].alias == "Deep learning"
+
+    with pytest.raises(ValueError):
+        CandidateGenerator(index_type="annoy")
+
+
+def test_backend(aliases, fitted_cg, tmp_path):
+    fitted_cg.to_disk(tmp_path)
+    cfg = srsly.read_json(tmp_path / "cg_cfg")
+    assert cfg["backend"] == cfg["ann_index"] == "nmslib"
+    assert fitted_cg.ann_backend.size(tmp_path / "cg" / "ann_index.bin") > 0
+
+    cg = CandidateGenerator(index_type="hnsw", backend="brute_force")
+    cg.fit([a["alias"] for a in aliases])
+    assert isinstance(cg.ann_index, BruteForceIndex)
+    cg.to_disk(tmp_path)
+    assert srsly.read_json(tmp_path / "cg_cfg")["backend"] == "brute_force"
+    assert CandidateGenerator().from_disk(tmp_path).backend == "brute_force"
+
+    cg = CandidateGenerator(
+        index_type="hnsw", backend="dense", backend_params={"n_components": 32}
+    )
+    cg.fit([a["alias"] for a in aliases])
+    assert [c[0] for c in candidate_tuples(cg(MENTIONS)) if c] == [
+        c[0] for c in candidate_tuples(fitted_cg(MENTIONS)) if c
+    ]
+    cg.to_disk(tmp_path)
+    assert srsly.read_json(tmp_path / "cg_cfg")["backend_params"] == {"n_components": 32}
+    loaded = CandidateGenerator().from_disk(tmp_path)
+    assert candidate_tuples(loaded(MENTIONS)) == candidate_tuples(cg(MENTIONS))
+
+    with pytest.raises(ValueError):
+        CandidateGenerator(backend="annoy")
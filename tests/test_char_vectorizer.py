@@ -0,0 +1,50 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import numpy as np
+import pytest
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from spacy_ann.char_vectorizer import CharNgramVectorizer, make_query_vectorizer
+
+TEXTS = [
+    "Machine learning",
+    "machine  LEARNING\t",
+    "NLP",
+    "a",
+    "",
+    "   ",
+    "Déjà vu",
+    "自然语言处理",
+    "unseen zq",
+]
+
+
+@pytest.mark.parametrize(
+    "params",
+    [
+        {"ngram_range": (1, 2), "binary": True, "dtype": np.float32},
+        {"ngram_range": (2, 3)},
+        {"ngram_range": (1, 3), "norm": "l1", "sublinear_tf": True},
+        {"ngram_range": (2, 2), "use_idf": False, "lowercase": False},
+    ],
+)
+def test_char_ngram_vectorizer(aliases, params):
+    vectorizer = TfidfVectorizer(analyzer="char_wb", **params)
+    vectorizer.fit([a["alias"] for a in aliases] + TEXTS[-3:-1])
+    assert CharNgramVectorizer.supports(vectorizer)
+
+    expected = vectorizer.transform(TEXTS)
+    expected.sort_indices()
+    tfidfs = CharNgramVectorizer(vectorizer).transform(TEXTS)
+    assert tfidfs.shape == expected.shape
+    assert tfidfs.dtype == expected.dtype
+    assert tfidfs.indptr.tolist() == expected.indptr.tolist()
+    assert tfidfs.indices.tolist() == expected.indices.tolist()
+    assert tfidfs.data.tobytes() == expected.data.tobytes()
+
+
+def test_make_query_vectorizer(aliases):
+    vectorizer = TfidfVectorizer(analyzer="char", ngram_range=(1, 2))
+    vectorizer.fit([a["alias"] for a in aliases])
+    assert make_query_vectorizer(vectorizer) is vectorizer
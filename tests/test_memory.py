@@ -0,0 +1,17 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+from spacy_ann.api.memory import MB, compute_n_workers, format_memory_usage
+
+
+def test_compute_n_workers():
+    assert compute_n_workers(4, 1000 * MB, memory_budget=64000 * MB, cpu_count=32) == 8
+    assert compute_n_workers(4, 1000 * MB, memory_budget=3000 * MB, cpu_count=32) == 3
+    assert compute_n_workers(4, 1000 * MB, memory_budget=500 * MB, cpu_count=32) == 1
+    assert compute_n_workers(8, 1000 * MB, memory_budget=64000 * MB, cpu_count=2) == 1
+
+
+def test_format_memory_usage():
+    usage = {"rss": 200 * MB, "pss": 120 * MB, "shared": 150 * MB, "private": 50 * MB}
+    assert format_memory_usage(usage) == "RSS 200 MB, PSS 120 MB, shared 150 MB (75%)"
+    assert format_memory_usage({}) == "memory usage not available"
@@ -1,6 +1,13 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import spacy
+from spacy_ann.remote_ann_linker import RemoteAnnLinker
+
 
 def test_remote_ann_linker(nlp):
 
@@ -41,3 +48,190 @@ def test_remote_ann_linker_disk(nlp):
     linker = nlp.create_pipe("remote_ann_linker").from_disk("/tmp/spacy_ann")
 
     assert linker.base_url == old_base_url
+
+
+class LinkHandler(BaseHTTPRequestHandler):
+    """Links every span to its own text, after failing the first request"""
+
+    n_requests = 0
+
+    def do_POST(self):
+        LinkHandler.n_requests += 1
+        if LinkHandler.n_requests == 1:
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        documents = [
+            {"spans": [dict(span, id=span["text"]) for span in doc["spans"]]}
+            for doc in body["documents"]
+        ]
+        data = json.dumps({"documents": documents}).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_remote_ann_linker_pipe():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), LinkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "SKILL", "pattern": f"skill{i}"} for i in range(20)])
+    linker = nlp.add_pipe(
+        "remote_ann_linker",
+        config={
+            "base_url": f"http://127.0.0.1:{server.server_port}/link",
+            "backoff_factor": 0.0,
+            "max_in_flight": 3,
+        },
+    )
+    texts = [f"I know skill{i}" for i in range(20)]
+    docs = list(linker.pipe(nlp.pipe(texts, disable=["remote_ann_linker"]), batch_size=2))
+    linker.close()
+    server.shutdown()
+
+    assert [doc.text for doc in docs] == texts
+    assert [doc.ents[0].kb_id_ for doc in docs] == [f"skill{i}" for i in range(20)]
+    assert LinkHandler.n_requests == 11
+    assert isinstance(linker, RemoteAnnLinker)
+
+
+class CandidatesHandler(BaseHTTPRequestHandler):
+    """Links every mention to its own text and records the request bodies"""
+
+    bodies = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        CandidatesHandler.bodies.append((self.path, body))
+        n_mentions = len(body["texts"])
+        data = json.dumps({
+            "ids": body["texts"],
+            "offsets": [0] * (n_mentions + 1),
+            "entities": [],
+            "similarities": [],
+        }).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_remote_ann_linker_mention_mode():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), CandidatesHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "SKILL", "pattern": p} for p in ["NLP", "ML"]])
+    linker = nlp.add_pipe(
+        "remote_ann_linker",
+        config={
+            "base_url": f"http://127.0.0.1:{server.server_port}/link",
+            "mention_mode": True,
+        },
+    )
+    texts = ["NLP and ML", "ML, NLP and NLP", "nothing"]
+    docs = list(nlp.pipe(texts, batch_size=8))
+    linker.close()
+    server.shutdown()
+
+    assert [[ent.kb_id_ for ent in doc.ents] for doc in docs] == [
+        ["NLP", "ML"], ["ML", "NLP", "NLP"], []
+    ]
+    assert CandidatesHandler.bodies == [
+        ("/candidates", {"texts": ["NLP", "ML"], "labels": ["SKILL", "SKILL"], "max_candidates": 0})
+    ]
+
+
+class VersionedLinkHandler(BaseHTTPRequestHandler):
+    """Links every span to its text and the model version, records linked texts"""
+
+    model_version = "v1"
+    texts = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        documents = []
+        for doc in body["documents"]:
+            VersionedLinkHandler.texts.extend(span["text"] for span in doc["spans"])
+            documents.append({"spans": [
+                {"id": f"{span['text']}-{self.model_version}"} for span in doc["spans"]
+            ]})
+        data = json.dumps({"documents": documents}).encode("utf8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("X-Model-Version", self.model_version)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_remote_ann_linker_cache():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), VersionedLinkHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    nlp = spacy.blank("en")
+    ruler = nlp.add_pipe("entity_ruler")
+    ruler.add_patterns([{"label": "SKILL", "pattern": p} for p in ["NLP", "ML", "AI", "DL"]])
+    linker = nlp.add_pipe(
+        "remote_ann_linker",
+        config={
+            "base_url": f"http://127.0.0.1:{server.server_port}/link",
+            "cache_size": 10,
+        },
+    )
+
+    docs = list(nlp.pipe(["NLP and ML", "ML and NLP"]))
+    assert [[ent.kb_id_ for ent in doc.ents] for doc in docs] == [
+        ["NLP-v1", "ML-v1"], ["ML-v1", "NLP-v1"]
+    ]
+    assert VersionedLinkHandler.texts == ["NLP", "ML"]
+
+    doc = nlp("ML and NLP")
+    assert [ent.kb_id_ for ent in doc.ents] == ["ML-v1", "NLP-v1"]
+    assert VersionedLinkHandler.texts == ["NLP", "ML"]
+    assert linker.cache_stats.hits == 2
+
+    doc = nlp("AI and NLP")
+    assert [ent.kb_id_ for ent in doc.ents] == ["AI-v1", "NLP-v1"]
+    assert VersionedLinkHandler.texts == ["NLP", "ML", "AI"]
+
+    # a new model version reported with the next request invalidates the cache,
+    # cached mentions of the same batch are linked again with the new version
+    VersionedLinkHandler.model_version = "v2"
+    doc = nlp("NLP and DL")
+    assert [ent.kb_id_ for ent in doc.ents] == ["NLP-v2", "DL-v2"]
+    assert VersionedLinkHandler.texts == ["NLP", "ML", "AI", "DL", "NLP"]
+    doc = nlp("NLP")
+    assert [ent.kb_id_ for ent in doc.ents] == ["NLP-v2"]
+    assert VersionedLinkHandler.texts == ["NLP", "ML", "AI", "DL", "NLP"]
+
+    # the model version is checked again after `version_check_interval`,
+    # even if every mention is cached
+    VersionedLinkHandler.model_version = "v3"
+    linker.version_check_interval = 0.0
+    doc = nlp("NLP")
+    assert [ent.kb_id_ for ent in doc.ents] == ["NLP-v3"]
+    assert VersionedLinkHandler.texts == ["NLP", "ML", "AI", "DL", "NLP", "NLP"]
+
+    linker.close()
+    server.shutdown()
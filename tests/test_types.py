@@ -0,0 +1,31 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import pickle
+
+from spacy_ann.types import (
+    AliasCandidate,
+    AliasCandidateModel,
+    KnowledgeBaseCandidate,
+    KnowledgeBaseCandidateModel,
+)
+
+
+def test_alias_candidate():
+    candidate = AliasCandidate(alias="Research", similarity=0.9)
+    assert candidate == AliasCandidate("Research", 0.9)
+    assert pickle.loads(pickle.dumps(candidate)) == candidate
+    assert candidate.to_model() == AliasCandidateModel(alias="Research", similarity=0.9)
+
+
+def test_kb_candidate_to_model():
+    candidate = KnowledgeBaseCandidate(
+        entity="a15",
+        label="SKILL",
+        similarity=0.9,
+        context_similarity=0.0,
+        alias_similarity=0.9,
+    )
+    model = candidate.to_model()
+    assert isinstance(model, KnowledgeBaseCandidateModel)
+    assert model.model_dump() == candidate.dict()
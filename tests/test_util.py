@@ -0,0 +1,95 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+import time
+
+import spacy
+from spacy.tokens import Doc, Span
+
+from spacy_ann.types import AliasCandidate
+from spacy_ann.util import FrequencyCache, LRUCache, MentionNormalizer, get_span_text
+
+
+def test_frequency_cache_evicts_least_frequent():
+    cache = FrequencyCache(max_size=2)
+    cache.add("a", [])
+    cache.add("b", [])
+    assert cache.get("a") == []
+    cache.add("c", [])
+
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+    assert cache.stats.hits == 1
+    assert cache.stats.evictions == 1
+    assert cache.get("b") is None
+    assert cache.stats.misses == 1
+
+
+def test_frequency_cache_aging():
+    cache = FrequencyCache(max_size=2, aging_interval=8)
+    cache.add("a", [])
+    for _ in range(5):
+        cache.get("a")
+    cache.add("b", [])
+    cache.get("b")
+    # frequencies were halved, so `b` still loses but `a` decayed
+    assert cache.get_most_frequent(2) == [("a", 3), ("b", 1)]
+    cache.add("c", [])
+    assert "a" in cache and "b" not in cache
+
+
+def test_frequency_cache_max_bytes():
+    candidates = [AliasCandidate(alias="Research", similarity=1.0)]
+    cache = FrequencyCache(max_size=100, max_bytes=1000)
+    for i in range(20):
+        cache.add(f"mention {i}", candidates)
+
+    assert cache.nbytes <= 1000
+    assert 0 < len(cache) < 20
+    assert cache.stats.evictions == 20 - len(cache)
+
+
+def test_mention_normalizer():
+    nlp = spacy.blank("zh")
+    ruler = nlp.add_pipe("entity_ruler", name="ner")
+    ruler.add_patterns([{"label": "GPE", "pattern": "法国"}, {"label": "ORG", "pattern": "欧莱雅"}])
+
+    def make_span(words, pos, label):
+        doc = Doc(nlp.vocab, words=words, pos=pos, spaces=[False] * len(words))
+        return Span(doc, 0, len(doc), label=label)
+
+    spans = [
+        make_span(["法国", "薰衣草", "精油"], ["PROPN", "NOUN", "NOUN"], "fragrance"),
+        make_span(["欧莱雅", "玫瑰", "提取物"], ["PROPN", "NOUN", "NOUN"], "ingredient"),
+        make_span(["Brand", "A", "/", "B"], ["PROPN", "PROPN", "PUNCT", "PROPN"], "brand"),
+        make_span(["Vitamin", "(C)"], ["NOUN", "NOUN"], "ingredient"),
+    ]
+    # annotated spans don't change the normalization or its memoization
+    spans[0].doc.spans["sc"] = [Span(spans[0].doc, 0, 1, label="GPE")]
+    normalizer = MentionNormalizer(nlp)
+    expected = ["薰衣草", "玫瑰", "BrandA", "VitaminC"]
+
+    assert normalizer.normalize_spans(spans) == expected
+    assert [get_span_text(nlp, span) for span in spans] == expected
+    assert normalizer.normalize_spans(spans) == expected
+    assert normalizer.cache.stats.hits == len(spans)
+
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+    cache.add("a", 1)
+    cache.add("b", 2)
+    assert cache.get("a") == 1
+    cache.add("c", 3)
+
+    assert "b" not in cache
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+    assert (cache.stats.hits, cache.stats.misses, cache.stats.evictions) == (2, 1, 1)
+
+    cache = LRUCache(max_size=2, ttl=0.01)
+    cache.add("a", 1)
+    time.sleep(0.02)
+    assert cache.get("a") is None
+    assert len(cache) == 0